@@ -0,0 +1,202 @@
+"""
+Local stand-ins for the external services, for benchmarks and offline runs.
+
+One app serves all three under path prefixes:
+
+    /hf/models/{owner}/{model}                         Hugging Face inference API
+    /gemini/{version}/models/{model}:generateContent   Gemini (and :streamGenerateContent)
+    /off/api/v2/product/{barcode}.json                 OpenFoodFacts product API
+
+Point the app at it with
+
+    HF_API_BASE=http://127.0.0.1:8900/hf/models
+    GEMINI_API_BASE=http://127.0.0.1:8900/gemini/
+    OFF_API_BASE=http://127.0.0.1:8900/off
+
+Latency, Hugging Face cold starts (503 while "loading") and random 500s are configurable:
+
+    python -m benchmarks.fake_upstreams --port 8900 --hf-latency-ms 150 --cold-start-requests 3 --error-rate 0.01
+"""
+import re
+import json
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from dataclasses import dataclass
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from services.labels import FOOD101_LABELS, FRUIT_VEGETABLE_LABELS
+
+@dataclass
+class FakeConfig:
+    hf_latency_ms: float = 150
+    gemini_latency_ms: float = 800
+    off_latency_ms: float = 100
+    # Relative spread of the latencies, uniform in [1 - jitter, 1 + jitter]
+    jitter: float = 0.25
+    # Requests per model answered with 503 before the model counts as loaded
+    cold_start_requests: int = 0
+    # Fraction of requests (per service) answered with 500
+    error_rate: float = 0.0
+    # Fraction of barcodes OFF reports as unknown
+    off_not_found_rate: float = 0.05
+    # Number of chunks a streamed Gemini response is split into
+    stream_chunks: int = 8
+    seed: int = 0
+
+_BATCH_ITEM = re.compile(r"^\s+- (.+)$", re.MULTILINE)
+_SINGLE_ITEM = re.compile(r"breakdown for (.+?) in JSON format")
+
+def _summary(food_item: str, rng: random.Random) -> dict:
+    calories = rng.randint(20, 600)
+    return {
+        "food_item": food_item,
+        "summary": f"{food_item} is a source of energy and nutrients when eaten in moderation.",
+        "calories": f"{calories} kcal",
+        "protein": f"{rng.randint(0, 30)} g",
+        "carbohydrates": f"{rng.randint(0, 80)} g",
+        "fats": f"{rng.randint(0, 40)} g",
+        "fiber": f"{rng.randint(0, 10)} g",
+        "sugar": f"{rng.randint(0, 40)} g",
+        "health_rating": rng.choice(["Healthy", "Moderate", "Unhealthy"]),
+        "average_serving_size": "150 g",
+        "calories_per_serving": f"{int(calories * 1.5)} kcal",
+        "serving_notes": "Typical single portion.",
+    }
+
+def _gemini_response(text: str) -> dict:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 200, "candidatesTokenCount": len(text) // 4},
+        "modelVersion": "gemini-2.0-flash",
+    }
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake upstreams")
+    rng = random.Random(config.seed)
+    hf_requests = defaultdict(int)
+
+    async def delay(latency_ms: float):
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000 * rng.uniform(1 - config.jitter, 1 + config.jitter))
+
+    def failed() -> bool:
+        return config.error_rate > 0 and rng.random() < config.error_rate
+
+    @app.post("/hf/models/{owner}/{model}")
+    async def hf_inference(owner: str, model: str, request: Request):
+        await request.body()
+        name = f"{owner}/{model}"
+        hf_requests[name] += 1
+        if hf_requests[name] <= config.cold_start_requests:
+            await delay(20)
+            return JSONResponse({"error": f"Model {name} is currently loading", "estimated_time": 1.0},
+                                status_code=503, headers={"Retry-After": "0.2"})
+        await delay(config.hf_latency_ms)
+        if failed():
+            return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+        labels = FRUIT_VEGETABLE_LABELS if "fruit" in model else FOOD101_LABELS
+        scores = sorted((rng.random() for _ in range(5)), reverse=True)
+        total = sum(scores) * 1.2
+        return [{"label": label, "score": round(score / total, 4)}
+                for label, score in zip(rng.sample(labels, 5), scores)]
+
+    def _prompt_text(body: dict) -> str:
+        return "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+
+    def _generated_text(body: dict) -> str:
+        prompt = _prompt_text(body)
+        items = _BATCH_ITEM.findall(prompt)
+        if items:
+            return json.dumps([_summary(item.strip(), rng) for item in items])
+        match = _SINGLE_ITEM.search(prompt)
+        return json.dumps(_summary(match.group(1) if match else "food", rng))
+
+    @app.post("/gemini/{version}/models/{model_action}")
+    async def gemini(version: str, model_action: str, request: Request):
+        body = await request.json()
+        action = model_action.rsplit(":", 1)[-1]
+        if failed():
+            await delay(config.gemini_latency_ms / 4)
+            return JSONResponse({"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}},
+                                status_code=500)
+        text = _generated_text(body)
+
+        if action == "streamGenerateContent":
+            async def events():
+                size = max(1, len(text) // config.stream_chunks + 1)
+                for start in range(0, len(text), size):
+                    await delay(config.gemini_latency_ms / config.stream_chunks)
+                    yield f"data: {json.dumps(_gemini_response(text[start:start + size]))}\r\n\r\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await delay(config.gemini_latency_ms)
+        return _gemini_response(text)
+
+    @app.get("/off/api/v2/product/{barcode}.json")
+    async def off_product(barcode: str):
+        await delay(config.off_latency_ms)
+        if failed():
+            return JSONResponse({"status": 0, "status_verbose": "server error"}, status_code=500)
+        if rng.random() < config.off_not_found_rate:
+            return JSONResponse({"code": barcode, "status": 0, "status_verbose": "product not found"}, status_code=404)
+        return {
+            "code": barcode,
+            "status": 1,
+            "product": {
+                "product_name": f"Product {barcode}",
+                "nutriments": {
+                    "energy-kcal_100g": rng.randint(20, 600),
+                    "proteins_100g": round(rng.uniform(0, 30), 1),
+                    "fat_100g": round(rng.uniform(0, 40), 1),
+                    "carbohydrates_100g": round(rng.uniform(0, 80), 1),
+                },
+                "nutriscore_grade": rng.choice("abcde"),
+                "ingredients_text": "water, sugar, salt",
+            },
+        }
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    return app
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeConfig()
+    parser.add_argument("--hf-latency-ms", type=float, default=defaults.hf_latency_ms)
+    parser.add_argument("--gemini-latency-ms", type=float, default=defaults.gemini_latency_ms)
+    parser.add_argument("--off-latency-ms", type=float, default=defaults.off_latency_ms)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--cold-start-requests", type=int, default=defaults.cold_start_requests)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--off-not-found-rate", type=float, default=defaults.off_not_found_rate)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(
+        hf_latency_ms=args.hf_latency_ms,
+        gemini_latency_ms=args.gemini_latency_ms,
+        off_latency_ms=args.off_latency_ms,
+        jitter=args.jitter,
+        cold_start_requests=args.cold_start_requests,
+        error_rate=args.error_rate,
+        off_not_found_rate=args.off_not_found_rate,
+        seed=args.seed,
+    )
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve fake Hugging Face, Gemini and OpenFoodFacts APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Load harness for the API against the fake upstreams.
+
+Starts benchmarks.fake_upstreams and `uvicorn main:app` as subprocesses (with fresh
+cache and database files), drives each scenario with concurrent requests and writes
+p50/p95/p99 latency, throughput and per-stage timings to a JSON file:
+
+    python -m benchmarks.load run --scenarios scan,summary --requests 300 --concurrency 32
+    python -m benchmarks.load compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+import httpx
+from PIL import Image
+from benchmarks.fake_upstreams import add_arguments
+from services.labels import ALL_LABELS, FOOD101_LABELS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Scenarios: build the httpx request arguments for the i-th request
+
+def _random_images(count: int, seed: int) -> List[bytes]:
+    """Distinct noisy JPEGs, so image-cache hits only come from deliberate repeats."""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.effect_noise((640, 480), rng.uniform(32, 96)).convert("RGB")
+        img = Image.blend(img, Image.new("RGB", img.size, tuple(rng.randrange(256) for _ in range(3))), 0.5)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+def _ean13(rng: random.Random) -> str:
+    digits = [rng.randrange(10) for _ in range(12)]
+    total = sum(digit * (3 if index % 2 else 1) for index, digit in enumerate(digits))
+    return "".join(map(str, digits)) + str((10 - total % 10) % 10)
+
+def build_scenarios(images: List[bytes], seed: int) -> Dict[str, Callable[[int], dict]]:
+    rng = random.Random(seed)
+    barcodes = [_ean13(rng) for _ in range(500)]
+
+    def upload(path):
+        return lambda i: {"method": "POST", "url": path,
+                          "files": {"file": ("upload.jpg", images[i % len(images)], "image/jpeg")}}
+
+    return {
+        "scan": upload("/food-detection/scan"),
+        "food-item": upload("/food-detection/food-item"),
+        "fruit-vegetable": upload("/food-detection/fruit-vegetable"),
+        "summary": lambda i: {"method": "GET", "url": f"/ai-summary/{FOOD101_LABELS[i % len(FOOD101_LABELS)]}"},
+        "summary-batch": lambda i: {"method": "POST", "url": "/ai-summary/batch",
+                                    "json": {"items": [ALL_LABELS[(i * 10 + k) % len(ALL_LABELS)] for k in range(10)]}},
+        "nutrition": lambda i: {"method": "GET", "url": f"/nutrition/{barcodes[i % len(barcodes)]}"},
+        "nutrition-bulk": lambda i: {"method": "POST", "url": "/nutrition/bulk",
+                                     "json": {"barcodes": [barcodes[(i * 20 + k) % len(barcodes)] for k in range(20)]}},
+    }
+
+# Statistics
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(latencies: List[float], statuses: List[int], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    errors = sum(1 for status in statuses if status >= 400 or status == 0)
+    return {
+        "requests": len(statuses),
+        "errors": errors,
+        "status_counts": {str(status): count for status, count in sorted(Counter(statuses).items())},
+        "throughput_rps": round(len(statuses) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+def parse_stage_metrics(text: str) -> Dict[str, dict]:
+    """Mean time per pipeline stage from the app's /metrics output."""
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"nutrivision_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"} ")
+                target[stage] = float(value)
+    return {
+        stage: {"count": int(counts.get(stage, 0)), "mean_ms": round(sums[stage] / counts[stage] * 1000, 2)}
+        for stage in sums if counts.get(stage)
+    }
+
+# Running
+
+async def run_scenario(client: httpx.AsyncClient, build: Callable[[int], dict], requests: int,
+                       concurrency: int) -> dict:
+    latencies: List[float] = []
+    statuses: List[int] = []
+    next_index = iter(range(requests))
+
+    async def worker():
+        for index in next_index:
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(**build(index))
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies.append(time.perf_counter() - started_at)
+            statuses.append(status)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started_at)
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+def _git_commit() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+def _fake_args(args: argparse.Namespace) -> List[str]:
+    return [
+        "--hf-latency-ms", str(args.hf_latency_ms), "--gemini-latency-ms", str(args.gemini_latency_ms),
+        "--off-latency-ms", str(args.off_latency_ms), "--jitter", str(args.jitter),
+        "--cold-start-requests", str(args.cold_start_requests), "--error-rate", str(args.error_rate),
+        "--off-not-found-rate", str(args.off_not_found_rate), "--seed", str(args.seed),
+    ]
+
+def run(args: argparse.Namespace) -> dict:
+    scenarios = build_scenarios(_random_images(args.images, args.seed), args.seed)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(scenarios)})")
+
+    workdir = tempfile.mkdtemp(prefix="nutrivision-bench-")
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    env = {
+        **os.environ,
+        "HF_API_BASE": f"{fake_url}/hf/models",
+        "GEMINI_API_BASE": f"{fake_url}/gemini/",
+        "OFF_API_BASE": f"{fake_url}/off",
+        "HUGGINGFACE_TOKEN": "benchmark",
+        "GEMINI_API_KEY": "benchmark",
+        "SUMMARY_CACHE_PATH": os.path.join(workdir, "summaries.sqlite3"),
+        "OFF_INDEX_PATH": os.path.join(workdir, "off_index.sqlite3"),
+        "MEAL_LOG_PATH": os.path.join(workdir, "meal_log.sqlite3"),
+        "DATABASE_BACKEND": "sqlite",
+        "USER_DB_PATH": os.path.join(workdir, "users.sqlite3"),
+        "METRICS_ENABLED": "true",
+        "METRICS_PATH": os.path.join(workdir, "metrics.sqlite3"),
+        "METRICS_FLUSH_INTERVAL": "1",
+        "INFERENCE_BACKEND": "remote",
+    }
+
+    fake = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(args.fake_port),
+                             *_fake_args(args)], cwd=ROOT, env=env)
+    app = None
+    try:
+        _wait_ready(f"{fake_url}/health", fake)
+        app = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.app_port),
+                                "--workers", str(args.workers), "--log-level", "warning"], cwd=ROOT, env=env)
+        _wait_ready(f"{app_url}/", app)
+
+        async def drive():
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=app_url, timeout=120, limits=limits) as client:
+                endpoints = {}
+                for name in selected:
+                    print(f"[INFO] Running {name}: {args.requests} requests, concurrency {args.concurrency}")
+                    endpoints[name] = await run_scenario(client, scenarios[name], args.requests, args.concurrency)
+                # Let every worker flush its metrics to the shared store before scraping
+                await asyncio.sleep(1.5)
+                metrics = (await client.get("/metrics")).text
+            return endpoints, metrics
+
+        endpoints, metrics = asyncio.run(drive())
+    finally:
+        for process in (app, fake):
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+
+    return {
+        **_git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key != "command"},
+        "endpoints": endpoints,
+        "stages": parse_stage_metrics(metrics),
+    }
+
+def compare(base: dict, new: dict, threshold: float) -> bool:
+    """Prints p50/p95/p99 changes per endpoint; returns False if any p95 regressed beyond threshold."""
+    ok = True
+    print(f"{'endpoint':<18}{'metric':<8}{base.get('commit') or 'base':>12}{new.get('commit') or 'new':>12}{'change':>10}")
+    for name, new_stats in new["endpoints"].items():
+        base_stats = base["endpoints"].get(name)
+        if base_stats is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            before, after = base_stats[metric], new_stats[metric]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if metric == "p95_ms" and change > threshold:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"{name:<18}{metric[:-3] if metric.endswith('_ms') else 'rps':<8}{before:>12}{after:>12}{change:>+10.1%}{flag}")
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API against local fake upstreams.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the load scenarios and write a JSON result file.")
+    run_parser.add_argument("--scenarios", default="", help="Comma-separated scenario names (default: all)")
+    run_parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--images", type=int, default=50,
+                            help="Distinct images for the upload scenarios; requests beyond this repeat them")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--app-port", type=int, default=8901)
+    run_parser.add_argument("--fake-port", type=int, default=8900)
+    run_parser.add_argument("--output", help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    add_arguments(run_parser)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative p95 increase")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        result = run(args)
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{result['commit'] or 'unknown'}.json")
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        for name, stats in result["endpoints"].items():
+            print(f"{name:<18} {stats['throughput_rps']:>8} rps  p50 {stats['p50_ms']:>8} ms  "
+                  f"p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  errors {stats['errors']}")
+        print(f"[INFO] Wrote {output}")
+    elif args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        return 0 if compare(base, new, args.threshold) else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
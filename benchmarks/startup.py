@@ -0,0 +1,85 @@
+"""
+Worker boot benchmark.
+
+Measures, in fresh interpreters, how long importing `main` takes and how long the
+lifespan startup takes, and lists the slowest imports from `python -X importtime`.
+Exits with status 1 when the median boot time is over budget, so it can run in CI.
+
+    python -m benchmarks.startup --runs 5 --budget 2.0
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "2.0"))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MEASURE = """
+import time, json, asyncio
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(boot())
+print(json.dumps({"import": imported - started, "startup": ready - imported}))
+"""
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # Placeholder key so the benchmark runs without secrets; nothing is sent upstream
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    return env
+
+def measure_boot() -> dict:
+    output = subprocess.run([sys.executable, "-c", _MEASURE], cwd=ROOT, env=_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def slowest_imports(limit: int = 10) -> list:
+    """Top-level-ish modules by cumulative import time, in milliseconds."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=_env(),
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative) / 1000, name.rstrip()))
+    rows.sort(reverse=True)
+    return [{"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2, "ms": round(ms, 1)}
+            for ms, name in rows[:limit]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure worker import and startup time.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="Max median boot time in seconds")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to report")
+    args = parser.parse_args(argv)
+
+    runs = [measure_boot() for _ in range(args.runs)]
+    boot = [run["import"] + run["startup"] for run in runs]
+    result = {
+        "runs": args.runs,
+        "import_median": round(statistics.median(run["import"] for run in runs), 3),
+        "startup_median": round(statistics.median(run["startup"] for run in runs), 3),
+        "boot_median": round(statistics.median(boot), 3),
+        "boot_max": round(max(boot), 3),
+        "budget": args.budget,
+        "slowest_imports": slowest_imports(args.top),
+    }
+    print(json.dumps(result, indent=2))
+
+    if result["boot_median"] > args.budget:
+        print(f"[WARNING] Median boot time {result['boot_median']}s is over the {args.budget}s budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
 from dotenv import load_dotenv
 
+# The only place .env is read. main.py imports this module first, so settings
+# that other modules read with os.getenv at import time see the .env values too.
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -0,0 +1,21 @@
+import os
+
+# Gunicorn settings, used by the Procfile. Values can be overridden with the usual
+# GUNICORN_* / WEB_CONCURRENCY environment variables.
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, (os.cpu_count() or 1) * 2))))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app once in the master and fork workers from it, so module imports are
+# paid once and shared copy-on-write. Clients, pools and ONNX sessions are created
+# after the fork (lazily or in the lifespan hook), since none of them are fork-safe.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+def on_starting(server):
+    # google.genai is only imported when the Gemini client is first used; importing it
+    # in the master means workers do not each pay for it on their first summary.
+    if preload_app:
+        import google.genai  # noqa: F401
@@ -1,10 +1,47 @@
-from fastapi import FastAPI
+import config  # loads .env before any module reads its settings
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from routers import food_detection, nutrition, ai_summary
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import food_detection, nutrition, ai_summary, intake, user
+from services.connect_database import close_database
+from services.auth import shutdown_password_pool
+from services.http_client import close_upstream
+from services.image_preprocessing import shutdown_executor
+from services.local_inference import use_local_backend, preload_local_models
+from services.registry import registry
+from services.jobs import job_queue
+from services.food_search import start_search_index
+from services.metrics import (METRICS_ENABLED, MetricsMiddleware, render as render_metrics, start_metrics_flusher,
+                              stop_metrics_flusher)
+from services.admission import OverloadedError
+from services.rate_limit import RATE_LIMIT_MAX_WAIT, RateLimitedError
+
+# Load local models before serving traffic when the local backend is selected. Everything
+# else (Gemini client, HTTP pools, database session, bcrypt pool) is created on first use
+# and only needs releasing on shutdown.
+# Flushes this worker's metrics to the shared store; registered first so it flushes last
+registry.register("metrics", start=start_metrics_flusher, stop=stop_metrics_flusher)
+registry.register("local_models", start=preload_local_models if use_local_backend() else None)
+# Built in a background thread; lookups before it is ready wait for it off the event loop
+registry.register("search_index", start=start_search_index)
+registry.register("upstream", stop=close_upstream)
+registry.register("preprocessing", stop=shutdown_executor)
+registry.register("database", stop=close_database)
+registry.register("password_pool", stop=shutdown_password_pool)
+# Background scan workers; registered last so they stop before the clients they use
+registry.register("jobs", start=job_queue.start, stop=job_queue.stop)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await registry.start_all()
+    yield
+    await registry.stop_all()
 
 app = FastAPI(
     title="NutriVision API",
-    description="Food Recognition and Nutrition Analysis"
+    description="Food Recognition and Nutrition Analysis",
+    lifespan=lifespan
 )
 
 # List of allowed origins
@@ -25,11 +62,33 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+# Request counts, latency and the optional per-request timing log
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Shed load with a 503 the client can retry, instead of a slow timeout
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request: Request, exc: RateLimitedError):
+    return JSONResponse(status_code=429, content={"detail": str(exc)},
+                        headers={"Retry-After": str(int(RATE_LIMIT_MAX_WAIT))})
+
 # Include routers
 app.include_router(food_detection.router)
 app.include_router(nutrition.router)
 app.include_router(ai_summary.router)
+app.include_router(intake.router)
+app.include_router(user.router)
 
 @app.get("/")
 def root():
     return {"message": "Welcome to NutriVision API"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
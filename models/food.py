@@ -1,34 +1,160 @@
-from pydantic import BaseModel
+import re
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from pydantic import BaseModel, Field
 
 class FoodDetectionResponse(BaseModel):
     food_item: str
 
+class BatchSummaryRequest(BaseModel):
+    items: List[str] = Field(..., min_length=1, max_length=50)
+
+class BulkBarcodeRequest(BaseModel):
+    barcodes: List[str] = Field(..., min_length=1, max_length=100)
+
+# Fixed order of the numeric nutrient vector, values per 100g
+NUTRIENT_FIELDS = ("calories", "protein", "carbohydrates", "fats", "fiber", "sugar")
+NUTRIENT_UNITS = ("kcal", "g", "g", "g", "g", "g")
+NUTRIENT_INDEX = {field: index for index, field in enumerate(NUTRIENT_FIELDS)}
+
+# Field names used by the OpenFoodFacts service payload
+_OFF_FIELDS = {"calories": "calories", "protein": "protein", "carbohydrates": "carbs", "fats": "fats",
+               "fiber": "fiber", "sugar": "sugar"}
+
+_NUMBER = re.compile(r"(\d+(?:[.,]\d+)?)(?:\s*(?:-|–|to)\s*(\d+(?:[.,]\d+)?))?")
+
+@lru_cache(maxsize=4096)
+def parse_quantity(text: str, unit: str = "g") -> float:
+    """
+    Parses a free-text quantity such as "52 kcal", "0.3g", "2-3 g", "500 mg" or "N/A"
+    into a float in `unit` (kcal or g). Ranges become their midpoint; anything without
+    a number becomes NaN. Cached, since the label vocabulary produces few distinct strings.
+    """
+    match = _NUMBER.search(text)
+    if match is None:
+        return math.nan
+
+    low = float(match.group(1).replace(",", "."))
+    high = match.group(2)
+    value = (low + float(high.replace(",", "."))) / 2 if high else low
+
+    rest = text[match.end():].strip().lower()
+    if unit == "kcal":
+        if rest.startswith("kj"):
+            value /= 4.184
+    elif rest.startswith("mg"):
+        value /= 1000
+    elif rest.startswith("kg"):
+        value *= 1000
+    return value
+
+def _to_float(value: Any, unit: str) -> float:
+    if value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    return parse_quantity(str(value), unit)
+
+class Nutrients:
+    """
+    Compact numeric nutrient record: a fixed-order float64 vector (see NUTRIENT_FIELDS),
+    per 100g, with NaN for unknown values. Lists of records stack into a 2D array so
+    totals and scaling can be computed with NumPy in one pass.
+    """
+    __slots__ = ("values",)
+
+    def __init__(self, values: Optional[Sequence[float]] = None):
+        if values is None:
+            self.values = np.full(len(NUTRIENT_FIELDS), np.nan)
+        else:
+            self.values = np.asarray(values, dtype=np.float64)
+
+    def __getattr__(self, name: str) -> float:
+        index = NUTRIENT_INDEX.get(name)
+        if index is None:
+            raise AttributeError(name)
+        return float(self.values[index])
+
+    def __repr__(self) -> str:
+        return f"Nutrients({self.to_dict()})"
+
+    @classmethod
+    def from_gemini(cls, summary) -> "Nutrients":
+        """Parses the string fields of a Gemini NutritionSummary."""
+        return cls([_to_float(getattr(summary, field), unit) for field, unit in zip(NUTRIENT_FIELDS, NUTRIENT_UNITS)])
+
+    @classmethod
+    def from_off(cls, product: Dict[str, Any]) -> "Nutrients":
+        """Parses a get_nutrition_info payload ("N/A" for missing values)."""
+        return cls([_to_float(product.get(_OFF_FIELDS[field]), unit) for field, unit in zip(NUTRIENT_FIELDS, NUTRIENT_UNITS)])
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Nutrients":
+        return cls([_to_float(data.get(field), unit) for field, unit in zip(NUTRIENT_FIELDS, NUTRIENT_UNITS)])
+
+    def scaled(self, grams: float) -> "Nutrients":
+        """Nutrients for `grams` of the food instead of 100g."""
+        return Nutrients(self.values * (grams / 100.0))
+
+    def merged(self, other: "Nutrients") -> "Nutrients":
+        """Fills this record's unknown values from `other`."""
+        return Nutrients(np.where(np.isnan(self.values), other.values, self.values))
+
+    def missing(self) -> List[str]:
+        return [field for field, value in zip(NUTRIENT_FIELDS, self.values) if math.isnan(value)]
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        """JSON-friendly dict, rounded to 0.1, with None for unknown values."""
+        return {field: (None if math.isnan(value) else round(float(value), 1))
+                for field, value in zip(NUTRIENT_FIELDS, self.values)}
+
+def stack_nutrients(records: Sequence[Nutrients]) -> np.ndarray:
+    """Stacks records into an (n, len(NUTRIENT_FIELDS)) array."""
+    if not records:
+        return np.empty((0, len(NUTRIENT_FIELDS)))
+    return np.stack([record.values for record in records])
+
+def total_nutrients(records: Sequence[Nutrients], grams: Sequence[float]) -> Nutrients:
+    """Sum of each record scaled to its portion size; unknown values count as zero."""
+    matrix = stack_nutrients(records)
+    portions = np.asarray(grams, dtype=np.float64)[:, None] / 100.0
+    return Nutrients(np.nansum(matrix * portions, axis=0))
+
 class NutritionResponse(BaseModel):
+    """Compact numeric nutrition payload (per 100g, null when unknown)."""
     name: str
-    calories: str
-    proteins: str
-    fats: str
-    carbs: str
-
-class NutritionSummary:
-    def __init__(self, summary, calories, protein, carbohydrates, fats, fiber, sugar, health_rating):
-        self.summary = summary
-        self.calories = calories
-        self.protein = protein
-        self.carbohydrates = carbohydrates
-        self.fats = fats
-        self.fiber = fiber
-        self.sugar = sugar
-        self.health_rating = health_rating
-
-    def to_dict(self):
-        return {
-            "summary": self.summary,
-            "calories": self.calories,
-            "protein": self.protein,
-            "carbohydrates": self.carbohydrates,
-            "fats": self.fats,
-            "fiber": self.fiber,
-            "sugar": self.sugar,
-            "health_rating": self.health_rating
-        }
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    carbohydrates: Optional[float] = None
+    fats: Optional[float] = None
+    fiber: Optional[float] = None
+    sugar: Optional[float] = None
+
+    @classmethod
+    def from_nutrients(cls, name: str, nutrients: Nutrients) -> "NutritionResponse":
+        return cls(name=name, **nutrients.to_dict())
+
+class NutrientValue(BaseModel):
+    """One resolved nutrient with its provenance."""
+    value: Optional[float] = None
+    unit: str
+    # Tier the value came from, None when no source knew it
+    source: Optional[str] = None
+    # When the source last updated the value (unix time), None for static tables or unknown
+    as_of: Optional[float] = None
+
+class ResolvedNutrition(BaseModel):
+    """Per-100g nutrients merged from several sources, with field-level provenance."""
+    query: str
+    name: Optional[str] = None
+    barcode: Optional[str] = None
+    # "ok" (all fields known), "partial", "not_found" or "unavailable"
+    status: str
+    nutrients: Dict[str, NutrientValue]
+    # Sources that contributed at least one field, in the order they were consulted
+    sources: List[str]
+
+    def to_nutrients(self) -> Nutrients:
+        return Nutrients.from_dict({field: item.value for field, item in self.nutrients.items()})
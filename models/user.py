@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, Optional
+from datetime import datetime
 
 # Input model for registration and goal update
 class UserCreate(BaseModel):
@@ -24,3 +25,21 @@ class UserResponse(BaseModel):
     goal_weight: Optional[float]
     goal_type: Optional[str]
     weight_change_speed: Optional[float]
+
+# Profile fields used to compute calorie and macro targets
+class UserProfile(BaseModel):
+    gender: Optional[str] = None
+    age: Optional[int] = None
+    height_cm: Optional[float] = None
+    current_weight: Optional[float] = None
+    goal_weight: Optional[float] = None
+    goal_type: Optional[str] = None
+    weight_change_speed: Optional[float] = None
+
+# Input model for logging a meal. Nutrient values are per 100g; when omitted they are
+# looked up from the nutrition summary of `food_item`.
+class MealLogCreate(BaseModel):
+    food_item: str
+    grams: float = Field(100.0, gt=0, le=5000)
+    eaten_at: Optional[datetime] = None
+    nutrients: Optional[Dict[str, Optional[float]]] = None
@@ -1,14 +1,29 @@
 from fastapi import APIRouter
-from services.gemini import generate_summary
+from fastapi.responses import StreamingResponse
+from models.food import BatchSummaryRequest
+from services.summary_stream import stream_summary_events
+from services.summary_cache import get_summary, get_summaries, normalize_label, summary_cache
+from services.admission import admission
 
 router = APIRouter(prefix="/ai-summary", tags=["AI Summary"])
 
+@router.get("/cache/stats")
+def get_cache_stats():
+    """
+    Returns hit/miss counters for the nutrition summary cache.
+    """
+    return summary_cache.stats()
+
 @router.get("/{food_item}")
 async def get_food_summary(food_item: str):
     """
     Returns an AI-generated nutritional summary along with calories & nutrients.
     """
-    summary_data = generate_summary(food_item)
+    # Cache hits are always served; generating a summary needs an admission slot
+    summary_data = await summary_cache.get_async(food_item)
+    if summary_data is None:
+        async with admission.admit("high"):
+            summary_data = await get_summary(food_item)
     return {
         "food_item": food_item,
         "summary": summary_data.summary,
@@ -20,3 +35,34 @@ async def get_food_summary(food_item: str):
         "sugar": summary_data.sugar,
         "health_rating": summary_data.health_rating
     }
+
+@router.post("/batch")
+async def get_food_summaries(request: BatchSummaryRequest):
+    """
+    Returns AI-generated nutritional summaries for several food items in one round-trip.
+    Duplicates are resolved once, cached items are served directly and the rest are
+    generated in as few Gemini calls as possible. Batches are shed before single lookups
+    when the server is overloaded.
+    """
+    summaries, errors = await get_summaries(request.items, priority="low")
+
+    results = []
+    for item in request.items:
+        key = normalize_label(item)
+        if key in summaries:
+            results.append({"food_item": item, "status": "ok", "summary": summaries[key].model_dump()})
+        else:
+            results.append({"food_item": item, "status": "error", "error": errors.get(key, "Invalid food item")})
+    return {"results": results}
+
+@router.get("/{food_item}/stream")
+async def stream_food_summary(food_item: str):
+    """
+    Streams the nutritional summary as Server-Sent Events: the label and any known
+    macros first, then the summary text as Gemini writes it, then the final result.
+    """
+    return StreamingResponse(
+        stream_summary_events(food_item),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
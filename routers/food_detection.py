@@ -1,57 +1,281 @@
-import shutil
-import os
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from services.food_recognition import detect_food
-from services.fruit_vegetable_detector import detect_fruit_or_vegetable
-from services.gemini import generate_summary
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Literal, Optional, Tuple
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from PIL import Image
+from services.food_recognition import detect_food_async, classify_food_async
+from services.fruit_vegetable_detector import detect_fruit_or_vegetable_async, classify_fruit_or_vegetable_async
+from services.summary_cache import get_summary
+from services.image_utils import sniff_content_type
+from services.image_preprocessing import preprocess_image_async, run_in_pool
+from services.image_cache import ImageResultCache, get_image_cache, image_cache_stats, sha256_digest, dhash
+from services.metrics import span
+from services.plate import PLATE_MAX_REGIONS, analyze_plate
+from services.admission import admission, OverloadedError
+from services.rate_limit import RateLimitedError
+from services.jobs import JobNotFoundError, job_queue, validate_callback_url
 
 router = APIRouter(prefix="/food-detection", tags=["Food Detection"])
 
-# Ensure the static directory exists
-os.makedirs("static", exist_ok=True)
+@dataclass
+class PreparedImage:
+    digest: str
+    data: bytes
+    content_type: str
+    # None when Pillow cannot decode the image; such uploads skip near-duplicate matching
+    phash: Optional[int]
 
-@router.post("/food-item")
-async def classify_food(file: UploadFile = File(...)):
-    try:
-        # Save uploaded file
-        file_path = f"static/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+async def read_image_upload(file: UploadFile):
+    """
+    Reads an uploaded image fully into memory and sniffs its content type.
+    Nothing is written to disk, so concurrent uploads with the same filename cannot collide.
+    """
+    image_bytes = await file.read()
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+
+    content_type = sniff_content_type(image_bytes)
+    if content_type is None:
+        raise HTTPException(status_code=400, detail="Unsupported image format.")
+
+    return image_bytes, content_type
+
+async def prepare_image(file: UploadFile, cache: ImageResultCache) -> Tuple[Optional[PreparedImage], Any]:
+    """
+    Reads, deduplicates and preprocesses an upload.
+
+    Returns:
+        tuple: (prepared image, cached result). Exactly one of the two is None.
+    """
+    # Read uploaded file into memory
+    with span("upload"):
+        image_bytes, content_type = await read_image_upload(file)
+
+    # Exact duplicate of a previous upload
+    digest = sha256_digest(image_bytes)
+    cached = cache.get(digest)
+    if cached is not None:
+        return None, cached
+
+    # Downscale and re-encode before uploading to the inference API
+    with span("preprocess"):
+        image_bytes, content_type = await preprocess_image_async(image_bytes)
+
+        # Near duplicate (re-compressed, resized or re-shared copy of a previous upload)
+        try:
+            phash = await run_in_pool(dhash, image_bytes)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # Formats the classifiers accept but Pillow cannot decode (e.g. HEIC) are still served
+            print(f"[WARNING] Could not compute perceptual hash, skipping near-duplicate lookup: {str(e)}")
+            phash = None
+    cached = cache.get_similar(phash) if phash is not None else None
+    if cached is not None:
+        cache.put(digest, phash, cached)
+        return None, cached
 
+    return PreparedImage(digest, image_bytes, content_type, phash), None
+
+async def detect_and_summarize(file: UploadFile, detector, cache_namespace: str) -> dict:
+    """
+    Shared pipeline for the detection endpoints: read, cache lookup, preprocess,
+    classify and summarize. Results are cached by exact and perceptual image hash.
+    """
+    cache = get_image_cache(cache_namespace)
+    image, cached = await prepare_image(file, cache)
+    if cached is not None:
+        return cached
+    return await classify_and_summarize(image, detector, cache)
+
+async def classify_and_summarize(image: PreparedImage, detector, cache: ImageResultCache,
+                                 priority: str = "high") -> dict:
+    """Classifies a prepared image, summarizes the label and caches the result."""
+    # Cache misses call the classifier and Gemini, so they need an admission slot
+    async with admission.admit(priority):
         # Detect food item
-        food_label = detect_food(file_path)
+        with span("classify"):
+            label = await detector(image.data, image.content_type)
 
         # Get nutrition summary from Gemini
-        nutrition_info = generate_summary(food_label)
+        nutrition_info = await get_summary(label)
 
-        # Clean up the uploaded file after processing
-        os.remove(file_path)
+    # Return the nutrition information as a dictionary
+    result = nutrition_info if isinstance(nutrition_info, dict) else nutrition_info.model_dump()
+    cache.put(image.digest, image.phash, result)
+    return result
 
-        # Return the nutrition information as a dictionary
-        return nutrition_info if isinstance(nutrition_info, dict) else nutrition_info.model_dump()
+@router.post("/food-item")
+async def classify_food(file: UploadFile = File(...)):
+    try:
+        return await detect_and_summarize(file, detect_food_async, "food-item")
 
+    except (HTTPException, OverloadedError, RateLimitedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 @router.post("/fruit-vegetable")
 async def classify_fruit_or_vegetable(file: UploadFile = File(...)):
     try:
-        # Save uploaded file
-        file_path = f"static/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        return await detect_and_summarize(file, detect_fruit_or_vegetable_async, "fruit-vegetable")
 
-        # Detect fruit or vegetable
-        fruit_label = detect_fruit_or_vegetable(file_path)
+    except (HTTPException, OverloadedError, RateLimitedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-        # Get nutrition summary from Gemini
-        nutrition_info = generate_summary(fruit_label)
+@router.post("/scan")
+async def scan(file: UploadFile = File(...), top_k: int = Query(3, ge=1, le=5)):
+    """
+    Runs both classifiers on one upload concurrently and summarizes only the most
+    confident label. The response includes the top_k candidates of each classifier.
+    """
+    try:
+        cache = get_image_cache(f"scan:{top_k}")
+        image, cached = await prepare_image(file, cache)
+        if cached is not None:
+            return cached
+        return await scan_image(image, top_k, cache)
 
-        # Clean up the uploaded file after processing
-        os.remove(file_path)
+    except (HTTPException, OverloadedError, RateLimitedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+async def scan_image(image: PreparedImage, top_k: int, cache: ImageResultCache, priority: str = "high") -> dict:
+    """Scan pipeline after preprocessing: both classifiers, then a summary of the best label."""
+    async with admission.admit(priority):
+        with span("classify"):
+            food, fruit = await asyncio.gather(
+                classify_food_async(image.data, image.content_type, top_k=top_k),
+                classify_fruit_or_vegetable_async(image.data, image.content_type, top_k=top_k),
+                return_exceptions=True,
+            )
+        candidates = {
+            source: predictions
+            for source, predictions in (("food-item", food), ("fruit-vegetable", fruit))
+            if not isinstance(predictions, BaseException) and predictions
+        }
+        if not candidates:
+            # Both classifiers failed; report the first error
+            raise food if isinstance(food, BaseException) else fruit
+
+        # Pick the classifier with the most confident top prediction
+        source = max(candidates, key=lambda name: candidates[name][0]["score"])
+        best = candidates[source][0]
+
+        nutrition_info = await get_summary(best["label"])
 
-        # Return the nutrition information as a dictionary
-        return nutrition_info if isinstance(nutrition_info, dict) else nutrition_info.model_dump()
+        result = {
+            "label": best["label"],
+            "score": best["score"],
+            "source": source,
+            "candidates": candidates,
+            "nutrition": nutrition_info.model_dump(),
+        }
+    cache.put(image.digest, image.phash, result)
+    return result
 
+@router.post("/plate")
+async def plate(file: UploadFile = File(...), max_regions: int = Query(PLATE_MAX_REGIONS, ge=1, le=12)):
+    """
+    Detects several foods on one meal photo. The image is split into regions that are
+    classified in one batch, overlapping detections are merged, and the response lists
+    each food with its portion and nutrients plus the totals for the whole meal.
+    """
+    try:
+        cache = get_image_cache(f"plate:{max_regions}")
+        image, cached = await prepare_image(file, cache)
+        if cached is not None:
+            return cached
+        # One plate costs several classifier calls, so it queues behind single-image scans
+        return await plate_image(image, max_regions, cache, priority="low")
+
+    except (HTTPException, OverloadedError, RateLimitedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+async def plate_image(image: PreparedImage, max_regions: int, cache: ImageResultCache, priority: str = "high") -> dict:
+    async with admission.admit(priority):
+        result = await analyze_plate(image.data, max_regions)
+    cache.put(image.digest, image.phash, result)
+    return result
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """
+    Returns hit/miss counters for the image result caches.
+    """
+    return image_cache_stats()
+
+# Asynchronous scans: the upload is preprocessed and queued, and a background worker runs
+# the classifier and Gemini chain. Clients poll the job or pass a callback_url.
+
+DETECTORS = {"food-item": detect_food_async, "fruit-vegetable": detect_fruit_or_vegetable_async}
+
+def _cache_namespace(kind: str, params: dict) -> str:
+    if kind == "scan":
+        return f"scan:{params['top_k']}"
+    if kind == "plate":
+        return f"plate:{params['max_regions']}"
+    return kind
+
+def _job_handler(kind: str):
+    async def handle(params: dict, payload: bytes) -> dict:
+        cache = get_image_cache(_cache_namespace(kind, params))
+        # A synchronous request for the same image may have finished in the meantime
+        cached = cache.get(params["digest"])
+        if cached is not None:
+            return cached
+        image = PreparedImage(params["digest"], payload, params["content_type"], params["phash"])
+        # Background work yields to interactive requests
+        if kind == "scan":
+            return await scan_image(image, params["top_k"], cache, priority="low")
+        if kind == "plate":
+            return await plate_image(image, params["max_regions"], cache, priority="low")
+        return await classify_and_summarize(image, DETECTORS[kind], cache, priority="low")
+    return handle
+
+for _kind in (*DETECTORS, "scan", "plate"):
+    job_queue.register_handler(_kind, _job_handler(_kind))
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    kind: Literal["food-item", "fruit-vegetable", "scan", "plate"] = Query("food-item"),
+    top_k: int = Query(3, ge=1, le=5),
+    max_regions: int = Query(PLATE_MAX_REGIONS, ge=1, le=12),
+    callback_url: Optional[str] = Query(None, max_length=2048),
+):
+    """
+    Queues an image for background detection and returns the job immediately.
+    Poll `status_url` until the job is `done` or `failed`, or pass `callback_url` to
+    have the finished job POSTed to it. Uploads already seen are deduplicated by hash.
+    """
+    if callback_url is not None and not await validate_callback_url(callback_url):
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL on an allowed, public host.")
+
+    params = {}
+    if kind == "scan":
+        params["top_k"] = top_k
+    elif kind == "plate":
+        params["max_regions"] = max_regions
+    cache = get_image_cache(_cache_namespace(kind, params))
+    image, cached = await prepare_image(file, cache)
+    if cached is not None:
+        job = await job_queue.submit(kind, None, params, callback_url=callback_url, result=cached)
+    else:
+        params.update(digest=image.digest, content_type=image.content_type, phash=image.phash)
+        dedup_key = f"{_cache_namespace(kind, params)}:{image.digest}"
+        job = await job_queue.submit(kind, dedup_key, params, image.data, callback_url=callback_url)
+    return {**job, "status_url": f"{router.prefix}/jobs/{job['job_id']}"}
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Returns a job's status, with its `result` once done or its last `error`.
+    """
+    try:
+        return job_queue.get(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found.")
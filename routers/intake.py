@@ -0,0 +1,56 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException
+from models.food import Nutrients
+from models.user import MealLogCreate, UserProfile
+from services.connect_database import PROFILE_FIELDS, UserRepository, get_db
+from services.intake import intake_engine, compute_targets
+from services.nutrition_resolver import resolve_nutrition
+from routers.user import get_current_user
+
+router = APIRouter(prefix="/intake", tags=["Intake"])
+
+# Dependency: the bearer token must belong to the user named in the path
+async def require_owner(username: str, current_user: dict = Depends(get_current_user)) -> str:
+    if current_user.get("username") != username:
+        raise HTTPException(status_code=403, detail="Not allowed to access another user's intake")
+    return username
+
+@router.put("/{username}/profile")
+async def update_profile(profile: UserProfile, username: str = Depends(require_owner),
+                         current_user: dict = Depends(get_current_user), db: UserRepository = Depends(get_db)):
+    """
+    Updates the user's body measurements and goal, which drive the calorie and macro
+    targets, and returns the new targets.
+    """
+    if not await db.update_profile_async(username, profile.model_dump()):
+        raise HTTPException(status_code=404, detail="User not found")
+    # The token cache holds this record; keep /users/me in step for this token
+    current_user.update(profile.model_dump())
+    return {"username": username, "targets": compute_targets(profile)}
+
+@router.post("/{username}/meals")
+async def log_meal(meal: MealLogCreate, username: str = Depends(require_owner)):
+    """
+    Logs a meal. Per-100g nutrients are taken from the request or, if omitted,
+    resolved for the food item (caches and reference data first, Gemini last).
+    """
+    if meal.nutrients is not None:
+        per_100g = Nutrients.from_dict(meal.nutrients)
+    else:
+        try:
+            per_100g = (await resolve_nutrition(meal.food_item)).to_nutrients()
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Could not look up nutrients: {str(e)}")
+
+    eaten_at = meal.eaten_at.timestamp() if meal.eaten_at else None
+    amounts = await asyncio.to_thread(intake_engine.log_meal, username, meal.food_item, meal.grams, per_100g, eaten_at)
+    return {"food_item": meal.food_item, "grams": meal.grams, "nutrients": amounts.to_dict()}
+
+@router.get("/{username}/dashboard")
+async def get_dashboard(username: str = Depends(require_owner), db: UserRepository = Depends(get_db)):
+    """
+    Returns today's totals, rolling 7/30-day totals and averages, targets and progress.
+    """
+    user = await db.get_user_async(username)
+    profile = UserProfile(**{field: user[field] for field in PROFILE_FIELDS}) if user else None
+    return await asyncio.to_thread(intake_engine.dashboard, username, profile)
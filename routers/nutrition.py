@@ -1,17 +1,71 @@
-from fastapi import APIRouter
-from services.openfoodfacts import get_nutrition_info
-from services.gemini import generate_summary
+from fastapi import APIRouter, Query
+from models.food import BulkBarcodeRequest, NutritionResponse, ResolvedNutrition
+from services.openfoodfacts import NOT_FOUND, UNAVAILABLE, get_nutrition_bulk, get_nutrition_info_async
+from services.summary_cache import get_summary
+from services.food_search import get_search_index, get_search_index_async
+from services.nutrition_resolver import resolve_nutrition, resolver_stats
 
 router = APIRouter(prefix="/nutrition", tags=["Nutrition Data"])
 
+@router.get("/autocomplete")
+def autocomplete(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(10, ge=1, le=50)):
+    """
+    Suggests known foods for a search box prefix, tolerating typos when nothing matches the prefix.
+    """
+    entries = get_search_index().autocomplete(q, limit)
+    return [{"name": entry.name, "source": entry.source, "barcode": entry.barcode} for entry in entries]
+
+@router.post("/bulk")
+async def fetch_nutrition_bulk(request: BulkBarcodeRequest):
+    """
+    Looks up to 100 barcodes in one request, e.g. from a receipt or pantry scan.
+    Invalid codes are rejected by checksum, duplicates are fetched once and misses are
+    fetched from OpenFoodFacts concurrently. Each item carries its own `status`.
+    """
+    return {"items": await get_nutrition_bulk(request.barcodes)}
+
+@router.get("/resolver/stats")
+def get_resolver_stats():
+    """
+    Returns hits and misses per resolver tier and how many lookups avoided a Gemini call.
+    """
+    return resolver_stats()
+
+@router.get("/resolve/{food_item_or_barcode}", response_model=ResolvedNutrition)
+async def resolve(food_item_or_barcode: str, llm: bool = True):
+    """
+    Resolves per-100g nutrients through the cheapest sources that know them: caches,
+    the local OpenFoodFacts index, the reference table and, unless `llm=false`, Gemini.
+    Partial records are merged and every field carries its source and timestamp.
+    """
+    return await resolve_nutrition(food_item_or_barcode, allow_llm=llm)
+
 @router.get("/{food_item_or_barcode}")
-def fetch_nutrition(food_item_or_barcode: str):
+async def fetch_nutrition(food_item_or_barcode: str, compact: bool = False):
     """
     Determines whether input is a barcode (packaged food) or food name (fresh food).
+    Food names are first resolved to a known food, so typos and plurals share one answer.
+    With `compact=true` only the numeric nutrient values per 100g are returned, merged
+    from the resolver tiers (see `/nutrition/resolve`).
     """
+    if compact:
+        resolved = await resolve_nutrition(food_item_or_barcode)
+        if resolved.status in ("not_found", "unavailable"):
+            return UNAVAILABLE if resolved.status == "unavailable" else NOT_FOUND
+        return NutritionResponse.from_nutrients(resolved.name or food_item_or_barcode, resolved.to_nutrients())
+
+    barcode = None
     if food_item_or_barcode.isnumeric() and len(food_item_or_barcode) > 6:
+        barcode = food_item_or_barcode
+    else:
+        index = await get_search_index_async()
+        match = index.resolve(food_item_or_barcode)
+        if match is not None and match.entry.barcode:
+            barcode = match.entry.barcode
+
+    if barcode is not None:
         # If it's a barcode, fetch packaged food data
-        return get_nutrition_info(food_item_or_barcode)
+        return await get_nutrition_info_async(barcode)
     else:
-        # If it's a food name, fetch AI-based summary
-        return generate_summary(food_item_or_barcode)
+        # If it's a food name, fetch AI-based summary for the canonical name
+        return await get_summary(match.entry.key if match else food_item_or_barcode)
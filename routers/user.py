@@ -1,69 +1,82 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import  JWTError, jwt
-from datetime import datetime, timedelta
-import os
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from models.user import UserCreate, UserResponse
-from services.connect_database import get_db
-from sqlalchemy import text
+from services.auth import (AuthBusyError, InvalidTokenError, auth_stats, create_access_token,
+                           decode_access_token, password_pool, public_user, token_cache)
+from services.connect_database import UserExistsError, UserRepository, get_db
 
-router = APIRouter()
+router = APIRouter(prefix="/users", tags=["Users"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+bearer_scheme = HTTPBearer()
 
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-ALGORITHM = "HS256"
+# Dependency: resolve the user behind a bearer token, from the token cache when possible
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+                           db: UserRepository = Depends(get_db)):
+    token = credentials.credentials
+    user = token_cache.get(token)
+    if user is not None:
+        return user
 
-# Helper: Generate JWT Token
-def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
-    to_encode = data.copy()
-    to_encode.update({"exp": datetime.utcnow() + expires_delta})
-    return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
+    try:
+        claims = decode_access_token(token)
+    except InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user = await db.get_user_async(claims["sub"])
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user = public_user(user)
+    token_cache.put(token, user, claims["exp"])
+    return user
 
 # Register User
 @router.post("/register", response_model=dict)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    hashed_password = pwd_context.hash(user.password)
+async def register(user: UserCreate, db: UserRepository = Depends(get_db)):
+    try:
+        hashed_password = await password_pool.hash(user.password)
+    except AuthBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     try:
-        db.execute(
-            text("""
-                INSERT INTO users (username, password, gender, age, height_cm, current_weight, goal_weight, goal_type, weight_change_speed)
-                VALUES (:username, :password, :gender, :age, :height_cm, :current_weight, :goal_weight, :goal_type, :weight_change_speed)
-            """),
-            {
-                "username": user.username,
-                "password": hashed_password,
-                "gender": user.gender,
-                "age": user.age,
-                "height_cm": user.height_cm,
-                "current_weight": user.current_weight,
-                "goal_weight": user.goal_weight,
-                "goal_type": user.goal_type,
-                "weight_change_speed": user.weight_change_speed,
-            },
-        )
-        db.commit()
-        return {"message": "User registered successfully"}
+        await db.create_user_async({**user.model_dump(), "password": hashed_password})
+    except UserExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "User registered successfully"}
 
 # User Login
 @router.post("/login", response_model=dict)
-def login(user: UserCreate, db: Session = Depends(get_db)):
-    user_record = db.execute(text("SELECT * FROM users WHERE username = :username"), {"username": user.username}).fetchone()
-    if not user_record or not pwd_context.verify(user.password, user_record.password):
+async def login(user: UserCreate, db: UserRepository = Depends(get_db)):
+    user_record = await db.get_user_async(user.username)
+    try:
+        verified = bool(user_record) and await password_pool.verify(user.password, user_record["password"])
+    except AuthBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not verified:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    access_token = create_access_token(data={"sub": user.username})
+
+    access_token, expires_at = create_access_token(data={"sub": user.username})
+    # The client will use the token right away, so the first request skips the lookup too
+    token_cache.put(access_token, public_user(user_record), expires_at)
     return {"access_token": access_token, "token_type": "bearer"}
 
-# Get User Info (Protected)
+# Get Current User (Protected)
+@router.get("/me", response_model=UserResponse)
+async def get_me(current_user: dict = Depends(get_current_user)):
+    return UserResponse(**current_user)
+
+# Get User Info
 @router.get("/user", response_model=UserResponse)
-def get_user(username: str, db: Session = Depends(get_db)):
-    user = db.execute(text("SELECT * FROM users WHERE username = :username"), {"username": username}).fetchone()
+async def get_user(username: str, db: UserRepository = Depends(get_db)):
+    user = await db.get_user_async(username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserResponse(**dict(user._mapping))
+    return UserResponse(**user)
+
+@router.get("/auth/stats")
+def get_auth_stats():
+    """
+    Returns the bcrypt pool queue depth per endpoint and the token cache counters.
+    """
+    return auth_stats()
@@ -0,0 +1,123 @@
+import os
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+from services.metrics import counter, register_collector
+
+# Admission config, per worker process. Requests that can be answered from a cache
+# never ask for a slot; everything that will call an upstream or a model does.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+
+# Priority classes, most important first: interactive single-item requests, then
+# batch/bulk work that clients can retry later
+PRIORITIES = ("high", "low")
+ADMISSION_MAX_QUEUE = {
+    "high": int(os.getenv("ADMISSION_MAX_QUEUE_HIGH", "64")),
+    "low": int(os.getenv("ADMISSION_MAX_QUEUE_LOW", "8")),
+}
+ADMISSION_QUEUE_TIMEOUT = {
+    "high": float(os.getenv("ADMISSION_QUEUE_TIMEOUT_HIGH", "10")),
+    "low": float(os.getenv("ADMISSION_QUEUE_TIMEOUT_LOW", "2")),
+}
+# Seconds clients are told to wait in the Retry-After header of a 503
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+ADMISSION_SHED = counter("nutrivision_admission_shed_total", "Requests rejected by the admission controller.",
+                         ("priority", "reason"))
+ADMISSION_QUEUED = counter("nutrivision_admission_queued_total", "Requests that waited for an admission slot.",
+                           ("priority",))
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because the worker is at capacity."""
+
+    def __init__(self, message: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bounds the number of expensive requests in flight in one worker.
+
+    Up to `max_inflight` requests run at once. Beyond that, requests wait in a queue
+    per priority class and freed slots go to the highest priority waiting first. A
+    request is shed with OverloadedError when its class's queue is full or it waited
+    longer than the class's timeout, so overload turns into fast 503s for batch work
+    first instead of every request slowing down together.
+    """
+
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT, max_queue: Dict[str, int] = ADMISSION_MAX_QUEUE,
+                 queue_timeout: Dict[str, float] = ADMISSION_QUEUE_TIMEOUT):
+        self.max_inflight = max_inflight
+        self.max_queue = dict(max_queue)
+        self.queue_timeout = dict(queue_timeout)
+        self.inflight = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+
+    def _waiting(self) -> bool:
+        return any(self._waiters.values())
+
+    async def _acquire(self, priority: str):
+        if self.inflight < self.max_inflight and not self._waiting():
+            self.inflight += 1
+            return
+
+        queue = self._waiters[priority]
+        if len(queue) >= self.max_queue[priority]:
+            ADMISSION_SHED.inc(priority, "queue_full")
+            raise OverloadedError(f"Server is busy ({priority} priority queue full)")
+
+        ADMISSION_QUEUED.inc(priority)
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        try:
+            # The slot is handed over by _release() resolving the future
+            await asyncio.wait_for(future, self.queue_timeout[priority])
+        except asyncio.TimeoutError:
+            ADMISSION_SHED.inc(priority, "timeout")
+            raise OverloadedError(f"Server is busy ({priority} priority request waited too long)")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled right after being handed a slot, pass it on
+                self._release()
+            raise
+        finally:
+            if future in queue:
+                queue.remove(future)
+
+    def _release(self):
+        for priority in PRIORITIES:
+            queue = self._waiters[priority]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.inflight -= 1
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "high"):
+        """Holds an admission slot for the duration of the block."""
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict:
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "queued": {priority: len(queue) for priority, queue in self._waiters.items()},
+        }
+
+admission = AdmissionController()
+
+register_collector("nutrivision_admission_inflight", "gauge", "Admitted requests in flight.", (),
+                   lambda: [((), admission.inflight)])
+register_collector("nutrivision_admission_queue_depth", "gauge", "Requests waiting for an admission slot.",
+                   ("priority",), lambda: [((priority,), depth) for priority, depth in admission.stats()["queued"].items()])
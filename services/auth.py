@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+from config import JWT_SECRET_KEY
+from services.metrics import register_cache_stats, register_collector
+
+# Password hashing config. Bcrypt costs 100-300 ms of CPU per call, so it runs in its
+# own small process pool instead of the request threadpool.
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_CONCURRENCY = {
+    "register": int(os.getenv("PASSWORD_REGISTER_CONCURRENCY", "1")),
+    "login": int(os.getenv("PASSWORD_LOGIN_CONCURRENCY", "2")),
+}
+PASSWORD_MAX_WAITING = int(os.getenv("PASSWORD_MAX_WAITING", "32"))
+
+# JWT config
+ALGORITHM = "HS256"
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_ENTRIES = int(os.getenv("TOKEN_CACHE_ENTRIES", "10000"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+class AuthBusyError(Exception):
+    """Raised when too many password operations are already waiting for the pool."""
+    pass
+
+class InvalidTokenError(Exception):
+    """Raised for malformed, expired or wrongly signed access tokens."""
+    pass
+
+# Run in the worker processes
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_password(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+class PasswordPool:
+    """
+    Bounded process pool for bcrypt.
+
+    Each endpoint has its own semaphore, so a burst of logins cannot take every worker
+    away from registrations (and vice versa), and requests beyond PASSWORD_MAX_WAITING
+    are rejected instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, limits: Dict[str, int] = PASSWORD_CONCURRENCY,
+                 max_waiting: int = PASSWORD_MAX_WAITING):
+        self.workers = workers
+        self.limits = dict(limits)
+        self.max_waiting = max_waiting
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiting = {endpoint: 0 for endpoint in self.limits}
+        self._active = {endpoint: 0 for endpoint in self.limits}
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn so workers do not inherit the server's threads and sockets
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            semaphore = self._semaphores[endpoint] = asyncio.Semaphore(self.limits[endpoint])
+        return semaphore
+
+    async def _run(self, endpoint: str, func, *args):
+        if self._waiting[endpoint] >= self.max_waiting:
+            self.rejected += 1
+            raise AuthBusyError(f"Too many pending {endpoint} requests")
+
+        semaphore = self._semaphore(endpoint)
+        self._waiting[endpoint] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[endpoint] -= 1
+
+        self._active[endpoint] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._active[endpoint] -= 1
+            self.completed += 1
+            semaphore.release()
+
+    async def hash(self, password: str, endpoint: str = "register") -> str:
+        return await self._run(endpoint, _hash_password, password)
+
+    async def verify(self, password: str, hashed: str, endpoint: str = "login") -> bool:
+        return await self._run(endpoint, _verify_password, password, hashed)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": sum(self._waiting.values()),
+            "endpoints": {
+                endpoint: {"limit": limit, "active": self._active[endpoint], "waiting": self._waiting[endpoint]}
+                for endpoint, limit in self.limits.items()
+            },
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+class TokenCache:
+    """
+    Short-lived cache of verified access tokens and the user they belong to.
+
+    Entries live for TOKEN_CACHE_TTL seconds, and never past the token's own expiry,
+    so authenticated requests skip the JWT decode and the user lookup.
+    """
+
+    def __init__(self, ttl: float = TOKEN_CACHE_TTL, max_entries: int = TOKEN_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._entries.get(token)
+            if item is None or item[1] < time.time():
+                if item is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return item[0]
+
+    def put(self, token: str, user: Dict, token_expires_at: float):
+        with self._lock:
+            self._entries[token] = (user, min(time.time() + self.ttl, token_expires_at))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+password_pool = PasswordPool()
+token_cache = TokenCache()
+
+def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)) -> Tuple[str, float]:
+    """Returns a signed JWT and its expiry as a Unix timestamp."""
+    expires_at = datetime.utcnow() + expires_delta
+    to_encode = data.copy()
+    to_encode.update({"exp": expires_at})
+    return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM), time.time() + expires_delta.total_seconds()
+
+def decode_access_token(token: str) -> Dict:
+    """Verifies a JWT and returns its claims."""
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        raise InvalidTokenError(str(e))
+    if not claims.get("sub"):
+        raise InvalidTokenError("Token has no subject")
+    return claims
+
+def public_user(user: Dict) -> Dict:
+    """Drops the password hash from a user record."""
+    return {key: value for key, value in user.items() if key != "password"}
+
+register_cache_stats(lambda: {"token": token_cache.stats()})
+register_collector("nutrivision_password_queue_depth", "gauge", "Password operations waiting for the bcrypt pool.",
+                   ("endpoint",), lambda: [((endpoint,), stats["waiting"])
+                                           for endpoint, stats in password_pool.stats()["endpoints"].items()])
+
+def auth_stats() -> Dict:
+    return {"password_pool": password_pool.stats(), "token_cache": token_cache.stats()}
+
+def shutdown_password_pool():
+    """Stops the bcrypt worker processes (call on application shutdown)."""
+    password_pool.shutdown()
@@ -1,29 +1,292 @@
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
+import os
 import json
+import uuid
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+from fastapi.concurrency import run_in_threadpool
 
-# This secure connect bundle is autogenerated when you download your SCB, 
-# if yours is different update the file name below
-cloud_config= {
-  'secure_connect_bundle': 'zip/secure-connect-nutrivisionapp-users.zip'
-}
-
-# This token JSON file is autogenerated when you download your token, 
-# if yours is different update the file name below
-with open("json/nutrivisionapp-users-token.json") as f:
-    secrets = json.load(f)
-
-CLIENT_ID = secrets["clientId"]
-CLIENT_SECRET = secrets["secret"]
-print(CLIENT_ID)
-print(CLIENT_SECRET)
-
-auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
-cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
-session = cluster.connect()
-
-row = session.execute("select release_version from system.local").one()
-if row:
-  print(row[0])
-else:
-  print("An error occurred.")
\ No newline at end of file
+# Database config
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "cassandra").lower()  # "cassandra" or "sqlite"
+ASTRA_BUNDLE_PATH = os.getenv("ASTRA_BUNDLE_PATH", "zip/secure-connect-nutrivisionapp-users.zip")
+ASTRA_TOKEN_PATH = os.getenv("ASTRA_TOKEN_PATH", "json/nutrivisionapp-users-token.json")
+CASSANDRA_KEYSPACE = os.getenv("CASSANDRA_KEYSPACE", "users")
+CASSANDRA_TIMEOUT = float(os.getenv("CASSANDRA_TIMEOUT", "10"))
+USER_DB_PATH = os.getenv("USER_DB_PATH", "data/users.sqlite3")
+
+USER_FIELDS = ("username", "password", "gender", "age", "height_cm", "current_weight",
+               "goal_weight", "goal_type", "weight_change_speed")
+# Body measurements and goal, editable after registration
+PROFILE_FIELDS = USER_FIELDS[2:]
+
+_SELECT_USER = "SELECT * FROM users WHERE username = :username"
+_UPDATE_PROFILE = (
+    f"UPDATE users SET {', '.join(f'{field} = :{field}' for field in PROFILE_FIELDS)} "
+    "WHERE username = :username"
+)
+_INSERT_USER = (
+    f"INSERT INTO users (id, {', '.join(USER_FIELDS)}) "
+    f"VALUES (:id, {', '.join(':' + field for field in USER_FIELDS)})"
+)
+
+_CQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username text PRIMARY KEY,
+    id bigint,
+    password text,
+    gender text,
+    age int,
+    height_cm double,
+    current_weight double,
+    goal_weight double,
+    goal_type text,
+    weight_change_speed double
+)
+"""
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    gender TEXT,
+    age INTEGER,
+    height_cm REAL,
+    current_weight REAL,
+    goal_weight REAL,
+    goal_type TEXT,
+    weight_change_speed REAL
+)
+"""
+
+class UserExistsError(Exception):
+    """Raised when registering a username that is already taken."""
+    pass
+
+class UserRepository(ABC):
+    """
+    Data access for user accounts.
+
+    Routes use the async methods; the sync methods are there for scripts and tests.
+    Backends must implement get_user, create_user and update_profile.
+    """
+
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def create_user(self, user: Dict) -> Dict:
+        ...
+
+    @abstractmethod
+    def update_profile(self, username: str, profile: Dict) -> bool:
+        """Overwrites the PROFILE_FIELDS of a user. Returns False if the user does not exist."""
+        ...
+
+    async def get_user_async(self, username: str) -> Optional[Dict]:
+        return await run_in_threadpool(self.get_user, username)
+
+    async def create_user_async(self, user: Dict) -> Dict:
+        return await run_in_threadpool(self.create_user, user)
+
+    async def update_profile_async(self, username: str, profile: Dict) -> bool:
+        return await run_in_threadpool(self.update_profile, username, profile)
+
+    def close(self):
+        pass
+
+class CassandraUserRepository(UserRepository):
+    """
+    Users table on Astra/Cassandra.
+
+    The cluster handshake happens on first use, not at import, so every worker starts
+    without blocking. One session per process is shared by all requests; the driver
+    keeps a connection pool per node behind it. Queries are prepared once and run with
+    execute_async, so routes await them without holding a threadpool slot.
+    """
+
+    def __init__(self, bundle_path: str = ASTRA_BUNDLE_PATH, token_path: str = ASTRA_TOKEN_PATH,
+                 keyspace: str = CASSANDRA_KEYSPACE):
+        self.bundle_path = bundle_path
+        self.token_path = token_path
+        self.keyspace = keyspace
+        self._cluster = None
+        self._session = None
+        self._select = None
+        self._insert = None
+        self._update = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._session is not None:
+            return self._session
+        with self._lock:
+            if self._session is None:
+                from cassandra.auth import PlainTextAuthProvider
+                from cassandra.cluster import Cluster
+                from cassandra.query import dict_factory
+
+                with open(self.token_path) as f:
+                    secrets = json.load(f)
+
+                auth_provider = PlainTextAuthProvider(secrets["clientId"], secrets["secret"])
+                cluster = Cluster(cloud={"secure_connect_bundle": self.bundle_path}, auth_provider=auth_provider)
+                session = cluster.connect(self.keyspace)
+                session.row_factory = dict_factory
+                session.default_timeout = CASSANDRA_TIMEOUT
+                session.execute(_CQL_SCHEMA)
+                self._select = session.prepare(_SELECT_USER)
+                # Lightweight transaction so a second registration cannot overwrite an account
+                self._insert = session.prepare(_INSERT_USER + " IF NOT EXISTS")
+                # IF EXISTS, or the update would create a row without a password
+                self._update = session.prepare(_UPDATE_PROFILE + " IF EXISTS")
+                self._cluster = cluster
+                self._session = session
+                print(f"[INFO] Connected to Cassandra keyspace {self.keyspace}")
+        return self._session
+
+    def _new_record(self, user: Dict) -> Dict:
+        record = {field: user.get(field) for field in USER_FIELDS}
+        # Cassandra has no auto-increment; a random positive 63-bit id is unique enough
+        record["id"] = uuid.uuid4().int >> 65
+        return record
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        session = self._connect()
+        return session.execute(self._select, {"username": username}).one()
+
+    def create_user(self, user: Dict) -> Dict:
+        session = self._connect()
+        record = self._new_record(user)
+        if not session.execute(self._insert, record).was_applied:
+            raise UserExistsError(f"Username {user['username']} is already taken")
+        return record
+
+    def _profile_record(self, username: str, profile: Dict) -> Dict:
+        return {"username": username, **{field: profile.get(field) for field in PROFILE_FIELDS}}
+
+    def update_profile(self, username: str, profile: Dict) -> bool:
+        session = self._connect()
+        return session.execute(self._update, self._profile_record(username, profile)).was_applied
+
+    async def _execute_async(self, statement, parameters):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(rows):
+            if not future.done():
+                future.set_result(rows)
+
+        def set_exception(exc):
+            if not future.done():
+                future.set_exception(exc)
+
+        # Driver callbacks run on its event thread, hand the result back to our loop
+        response = self._session.execute_async(statement, parameters)
+        response.add_callbacks(
+            lambda rows: loop.call_soon_threadsafe(set_result, rows),
+            lambda exc: loop.call_soon_threadsafe(set_exception, exc),
+        )
+        return await future
+
+    async def get_user_async(self, username: str) -> Optional[Dict]:
+        if self._session is None:
+            await run_in_threadpool(self._connect)
+        rows = await self._execute_async(self._select, {"username": username})
+        return rows[0] if rows else None
+
+    async def create_user_async(self, user: Dict) -> Dict:
+        if self._session is None:
+            await run_in_threadpool(self._connect)
+        record = self._new_record(user)
+        rows = await self._execute_async(self._insert, record)
+        if not rows or not rows[0].get("[applied]", False):
+            raise UserExistsError(f"Username {user['username']} is already taken")
+        return record
+
+    async def update_profile_async(self, username: str, profile: Dict) -> bool:
+        if self._session is None:
+            await run_in_threadpool(self._connect)
+        rows = await self._execute_async(self._update, self._profile_record(username, profile))
+        return bool(rows) and rows[0].get("[applied]", False)
+
+    def close(self):
+        if self._cluster is not None:
+            self._cluster.shutdown()
+            self._cluster = None
+            self._session = None
+
+class SqliteUserRepository(UserRepository):
+    """Local stand-in for the Cassandra table, for development and tests."""
+
+    def __init__(self, path: str = USER_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SQLITE_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        row = self._connection().execute(_SELECT_USER, {"username": username}).fetchone()
+        return dict(row) if row else None
+
+    def create_user(self, user: Dict) -> Dict:
+        record = {field: user.get(field) for field in USER_FIELDS}
+        try:
+            cursor = self._connection().execute(
+                f"INSERT INTO users ({', '.join(USER_FIELDS)}) "
+                f"VALUES ({', '.join(':' + field for field in USER_FIELDS)})",
+                record,
+            )
+        except sqlite3.IntegrityError:
+            raise UserExistsError(f"Username {user['username']} is already taken")
+        record["id"] = cursor.lastrowid
+        return record
+
+    def update_profile(self, username: str, profile: Dict) -> bool:
+        record = {"username": username, **{field: profile.get(field) for field in PROFILE_FIELDS}}
+        return self._connection().execute(_UPDATE_PROFILE, record).rowcount > 0
+
+_repository: Optional[UserRepository] = None
+_repository_lock = threading.Lock()
+
+def get_user_repository() -> UserRepository:
+    """Returns the process-wide repository for DATABASE_BACKEND, created on first use."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                if DATABASE_BACKEND == "sqlite":
+                    _repository = SqliteUserRepository()
+                elif DATABASE_BACKEND == "cassandra":
+                    _repository = CassandraUserRepository()
+                else:
+                    raise ValueError(f"Unknown DATABASE_BACKEND: {DATABASE_BACKEND}")
+    return _repository
+
+def set_user_repository(repository: Optional[UserRepository]):
+    """Replaces the repository, e.g. with a SqliteUserRepository on a temp file in tests."""
+    global _repository
+    _repository = repository
+
+def get_db() -> UserRepository:
+    """FastAPI dependency for the user routes."""
+    return get_user_repository()
+
+def close_database():
+    """Closes the Cassandra cluster connection, if one was opened."""
+    if _repository is not None:
+        _repository.close()
@@ -1,19 +1,64 @@
 import os
-import time
-import requests
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
+import asyncio
+import httpx
+from typing import Dict, List, Optional, Sequence, Union
+from services.http_client import get_upstream, CircuitOpenError
+from services.image_utils import ImageBuffer, sniff_content_type, as_request_body
+from services.local_inference import use_local_backend, classify_local, classify_local_async, classify_local_batch_async
+from config import HUGGINGFACE_TOKEN
 
 # API config
-API_URL = "https://api-inference.huggingface.co/models/nateraw/food"
+HF_API_BASE = os.getenv("HF_API_BASE", "https://api-inference.huggingface.co/models")
+API_URL = f"{HF_API_BASE}/nateraw/food"
 
 # Custom Exception for API errors
 class HuggingFaceAPIError(Exception):
     pass
 
+def _build_headers(image: ImageBuffer, content_type: Optional[str]) -> dict:
+    """Builds request headers, sniffing the content type from magic bytes if not given."""
+    return {
+        "Authorization": f"Bearer {HUGGINGFACE_TOKEN}",
+        "Content-Type": content_type or sniff_content_type(image) or "image/jpeg"
+    }
+
+def _handle_response(response) -> Optional[List[Dict]]:
+    """
+    Interprets a Hugging Face API response.
+
+    Returns:
+        list | None: Predictions as [{"label", "score"}] sorted by score, or None if the
+        model is still loading (503).
+
+    Raises:
+        HuggingFaceAPIError: For any other non-200 response or malformed payload.
+    """
+    if response.status_code == 200:
+        try:
+            result = response.json()
+            if isinstance(result, list) and result:
+                return [{"label": item["label"], "score": float(item["score"])} for item in result]
+            else:
+                raise HuggingFaceAPIError("API returned no predictions.")
+        except (KeyError, ValueError) as e:
+            raise HuggingFaceAPIError(f"Invalid API response format: {e}")
+
+    elif response.status_code == 503:
+        return None
+
+    elif response.status_code == 401:
+        raise HuggingFaceAPIError("Unauthorized: Check your HUGGINGFACE_TOKEN.")
+
+    elif response.status_code == 404:
+        raise HuggingFaceAPIError("Model not found. Verify the model name and URL.")
+
+    else:
+        try:
+            error_detail = response.json().get("error", response.text)
+        except Exception:
+            error_detail = response.text
+        raise HuggingFaceAPIError(f"API Error {response.status_code}: {error_detail}")
+
 def detect_food(image_path: str, retries: int = 3, delay: int = 5) -> str:
     """
     Detects food category from image using Hugging Face API and the 'nateraw/food' model.
@@ -21,7 +66,7 @@ def detect_food(image_path: str, retries: int = 3, delay: int = 5) -> str:
     Args:
         image_path (str): Path to the image file.
         retries (int): Number of retries if the model is still loading.
-        delay (int): Delay between retries in seconds.
+        delay (int): Base delay for the jittered exponential backoff between retries, in seconds.
 
     Returns:
         str: Top predicted food label.
@@ -29,9 +74,6 @@ def detect_food(image_path: str, retries: int = 3, delay: int = 5) -> str:
     Raises:
         HuggingFaceAPIError: If the API fails to respond properly.
     """
-    if not HUGGINGFACE_TOKEN:
-        raise EnvironmentError("HUGGINGFACE_TOKEN not found in environment.")
-
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image file '{image_path}' not found.")
 
@@ -42,57 +84,134 @@ def detect_food(image_path: str, retries: int = 3, delay: int = 5) -> str:
     except IOError as e:
         raise HuggingFaceAPIError(f"Failed to read image: {e}")
 
-    # Determine content type
-    content_type = "image/jpeg"
-    if image_path.endswith(".png"):
-        content_type = "image/png"
-    elif image_path.endswith(".bmp"):
-        content_type = "image/bmp"
-    elif image_path.endswith(".webp"):
-        content_type = "image/webp"
+    return detect_food_bytes(image_bytes, retries=retries, delay=delay)
 
-    headers = {
-        "Authorization": f"Bearer {HUGGINGFACE_TOKEN}",
-        "Content-Type": content_type
-    }
+def detect_food_bytes(image: ImageBuffer, content_type: Optional[str] = None, retries: int = 3, delay: int = 5) -> str:
+    """
+    Same as detect_food, but classifies an in-memory image buffer instead of a file.
 
-    # Retry loop
-    for attempt in range(retries):
-        try:
-            response = requests.post(API_URL, headers=headers, data=image_bytes, timeout=30)
+    Args:
+        image (bytes | bytearray | memoryview): Raw image data.
+        content_type (str): MIME type of the image; sniffed from magic bytes if omitted.
+        retries (int): Number of retries if the model is still loading.
+        delay (int): Base delay for the jittered exponential backoff between retries, in seconds.
 
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-                    if isinstance(result, list) and result:
-                        return result[0]["label"]
-                    else:
-                        raise HuggingFaceAPIError("API returned no predictions.")
-                except (KeyError, ValueError) as e:
-                    raise HuggingFaceAPIError(f"Invalid API response format: {e}")
+    Returns:
+        str: Top predicted food label.
 
-            elif response.status_code == 503:
-                print(f"[INFO] Model is loading... Retrying in {delay}s (Attempt {attempt + 1}/{retries})")
-                if attempt < retries - 1:
-                    time.sleep(delay)
+    Raises:
+        HuggingFaceAPIError: If the API fails to respond properly.
+    """
+    return classify_food_bytes(image, content_type, top_k=1, retries=retries, delay=delay)[0]["label"]
 
-            elif response.status_code == 401:
-                raise HuggingFaceAPIError("Unauthorized: Check your HUGGINGFACE_TOKEN.")
+def classify_food_bytes(image: ImageBuffer, content_type: Optional[str] = None, top_k: int = 5,
+                        retries: int = 3, delay: int = 5) -> List[Dict]:
+    """
+    Classifies an in-memory image and returns the top_k predictions with their scores.
 
-            elif response.status_code == 404:
-                raise HuggingFaceAPIError("Model not found. Verify the model name and URL.")
+    Returns:
+        list: [{"label": str, "score": float}] sorted by descending score.
 
-            else:
-                try:
-                    error_detail = response.json().get("error", response.text)
-                except Exception:
-                    error_detail = response.text
-                raise HuggingFaceAPIError(f"API Error {response.status_code}: {error_detail}")
-
-        except requests.exceptions.RequestException as e:
-            if attempt == retries - 1:
-                raise HuggingFaceAPIError(f"Network error: {e}")
-            print(f"[WARNING] Network error on attempt {attempt + 1}, retrying: {e}")
-            time.sleep(delay)
-
-    raise HuggingFaceAPIError("Model failed to load after multiple retries.")
+    Raises:
+        HuggingFaceAPIError: If the API fails to respond properly.
+    """
+    # Local ONNX backend, if selected
+    if use_local_backend():
+        return classify_local("food", image, top_k)
+
+    if not HUGGINGFACE_TOKEN:
+        raise EnvironmentError("HUGGINGFACE_TOKEN not found in environment.")
+
+    headers = _build_headers(image, content_type)
+    body = as_request_body(image)
+
+    # Retries with jittered exponential backoff happen in the shared upstream client
+    try:
+        response = get_upstream().request("POST", API_URL, headers=headers, content=body,
+                                          retries=retries, backoff=delay)
+    except CircuitOpenError as e:
+        raise HuggingFaceAPIError(f"Inference API temporarily unavailable: {e}")
+    except httpx.HTTPError as e:
+        raise HuggingFaceAPIError(f"Network error: {e}")
+
+    predictions = _handle_response(response)
+    if predictions is None:
+        raise HuggingFaceAPIError("Model failed to load after multiple retries.")
+    return predictions[:top_k]
+
+async def detect_food_async(image: ImageBuffer, content_type: Optional[str] = None, retries: int = 3, delay: float = 5, timeout: float = 30) -> str:
+    """
+    Non-blocking variant of detect_food_bytes for use inside async routes.
+
+    Uses the shared upstream client with asyncio.sleep between retries, so a slow or
+    loading model never blocks the event loop. Cancelling the calling task aborts the
+    in-flight request.
+
+    Args:
+        image (bytes | bytearray | memoryview): Raw image data.
+        content_type (str): MIME type of the image; sniffed from magic bytes if omitted.
+        retries (int): Number of retries if the model is still loading.
+        delay (float): Base delay for the jittered exponential backoff between retries, in seconds.
+        timeout (float): Per-call timeout in seconds.
+
+    Returns:
+        str: Top predicted food label.
+
+    Raises:
+        HuggingFaceAPIError: If the API fails to respond properly.
+    """
+    predictions = await classify_food_async(image, content_type, top_k=1, retries=retries, delay=delay, timeout=timeout)
+    return predictions[0]["label"]
+
+async def classify_food_async(image: ImageBuffer, content_type: Optional[str] = None, top_k: int = 5,
+                              retries: int = 3, delay: float = 5, timeout: float = 30) -> List[Dict]:
+    """
+    Non-blocking variant of classify_food_bytes.
+
+    Returns:
+        list: [{"label": str, "score": float}] sorted by descending score.
+
+    Raises:
+        HuggingFaceAPIError: If the API fails to respond properly.
+    """
+    # Local ONNX backend, if selected
+    if use_local_backend():
+        return await classify_local_async("food", image, top_k)
+
+    if not HUGGINGFACE_TOKEN:
+        raise EnvironmentError("HUGGINGFACE_TOKEN not found in environment.")
+
+    headers = _build_headers(image, content_type)
+    body = as_request_body(image)
+
+    try:
+        response = await get_upstream().arequest("POST", API_URL, headers=headers, content=body,
+                                                 retries=retries, backoff=delay, timeout=timeout)
+    except CircuitOpenError as e:
+        raise HuggingFaceAPIError(f"Inference API temporarily unavailable: {e}")
+    except httpx.HTTPError as e:
+        raise HuggingFaceAPIError(f"Network error: {e}")
+
+    predictions = _handle_response(response)
+    if predictions is None:
+        raise HuggingFaceAPIError("Model failed to load after multiple retries.")
+    return predictions[:top_k]
+
+async def classify_food_batch_async(images: Sequence[ImageBuffer], content_type: Optional[str] = None, top_k: int = 5,
+                                    retries: int = 3, delay: float = 5, timeout: float = 30) -> List[Union[List[Dict], Exception]]:
+    """
+    Classifies several images, returning the predictions of each in input order.
+    The local backend runs them as one batch; the Inference API takes one image per
+    request, so those calls are sent concurrently over the shared connection pool.
+    An image whose call failed gets its exception in place of predictions; if every
+    call failed, the first error is raised.
+    """
+    if use_local_backend():
+        return await classify_local_batch_async("food", images, top_k)
+    results = await asyncio.gather(
+        *(classify_food_async(image, content_type, top_k, retries, delay, timeout) for image in images),
+        return_exceptions=True,
+    )
+    if results and all(isinstance(result, Exception) for result in results):
+        raise results[0]
+    return list(results)
@@ -0,0 +1,242 @@
+import os
+import bisect
+import asyncio
+import sqlite3
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from services.labels import ALL_LABELS
+from services.summary_cache import normalize_label, summary_cache
+from services.off_index import OFF_INDEX_PATH
+
+# Search config
+SEARCH_MATCH_THRESHOLD = float(os.getenv("SEARCH_MATCH_THRESHOLD", "0.75"))
+# Cap on OpenFoodFacts product names loaded into memory
+SEARCH_MAX_OFF_NAMES = int(os.getenv("SEARCH_MAX_OFF_NAMES", "50000"))
+# Number of best trigram candidates verified with edit distance per query
+SEARCH_CANDIDATES = 12
+
+# Earlier sources win ties
+SOURCE_PRIORITY = {"label": 0, "cache": 1, "openfoodfacts": 2}
+
+@dataclass
+class SearchEntry:
+    name: str
+    key: str
+    source: str
+    barcode: Optional[str] = None
+
+@dataclass
+class SearchMatch:
+    entry: SearchEntry
+    score: float
+
+def _trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions),
+    giving up early with limit + 1 once every path exceeds `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+class FoodSearchIndex:
+    """
+    In-memory search over the known food vocabulary: classifier labels, cached summary
+    keys and (optionally) OpenFoodFacts product names.
+
+    Typo-tolerant lookup uses a trigram inverted index to collect candidates and an
+    edit-distance check to score them. Autocomplete uses sorted name and word lists
+    with binary search for prefix ranges.
+    """
+
+    def __init__(self):
+        self.entries: List[SearchEntry] = []
+        self._by_key: Dict[str, int] = {}
+        self._trigram_counts: List[int] = []
+        self._trigram_index: Dict[str, List[int]] = {}
+        self._prefixes: List = []
+        self._prefixes_dirty = False
+        self._lock = threading.Lock()
+
+    def add(self, name: str, source: str, barcode: Optional[str] = None) -> Optional[int]:
+        key = normalize_label(name)
+        if not key or key in self._by_key:
+            return None
+
+        with self._lock:
+            entry_id = len(self.entries)
+            self.entries.append(SearchEntry(name, key, source, barcode))
+            self._by_key[key] = entry_id
+            trigrams = set(_trigrams(key))
+            self._trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                self._trigram_index.setdefault(trigram, []).append(entry_id)
+            self._prefixes_dirty = True
+        return entry_id
+
+    def _prefix_list(self) -> List:
+        if self._prefixes_dirty:
+            # Full names and every word start, so "pie" completes "apple pie"
+            prefixes = []
+            for entry_id, entry in enumerate(self.entries):
+                prefixes.append((entry.key, entry_id))
+                words = entry.key.split(" ")
+                for i in range(1, len(words)):
+                    prefixes.append((" ".join(words[i:]), entry_id))
+            prefixes.sort()
+            self._prefixes = prefixes
+            self._prefixes_dirty = False
+        return self._prefixes
+
+    def _rank(self, entry_id: int):
+        entry = self.entries[entry_id]
+        return SOURCE_PRIORITY.get(entry.source, 9), len(entry.key)
+
+    def search(self, query: str, limit: int = 5) -> List[SearchMatch]:
+        """Returns up to `limit` entries most similar to `query`, best first, scored 0..1."""
+        key = normalize_label(query)
+        if not key:
+            return []
+
+        exact = self._by_key.get(key)
+        if exact is not None and limit == 1:
+            return [SearchMatch(self.entries[exact], 1.0)]
+
+        query_trigrams = set(_trigrams(key))
+        overlap = Counter()
+        for trigram in query_trigrams:
+            overlap.update(self._trigram_index.get(trigram, ()))
+
+        # Rank by trigram Dice coefficient first; only the best few get the edit-distance check
+        query_count = len(query_trigrams)
+        counts = self._trigram_counts
+        dice_scores = sorted(
+            ((2 * shared / (query_count + counts[entry_id]), entry_id) for entry_id, shared in overlap.items()),
+            reverse=True,
+        )[:SEARCH_CANDIDATES]
+
+        matches = []
+        best = 0.0
+        for dice, entry_id in dice_scores:
+            # Candidates come in descending Dice order, so once the best score beats the
+            # highest score still reachable (distance 0), the rest cannot win
+            if limit == 1 and best >= 0.5 + 0.5 * dice:
+                break
+            entry = self.entries[entry_id]
+            longest = max(len(key), len(entry.key))
+            limit_distance = max(1, longest // 2)
+            distance = edit_distance(key, entry.key, limit_distance)
+            if distance > limit_distance:
+                continue
+            score = 0.5 * (1 - distance / longest) + 0.5 * dice
+            best = max(best, score)
+            matches.append(SearchMatch(entry, round(score, 4)))
+
+        matches.sort(key=lambda match: (-match.score, self._rank(self._by_key[match.entry.key])))
+        return matches[:limit]
+
+    def resolve(self, query: str, threshold: float = SEARCH_MATCH_THRESHOLD) -> Optional[SearchMatch]:
+        """Maps a free-text query to a canonical food, or None if nothing is close enough."""
+        matches = self.search(query, limit=1)
+        if matches and matches[0].score >= threshold:
+            return matches[0]
+        return None
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> List[SearchEntry]:
+        """Entries whose name or any word of it starts with `prefix`; falls back to fuzzy matches."""
+        key = " ".join(prefix.strip().lower().replace("_", " ").split())
+        if not key:
+            return []
+
+        prefixes = self._prefix_list()
+        start = bisect.bisect_left(prefixes, (key,))
+        seen = {}
+        for text, entry_id in prefixes[start:]:
+            if not text.startswith(key):
+                break
+            seen.setdefault(entry_id, None)
+            if len(seen) >= limit * 20:
+                break
+
+        if seen:
+            ranked = sorted(seen, key=self._rank)[:limit]
+            return [self.entries[entry_id] for entry_id in ranked]
+        return [match.entry for match in self.search(key, limit)]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+def _off_product_names(limit: int):
+    if limit <= 0 or not os.path.exists(OFF_INDEX_PATH):
+        return []
+    conn = sqlite3.connect(f"file:{OFF_INDEX_PATH}?mode=ro", uri=True)
+    try:
+        return conn.execute(
+            "SELECT name, barcode FROM products WHERE name IS NOT NULL AND name != '' LIMIT ?", (limit,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+def build_index() -> FoodSearchIndex:
+    index = FoodSearchIndex()
+    for label in ALL_LABELS:
+        index.add(label.replace("_", " "), "label")
+    for key in summary_cache.keys():
+        index.add(key, "cache")
+    for name, barcode in _off_product_names(SEARCH_MAX_OFF_NAMES):
+        index.add(name, "openfoodfacts", barcode)
+    print(f"[INFO] Built food search index with {len(index)} entries")
+    return index
+
+_index: Optional[FoodSearchIndex] = None
+_index_lock = threading.Lock()
+
+def get_search_index() -> FoodSearchIndex:
+    """Builds the process-wide search index on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+async def get_search_index_async() -> FoodSearchIndex:
+    """
+    get_search_index() for async code: the first build (up to SEARCH_MAX_OFF_NAMES OFF
+    names) runs in a worker thread instead of blocking the event loop.
+    """
+    if _index is not None:
+        return _index
+    return await asyncio.to_thread(get_search_index)
+
+async def _warm_up():
+    try:
+        await get_search_index_async()
+    except Exception as e:
+        # The next lookup tries again
+        print(f"[WARNING] Could not build food search index: {str(e)}")
+
+_warmup: Optional[asyncio.Task] = None
+
+def start_search_index():
+    """Starts building the index in the background at startup, so boot is not delayed."""
+    global _warmup
+    _warmup = asyncio.ensure_future(_warm_up())
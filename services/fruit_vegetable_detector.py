@@ -1,25 +1,69 @@
 import os
-import time
-import requests
-from dotenv import load_dotenv
-from typing import Optional, Dict, Any
-
-# Load environment variables from .env file
-load_dotenv()
-HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
+import asyncio
+import httpx
+from typing import Dict, List, Optional, Sequence, Union
+from services.http_client import get_upstream, CircuitOpenError
+from services.image_utils import ImageBuffer, sniff_content_type, as_request_body
+from services.local_inference import use_local_backend, classify_local, classify_local_async, classify_local_batch_async
+from config import HUGGINGFACE_TOKEN
 
 # API configuration
-API_URL = "https://api-inference.huggingface.co/models/jazzmacedo/fruits-and-vegetables-detector-36"
+HF_API_BASE = os.getenv("HF_API_BASE", "https://api-inference.huggingface.co/models")
+API_URL = f"{HF_API_BASE}/jazzmacedo/fruits-and-vegetables-detector-36"
 
 # Custom Exception for API Failures
 class HuggingFaceAPIError(Exception):
     pass
 
-def detect_fruit_or_vegetable(image_path: str, retries: int = 3, delay: int = 5) -> Dict[str, Any]:
+def _build_headers(image: ImageBuffer, content_type: Optional[str]) -> dict:
+    """Builds request headers, sniffing the content type from magic bytes if not given."""
+    return {
+        "Authorization": f"Bearer {HUGGINGFACE_TOKEN}",
+        "Content-Type": content_type or sniff_content_type(image) or "image/jpeg"
+    }
 
-    # Validate environment
-    if not HUGGINGFACE_TOKEN:
-        raise EnvironmentError("HUGGINGFACE_TOKEN not set in environment variables.")
+def _handle_response(response) -> Optional[List[Dict]]:
+    """
+    Interprets a Hugging Face API response.
+    Returns the predictions as [{"label", "score"}], or None while the model is still loading (503).
+    """
+    if response.status_code == 200:
+        try:
+            result = response.json()
+
+            if isinstance(result, list) and len(result) > 0:
+                return [{"label": item["label"], "score": float(item["score"])} for item in result]
+
+            else:
+                raise HuggingFaceAPIError("Unexpected API response format.")
+
+        except (KeyError, ValueError) as e:
+            raise HuggingFaceAPIError(f"Failed to parse API response: {e}")
+
+    elif response.status_code == 503:
+        return None
+
+    elif response.status_code == 400:
+        try:
+            print("[DEBUG] 400 Error Response:", response.json())
+        except Exception:
+            print("[DEBUG] 400 Error Response (non-JSON):", response.text)
+        raise HuggingFaceAPIError("Bad request. Possibly malformed image or model input error.")
+
+    elif response.status_code == 401:
+        raise HuggingFaceAPIError("Authentication failed. Check your HUGGINGFACE_TOKEN.")
+
+    elif response.status_code == 404:
+        raise HuggingFaceAPIError("Model not found. Check the model name and availability.")
+
+    else:
+        try:
+            error_detail = response.json().get("error", response.text)
+        except Exception:
+            error_detail = response.text
+        raise HuggingFaceAPIError(f"API error {response.status_code}: {error_detail}")
+
+def detect_fruit_or_vegetable(image_path: str, retries: int = 3, delay: int = 5) -> str:
 
     # Validate file existence
     if not os.path.exists(image_path):
@@ -32,77 +76,98 @@ def detect_fruit_or_vegetable(image_path: str, retries: int = 3, delay: int = 5)
     except IOError as e:
         raise HuggingFaceAPIError(f"Failed to read image file: {e}")
 
-    # Determine content type from file extension
-    content_type = "image/jpeg"
-    if image_path.endswith(".png"):
-        content_type = "image/png"
-    elif image_path.endswith(".bmp"):
-        content_type = "image/bmp"
-    elif image_path.endswith(".gif"):
-        content_type = "image/gif"
-    elif image_path.endswith(".webp"):
-        content_type = "image/webp"
-
-    headers = {
-        "Authorization": f"Bearer {HUGGINGFACE_TOKEN}",
-        "Content-Type": content_type
-    }
+    return detect_fruit_or_vegetable_bytes(image_data, retries=retries, delay=delay)
 
-    # Retry logic for API calls
-    for attempt in range(retries):
-        try:
-            response = requests.post(
-                API_URL,
-                headers=headers,
-                data=image_data,
-                timeout=30
-            )
-
-            if response.status_code == 200:
-                try:
-                    result = response.json()
-
-                    if isinstance(result, list) and len(result) > 0:
-                        return result[0]["label"],
-                        
-                    elif isinstance(result, dict):
-                        return result[0]["label"],
-                        
-                    else:
-                        raise HuggingFaceAPIError("Unexpected API response format.")
-
-                except (KeyError, ValueError) as e:
-                    raise HuggingFaceAPIError(f"Failed to parse API response: {e}")
-
-            elif response.status_code == 503:
-                print(f"[INFO] Model is loading, retrying in {delay} seconds... (Attempt {attempt + 1}/{retries})")
-                if attempt < retries - 1:
-                    time.sleep(delay)
-
-            elif response.status_code == 400:
-                try:
-                    print("[DEBUG] 400 Error Response:", response.json())
-                except Exception:
-                    print("[DEBUG] 400 Error Response (non-JSON):", response.text)
-                raise HuggingFaceAPIError("Bad request. Possibly malformed image or model input error.")
-
-            elif response.status_code == 401:
-                raise HuggingFaceAPIError("Authentication failed. Check your HUGGINGFACE_TOKEN.")
-
-            elif response.status_code == 404:
-                raise HuggingFaceAPIError("Model not found. Check the model name and availability.")
+def detect_fruit_or_vegetable_bytes(image: ImageBuffer, content_type: Optional[str] = None, retries: int = 3, delay: int = 5) -> str:
+    """
+    Classifies an in-memory image buffer; the content type is sniffed from magic bytes if omitted.
+    """
+    return classify_fruit_or_vegetable_bytes(image, content_type, top_k=1, retries=retries, delay=delay)[0]["label"]
 
-            else:
-                try:
-                    error_detail = response.json().get("error", response.text)
-                except:
-                    error_detail = response.text
-                raise HuggingFaceAPIError(f"API error {response.status_code}: {error_detail}")
-
-        except requests.exceptions.RequestException as e:
-            if attempt == retries - 1:
-                raise HuggingFaceAPIError(f"Network error: {e}")
-            print(f"[WARNING] Network error on attempt {attempt + 1}, retrying: {e}")
-            time.sleep(delay)
-
-    raise HuggingFaceAPIError("Model did not load in time. Please try again later.")
+def classify_fruit_or_vegetable_bytes(image: ImageBuffer, content_type: Optional[str] = None, top_k: int = 5,
+                                      retries: int = 3, delay: int = 5) -> List[Dict]:
+    """
+    Returns the top_k predictions as [{"label", "score"}] sorted by descending score.
+    """
+
+    # Local ONNX backend, if selected
+    if use_local_backend():
+        return classify_local("fruit-vegetable", image, top_k)
+
+    # Validate environment
+    if not HUGGINGFACE_TOKEN:
+        raise EnvironmentError("HUGGINGFACE_TOKEN not set in environment variables.")
+
+    headers = _build_headers(image, content_type)
+    body = as_request_body(image)
+
+    # Retries with jittered exponential backoff happen in the shared upstream client
+    try:
+        response = get_upstream().request("POST", API_URL, headers=headers, content=body,
+                                          retries=retries, backoff=delay)
+    except CircuitOpenError as e:
+        raise HuggingFaceAPIError(f"Inference API temporarily unavailable: {e}")
+    except httpx.HTTPError as e:
+        raise HuggingFaceAPIError(f"Network error: {e}")
+
+    predictions = _handle_response(response)
+    if predictions is None:
+        raise HuggingFaceAPIError("Model did not load in time. Please try again later.")
+    return predictions[:top_k]
+
+async def detect_fruit_or_vegetable_async(image: ImageBuffer, content_type: Optional[str] = None, retries: int = 3, delay: float = 5, timeout: float = 30) -> str:
+    """
+    Non-blocking variant of detect_fruit_or_vegetable_bytes for async routes.
+    Uses the shared upstream client, asyncio.sleep backoff and a per-call timeout.
+    """
+    predictions = await classify_fruit_or_vegetable_async(image, content_type, top_k=1, retries=retries, delay=delay, timeout=timeout)
+    return predictions[0]["label"]
+
+async def classify_fruit_or_vegetable_async(image: ImageBuffer, content_type: Optional[str] = None, top_k: int = 5,
+                                            retries: int = 3, delay: float = 5, timeout: float = 30) -> List[Dict]:
+    """
+    Non-blocking variant of classify_fruit_or_vegetable_bytes.
+    """
+
+    # Local ONNX backend, if selected
+    if use_local_backend():
+        return await classify_local_async("fruit-vegetable", image, top_k)
+
+    # Validate environment
+    if not HUGGINGFACE_TOKEN:
+        raise EnvironmentError("HUGGINGFACE_TOKEN not set in environment variables.")
+
+    headers = _build_headers(image, content_type)
+    body = as_request_body(image)
+
+    try:
+        response = await get_upstream().arequest("POST", API_URL, headers=headers, content=body,
+                                                 retries=retries, backoff=delay, timeout=timeout)
+    except CircuitOpenError as e:
+        raise HuggingFaceAPIError(f"Inference API temporarily unavailable: {e}")
+    except httpx.HTTPError as e:
+        raise HuggingFaceAPIError(f"Network error: {e}")
+
+    predictions = _handle_response(response)
+    if predictions is None:
+        raise HuggingFaceAPIError("Model did not load in time. Please try again later.")
+    return predictions[:top_k]
+
+async def classify_fruit_or_vegetable_batch_async(images: Sequence[ImageBuffer], content_type: Optional[str] = None, top_k: int = 5,
+                                                  retries: int = 3, delay: float = 5, timeout: float = 30) -> List[Union[List[Dict], Exception]]:
+    """
+    Classifies several images, returning the predictions of each in input order.
+    The local backend runs them as one batch; the Inference API takes one image per
+    request, so those calls are sent concurrently over the shared connection pool.
+    An image whose call failed gets its exception in place of predictions; if every
+    call failed, the first error is raised.
+    """
+    if use_local_backend():
+        return await classify_local_batch_async("fruit-vegetable", images, top_k)
+    results = await asyncio.gather(
+        *(classify_fruit_or_vegetable_async(image, content_type, top_k, retries, delay, timeout) for image in images),
+        return_exceptions=True,
+    )
+    if results and all(isinstance(result, Exception) for result in results):
+        raise results[0]
+    return list(results)
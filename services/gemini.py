@@ -1,6 +1,11 @@
-from google import genai
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
+from typing import AsyncIterator, Dict, List
+import asyncio
+import threading
 import os
+from config import GEMINI_API_KEY
+from services.rate_limit import rate_limiter
 
 # Define the response schema using Pydantic
 class NutritionSummary(BaseModel):
@@ -18,18 +23,60 @@ class NutritionSummary(BaseModel):
     serving_notes: str
 
 
-# Initialize the Gemini client with API key
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# The Gemini client is created on first use: importing google.genai and building the
+# client is the slowest part of importing the app
+_client = None
+_client_lock = threading.Lock()
 
-def generate_summary(food_item: str) -> NutritionSummary:
-    """
-    Generates a structured nutritional summary and key nutrients of the specified food item
-    using the Gemini 2.0 Flash model.
-    """
-    prompt = f"""
-    Provide a structured nutritional breakdown for {food_item} in JSON format.
-    Include the following data fields:
-    {{
+def get_client():
+    """Returns the process-wide Gemini client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                http_options = {"base_url": GEMINI_API_BASE} if GEMINI_API_BASE else None
+                _client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _client
+
+MODEL_NAME = "gemini-2.0-flash"
+
+# Override the API endpoint, e.g. to point at the fake server in benchmarks/
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE")
+
+# Upper bound for a single async generation call, in seconds
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+# Max number of Gemini calls in flight per worker, to stay under the API rate limit
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# Max number of food items packed into one batched generation call
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", "10"))
+
+_semaphore = None
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return _semaphore
+
+def _is_rate_limited(e: Exception) -> bool:
+    # google.genai.errors.APIError carries the HTTP status in `code`
+    return getattr(e, "code", None) == 429
+
+@asynccontextmanager
+async def _gemini_slot():
+    """Concurrency limit, shared rate limit and 429 feedback around one Gemini call."""
+    async with _get_semaphore():
+        await rate_limiter.acquire_async("gemini")
+        try:
+            yield
+        except Exception as e:
+            if _is_rate_limited(e):
+                await rate_limiter.penalize_async("gemini")
+            raise
+
+def _field_spec(food_item: str) -> str:
+    return f"""{{
         "food_item": "{food_item}",
         "summary": "Brief nutritional and health benefits summary",
         "calories": "Calories per 100g",
@@ -42,37 +89,150 @@ def generate_summary(food_item: str) -> NutritionSummary:
         "average_serving_size": "Description or weight (g) of a typical serving",
         "calories_per_serving": "Estimated calories per typical serving",
         "serving_notes": "Additional remarks on the serving size"
-    }}
+    }}"""
+
+def _build_prompt(food_item: str) -> str:
+    return f"""
+    Provide a structured nutritional breakdown for {food_item} in JSON format.
+    Include the following data fields:
+    {_field_spec(food_item)}
+    Return the pure JSON without extra commentary.
+    """
+
+def _build_batch_prompt(food_items: List[str]) -> str:
+    items = "\n".join(f"    - {item}" for item in food_items)
+    return f"""
+    Provide a structured nutritional breakdown for each of the following food items:
+{items}
+    Return a JSON array with exactly one object per food item, in the same order.
+    Each object must include the following data fields:
+    {_field_spec("<food item name exactly as listed>")}
     Return the pure JSON without extra commentary.
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[prompt],
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": NutritionSummary,
-        },
+def _generation_config() -> dict:
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": NutritionSummary,
+    }
+
+def _empty_summary(food_item: str) -> NutritionSummary:
+    return NutritionSummary(
+        food_item=food_item,
+        summary="N/A",
+        calories="N/A",
+        protein="N/A",
+        carbohydrates="N/A",
+        fats="N/A",
+        fiber="N/A",
+        sugar="N/A",
+        health_rating="Unknown",
+        average_serving_size="N/A",
+        calories_per_serving="N/A",
+        serving_notes="N/A"
     )
 
+def generate_summary(food_item: str) -> NutritionSummary:
+    """
+    Generates a structured nutritional summary and key nutrients of the specified food item
+    using the Gemini 2.0 Flash model.
+    """
+    rate_limiter.acquire("gemini")
+    try:
+        response = get_client().models.generate_content(
+            model=MODEL_NAME,
+            contents=[_build_prompt(food_item)],
+            config=_generation_config(),
+        )
+    except Exception as e:
+        if _is_rate_limited(e):
+            rate_limiter.penalize("gemini")
+        raise
+
     # Return parsed response if available
     if response.parsed:
         structured_data = response.parsed
     else:
-        structured_data = NutritionSummary(
-            food_item=food_item,
-            summary="N/A",
-            calories="N/A",
-            protein="N/A",
-            carbohydrates="N/A",
-            fats="N/A",
-            fiber="N/A",
-            sugar="N/A",
-            health_rating="Unknown",
-            average_serving_size="N/A",
-            calories_per_serving="N/A",
-            serving_notes="N/A"
+        structured_data = _empty_summary(food_item)
+
+    return structured_data
+
+async def generate_summary_async(food_item: str, timeout: float = GEMINI_TIMEOUT) -> NutritionSummary:
+    """
+    Non-blocking variant of generate_summary using the client's asyncio API.
+    Raises asyncio.TimeoutError if Gemini does not answer within `timeout` seconds.
+    """
+    async with _gemini_slot():
+        response = await asyncio.wait_for(
+            get_client().aio.models.generate_content(
+                model=MODEL_NAME,
+                contents=[_build_prompt(food_item)],
+                config=_generation_config(),
+            ),
+            timeout=timeout,
         )
 
+    # Return parsed response if available
+    if response.parsed:
+        structured_data = response.parsed
+    else:
+        structured_data = _empty_summary(food_item)
+
     return structured_data
- 
\ No newline at end of file
+
+async def generate_summaries_async(food_items: List[str], timeout: float = GEMINI_TIMEOUT) -> Dict[str, NutritionSummary]:
+    """
+    Generates summaries for several food items in a single Gemini call, using a
+    list-of-NutritionSummary response schema.
+
+    Returns a dict keyed by the requested food item. Items Gemini skipped or renamed
+    beyond recognition are missing from the result.
+    """
+    async with _gemini_slot():
+        response = await asyncio.wait_for(
+            get_client().aio.models.generate_content(
+                model=MODEL_NAME,
+                contents=[_build_batch_prompt(food_items)],
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": list[NutritionSummary],
+                },
+            ),
+            timeout=timeout,
+        )
+
+    parsed = response.parsed or []
+    by_name = {summary.food_item.strip().lower(): summary for summary in parsed}
+
+    results = {}
+    for index, food_item in enumerate(food_items):
+        summary = by_name.get(food_item.strip().lower())
+        # Fall back to position when Gemini echoed a slightly different name
+        if summary is None and len(parsed) == len(food_items):
+            summary = parsed[index]
+        if summary is not None:
+            results[food_item] = summary
+    return results
+
+async def stream_summary_async(food_item: str, timeout: float = GEMINI_TIMEOUT) -> AsyncIterator[str]:
+    """
+    Streams the raw JSON text of a structured summary as Gemini produces it.
+    `timeout` bounds the wait for each chunk rather than the whole stream.
+    """
+    async with _gemini_slot():
+        stream = await asyncio.wait_for(
+            get_client().aio.models.generate_content_stream(
+                model=MODEL_NAME,
+                contents=[_build_prompt(food_item)],
+                config=_generation_config(),
+            ),
+            timeout=timeout,
+        )
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            if chunk.text:
+                yield chunk.text
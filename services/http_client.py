@@ -0,0 +1,347 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import importlib.util
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+import httpx
+from services.metrics import (RETRY_SLEEP_SECONDS, UPSTREAM_RESPONSES, UPSTREAM_RETRIES,
+                              UPSTREAM_SECONDS, span)
+from services.rate_limit import RateLimitedError, rate_limiter
+
+# Upstream client config
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+UPSTREAM_DEFAULT_POOL_SIZE = int(os.getenv("UPSTREAM_DEFAULT_POOL_SIZE", "20"))
+# Per-host pool sizes, e.g. "api-inference.huggingface.co=64,world.openfoodfacts.org=16"
+UPSTREAM_POOL_SIZES = os.getenv("UPSTREAM_POOL_SIZES", "api-inference.huggingface.co=64")
+UPSTREAM_BACKOFF_CAP = float(os.getenv("UPSTREAM_BACKOFF_CAP", "20"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Use HTTP/2 when the optional h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit breaker is open or whose rate limit is exhausted."""
+    pass
+
+def _parse_pool_sizes(spec: str) -> Dict[str, int]:
+    sizes = {}
+    for item in spec.split(","):
+        host, _, size = item.strip().partition("=")
+        if host and size.isdigit():
+            sizes[host] = int(size)
+    return sizes
+
+def backoff_delay(attempt: int, base: float, cap: float = UPSTREAM_BACKOFF_CAP) -> float:
+    """Exponential backoff with equal jitter: half the window is fixed, half is random."""
+    window = min(cap, base * (2 ** attempt))
+    return window / 2 + random.uniform(0, window / 2)
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value and value.replace(".", "", 1).isdigit():
+        return float(value)
+    return None
+
+def _adapt_rate_limit(host: str, response: httpx.Response):
+    """Slows the host's token bucket down on 429 and pauses it for any Retry-After."""
+    retry_after = _retry_after(response)
+    if response.status_code == 429:
+        rate_limiter.penalize(host, retry_after)
+    elif retry_after:
+        rate_limiter.penalize(host, retry_after, slow_down=False)
+
+async def _adapt_rate_limit_async(host: str, response: httpx.Response):
+    retry_after = _retry_after(response)
+    if response.status_code == 429:
+        await rate_limiter.penalize_async(host, retry_after)
+    elif retry_after:
+        await rate_limiter.penalize_async(host, retry_after, slow_down=False)
+
+def _is_upstream_failure(response: httpx.Response) -> bool:
+    """
+    Whether a retryable response should count toward the circuit breaker. 429s are the
+    rate limiter's job, and Hugging Face's cold-start 503 ("model is loading", with an
+    `estimated_time`) is normal warm-up, so only other 5xx responses count.
+    """
+    if response.status_code < 500:
+        return False
+    if response.status_code == 503:
+        body = response.text.lower()
+        if "estimated_time" in body or "loading" in body:
+            return False
+    return True
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After `failure_threshold` consecutive failures the circuit
+    opens and calls fail fast for `reset_timeout` seconds; then a single trial call is let
+    through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Frees a half-open trial that ended without an outcome (e.g. the caller was cancelled)."""
+        with self._lock:
+            if self.opened_at is not None:
+                self._trial_in_flight = False
+
+class UpstreamClient:
+    """
+    Shared HTTP layer for all upstream APIs (Hugging Face, OpenFoodFacts).
+
+    Keeps one keep-alive connection pool per host for both sync and async callers, with
+    HTTP/2 where available, connect/read timeouts, a per-host circuit breaker and
+    jittered exponential backoff for retryable failures.
+
+    Tests can pass `transport` / `async_transport` (e.g. httpx.MockTransport) or point the
+    service base URLs at a local stub server.
+    """
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None,
+                 async_transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._transport = transport
+        self._async_transport = async_transport
+        self._pool_sizes = _parse_pool_sizes(UPSTREAM_POOL_SIZES)
+        self._timeout = httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _limits(self, host: str) -> httpx.Limits:
+        size = self._pool_sizes.get(host, UPSTREAM_DEFAULT_POOL_SIZE)
+        return httpx.Limits(max_connections=size, max_keepalive_connections=size)
+
+    def _client(self, host: str) -> httpx.Client:
+        client = self._clients.get(host)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(host)
+                if client is None:
+                    client = httpx.Client(timeout=self._timeout, limits=self._limits(host),
+                                          http2=HTTP2_AVAILABLE, transport=self._transport)
+                    self._clients[host] = client
+        return client
+
+    def _async_client(self, host: str) -> httpx.AsyncClient:
+        client = self._async_clients.get(host)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits(host),
+                                       http2=HTTP2_AVAILABLE, transport=self._async_transport)
+            self._async_clients[host] = client
+        return client
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(host, CircuitBreaker())
+        return breaker
+
+    def _next_delay(self, attempt: int, backoff: float, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                return min(retry_after, UPSTREAM_BACKOFF_CAP)
+        return backoff_delay(attempt, backoff)
+
+    def request(self, method: str, url: str, *, retries: int = 1, backoff: float = 0.5,
+                retry_statuses: Iterable[int] = RETRY_STATUSES, **kwargs) -> httpx.Response:
+        """
+        Sends a request, retrying network errors and `retry_statuses` up to `retries` attempts.
+        Returns the last response (which may still have a retryable status).
+
+        Raises:
+            RateLimitedError: If no rate-limit token for the host frees up in time.
+            CircuitOpenError: If the host's circuit breaker is open.
+            httpx.HTTPError: If the last attempt failed at the network level.
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        client = self._client(host)
+
+        for attempt in range(retries):
+            # Take the rate-limit token first so a rejection never holds a half-open trial
+            try:
+                rate_limiter.acquire(host)
+            except RateLimitedError:
+                UPSTREAM_RESPONSES.inc(host, "rate_limited")
+                raise
+            if not breaker.allow():
+                UPSTREAM_RESPONSES.inc(host, "circuit_open")
+                raise CircuitOpenError(f"Circuit open for {host}")
+
+            response = None
+            started_at = time.perf_counter()
+            try:
+                response = client.request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started_at, host)
+                UPSTREAM_RESPONSES.inc(host, "error")
+                breaker.record_failure()
+                if attempt == retries - 1:
+                    raise
+                UPSTREAM_RETRIES.inc(host, "error")
+                print(f"[WARNING] {host} network error on attempt {attempt + 1}, retrying: {e}")
+            except BaseException:
+                # Cancelled or failed outside the network layer: no outcome, so free the trial
+                breaker.release_trial()
+                raise
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started_at, host)
+                UPSTREAM_RESPONSES.inc(host, str(response.status_code))
+                if response.status_code not in retry_statuses:
+                    breaker.record_success()
+                    return response
+                if _is_upstream_failure(response):
+                    breaker.record_failure()
+                else:
+                    # The host answered; it is busy or warming up, not down
+                    breaker.record_success()
+                _adapt_rate_limit(host, response)
+                if attempt == retries - 1:
+                    return response
+                UPSTREAM_RETRIES.inc(host, str(response.status_code))
+                print(f"[INFO] {host} returned {response.status_code}, retrying (Attempt {attempt + 1}/{retries})")
+
+            delay = self._next_delay(attempt, backoff, response)
+            RETRY_SLEEP_SECONDS.inc(host, amount=delay)
+            with span("retry_sleep"):
+                time.sleep(delay)
+
+        raise RuntimeError("retries must be at least 1")
+
+    async def arequest(self, method: str, url: str, *, retries: int = 1, backoff: float = 0.5,
+                       retry_statuses: Iterable[int] = RETRY_STATUSES, **kwargs) -> httpx.Response:
+        """Async counterpart of request(); sleeps with asyncio.sleep and honours task cancellation."""
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        client = self._async_client(host)
+
+        for attempt in range(retries):
+            # Take the rate-limit token first so a rejection never holds a half-open trial
+            try:
+                await rate_limiter.acquire_async(host)
+            except RateLimitedError:
+                UPSTREAM_RESPONSES.inc(host, "rate_limited")
+                raise
+            if not breaker.allow():
+                UPSTREAM_RESPONSES.inc(host, "circuit_open")
+                raise CircuitOpenError(f"Circuit open for {host}")
+
+            response = None
+            started_at = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started_at, host)
+                UPSTREAM_RESPONSES.inc(host, "error")
+                breaker.record_failure()
+                if attempt == retries - 1:
+                    raise
+                UPSTREAM_RETRIES.inc(host, "error")
+                print(f"[WARNING] {host} network error on attempt {attempt + 1}, retrying: {e}")
+            except BaseException:
+                # Cancelled or failed outside the network layer: no outcome, so free the trial
+                breaker.release_trial()
+                raise
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started_at, host)
+                UPSTREAM_RESPONSES.inc(host, str(response.status_code))
+                if response.status_code not in retry_statuses:
+                    breaker.record_success()
+                    return response
+                if _is_upstream_failure(response):
+                    breaker.record_failure()
+                else:
+                    # The host answered; it is busy or warming up, not down
+                    breaker.record_success()
+                await _adapt_rate_limit_async(host, response)
+                if attempt == retries - 1:
+                    return response
+                UPSTREAM_RETRIES.inc(host, str(response.status_code))
+                print(f"[INFO] {host} returned {response.status_code}, retrying (Attempt {attempt + 1}/{retries})")
+
+            delay = self._next_delay(attempt, backoff, response)
+            RETRY_SLEEP_SECONDS.inc(host, amount=delay)
+            with span("retry_sleep"):
+                await asyncio.sleep(delay)
+
+        raise RuntimeError("retries must be at least 1")
+
+    def close(self):
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+    async def aclose(self):
+        for client in self._async_clients.values():
+            await client.aclose()
+        self._async_clients.clear()
+        self.close()
+
+_upstream: Optional[UpstreamClient] = None
+
+def get_upstream() -> UpstreamClient:
+    """Returns the process-wide upstream client, creating it on first use."""
+    global _upstream
+    if _upstream is None:
+        _upstream = UpstreamClient()
+    return _upstream
+
+def set_upstream(client: Optional[UpstreamClient]):
+    """Replaces the process-wide upstream client (e.g. with one wired to stub transports)."""
+    global _upstream
+    _upstream = client
+
+async def close_upstream():
+    """Closes all pooled upstream connections (call on application shutdown)."""
+    global _upstream
+    if _upstream is not None:
+        await _upstream.aclose()
+        _upstream = None
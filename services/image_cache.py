@@ -0,0 +1,210 @@
+import io
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from PIL import Image
+from services.image_utils import ImageBuffer
+from services.metrics import register_cache_stats
+
+# Cache config
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", str(24 * 60 * 60)))
+# Max number of differing dHash bits for two images to count as near-duplicates
+IMAGE_CACHE_HAMMING_THRESHOLD = int(os.getenv("IMAGE_CACHE_HAMMING_THRESHOLD", "6"))
+
+def sha256_digest(image: ImageBuffer) -> str:
+    """Exact content hash of the raw upload."""
+    return hashlib.sha256(image).hexdigest()
+
+def dhash(image: ImageBuffer, hash_size: int = 8) -> int:
+    """
+    Computes a 64-bit difference hash: the image is shrunk to (hash_size + 1) x hash_size
+    grayscale pixels and each bit records whether a pixel is brighter than its right neighbour.
+    Re-encoded, resized or slightly recompressed copies of a photo end up a few bits apart.
+    """
+    with Image.open(io.BytesIO(image)) as img:
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+        pixels = small.tobytes()
+
+    value = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance as the metric.
+    A radius search only descends into children whose edge distance lies within
+    [d - radius, d + radius], which prunes most of the tree for small radii.
+    """
+
+    def __init__(self):
+        self._root: Optional[Tuple[int, Dict[int, Any]]] = None
+        self.size = 0
+
+    def add(self, value: int):
+        if self._root is None:
+            self._root = (value, {})
+            self.size = 1
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """Returns (distance, hash) pairs within `radius` of `value`, nearest first."""
+        if self._root is None:
+            return []
+
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= radius:
+                matches.append((distance, node_value))
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+
+        matches.sort()
+        return matches
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    phash: Optional[int]
+    expires_at: float
+
+class ImageResultCache:
+    """
+    Two-tier cache for image classification results.
+
+    The exact tier is keyed by the SHA-256 of the upload. The perceptual tier matches
+    dHashes within a Hamming threshold through a BK-tree, so re-compressed or resized
+    copies of the same photo also hit. Entries are evicted LRU once `max_entries` is
+    reached and expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = IMAGE_CACHE_MAX_ENTRIES, ttl: float = IMAGE_CACHE_TTL,
+                 threshold: int = IMAGE_CACHE_HAMMING_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._by_phash: Dict[int, Set[str]] = {}
+        self._tree = BKTree()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_live(self, digest: str) -> Optional[_CacheEntry]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(digest)
+            return None
+        self._entries.move_to_end(digest)
+        return entry
+
+    def get(self, digest: str) -> Optional[Any]:
+        """Exact lookup by SHA-256. Misses are not counted until get_similar also misses."""
+        entry = self._get_live(digest)
+        if entry is None:
+            return None
+        self.exact_hits += 1
+        return entry.value
+
+    def get_similar(self, phash: int) -> Optional[Any]:
+        """Near-duplicate lookup: returns the value of the closest live entry within the threshold."""
+        for _, candidate in self._tree.search(phash, self.threshold):
+            for digest in list(self._by_phash.get(candidate, ())):
+                entry = self._get_live(digest)
+                if entry is not None:
+                    self.near_hits += 1
+                    return entry.value
+        self.misses += 1
+        return None
+
+    def put(self, digest: str, phash: Optional[int], value: Any):
+        if digest in self._entries:
+            self._remove(digest)
+
+        self._entries[digest] = _CacheEntry(value, phash, time.monotonic() + self.ttl)
+        if phash is not None:
+            if phash not in self._by_phash:
+                self._by_phash[phash] = set()
+                self._tree.add(phash)
+            self._by_phash[phash].add(digest)
+
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, digest: str):
+        entry = self._entries.pop(digest)
+        if entry.phash is None:
+            return
+
+        digests = self._by_phash.get(entry.phash)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_phash[entry.phash]
+
+        # BK-trees do not support deletion; rebuild once stale hashes outnumber live ones
+        if self._tree.size > 2 * len(self._by_phash) + 64:
+            self._tree = BKTree()
+            for value in self._by_phash:
+                self._tree.add(value)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_phash.clear()
+        self._tree = BKTree()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+# One cache per classifier, since the same image maps to different labels in each
+_caches: Dict[str, ImageResultCache] = {}
+
+def get_image_cache(namespace: str) -> ImageResultCache:
+    if namespace not in _caches:
+        _caches[namespace] = ImageResultCache()
+    return _caches[namespace]
+
+def image_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {namespace: cache.stats() for namespace, cache in _caches.items()}
+
+register_cache_stats(lambda: {f"image:{namespace}": stats for namespace, stats in image_cache_stats().items()})
@@ -0,0 +1,101 @@
+import io
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from PIL import Image, ImageOps, UnidentifiedImageError
+from services.image_utils import ImageBuffer, sniff_content_type, as_request_body
+
+# Preprocessing config. The classifiers only look at ~224px input, so anything much
+# larger than that is wasted upload bandwidth.
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MAX_SIDE = int(os.getenv("PREPROCESS_MAX_SIDE", "448"))
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "JPEG").upper()
+PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "85"))
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+    return _executor
+
+def shutdown_executor():
+    """Stops the preprocessing worker threads (call on application shutdown)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Converts to RGB, compositing transparent images onto a white background."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def preprocess_image(image: ImageBuffer, max_side: int = PREPROCESS_MAX_SIDE) -> Tuple[bytes, str]:
+    """
+    Normalizes an uploaded photo before it is sent for inference.
+
+    Applies the EXIF orientation, downscales so the longest side is at most `max_side`
+    (using JPEG draft mode so large photos are decoded at reduced resolution), and
+    re-encodes to a compact JPEG/WebP.
+
+    Args:
+        image (bytes | bytearray | memoryview): Raw image data.
+        max_side (int): Maximum width/height of the output image in pixels.
+
+    Returns:
+        tuple: (encoded image bytes, content type). If the image cannot be decoded or the
+        re-encoded version is not smaller, the original data is returned unchanged.
+    """
+    original = as_request_body(image)
+    original_type = sniff_content_type(original) or "image/jpeg"
+
+    try:
+        with Image.open(io.BytesIO(original)) as img:
+            # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+            img.draft("RGB", (max_side, max_side))
+            img = ImageOps.exif_transpose(img)
+            img = _flatten(img)
+            img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+            out = io.BytesIO()
+            img.save(out, format=PREPROCESS_FORMAT, quality=PREPROCESS_QUALITY)
+            encoded = out.getvalue()
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        print(f"[WARNING] Image preprocessing skipped, sending original: {e}")
+        return original, original_type
+
+    if len(encoded) >= len(original):
+        return original, original_type
+
+    print(f"[INFO] Preprocessed image {len(original)} -> {len(encoded)} bytes ({len(original) - len(encoded)} saved)")
+    return encoded, CONTENT_TYPES.get(PREPROCESS_FORMAT, "image/jpeg")
+
+async def preprocess_image_async(image: ImageBuffer, max_side: int = PREPROCESS_MAX_SIDE) -> Tuple[bytes, str]:
+    """
+    Runs preprocess_image on the preprocessing thread pool so decoding never blocks the event loop.
+    Pillow releases the GIL while decoding/encoding, so threads scale across cores.
+    """
+    if not PREPROCESS_ENABLED:
+        return as_request_body(image), sniff_content_type(image) or "image/jpeg"
+
+    return await run_in_pool(preprocess_image, image, max_side)
+
+async def run_in_pool(func, *args):
+    """Runs a CPU-bound image function on the preprocessing thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), func, *args)
@@ -0,0 +1,35 @@
+from typing import Optional, Union
+
+# Anything that exposes the buffer protocol can be handed to the detectors
+ImageBuffer = Union[bytes, bytearray, memoryview]
+
+def sniff_content_type(data: ImageBuffer) -> Optional[str]:
+    """
+    Detects the image content type from its leading magic bytes.
+    Returns None if the data does not look like a supported image format.
+    """
+    # Slicing a memoryview does not copy the underlying upload buffer
+    head = memoryview(data)[:16].tobytes()
+
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+def as_request_body(data: ImageBuffer) -> bytes:
+    """
+    Returns the buffer as bytes for the HTTP client.
+    bytes objects are passed through untouched; other buffers are copied once.
+    """
+    if isinstance(data, bytes):
+        return data
+    return memoryview(data).tobytes()
@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import numpy as np
+from models.food import NUTRIENT_FIELDS, Nutrients
+from models.user import UserProfile
+from services.meal_log import MealLogStore, meal_log, day_number
+
+# Intake engine config
+INTAKE_HISTORY_DAYS = int(os.getenv("INTAKE_HISTORY_DAYS", "90"))
+INTAKE_MAX_USERS = int(os.getenv("INTAKE_MAX_USERS", "10000"))
+# Multiplier from BMR to daily energy expenditure (1.2 = sedentary, 1.55 = moderately active)
+INTAKE_ACTIVITY_FACTOR = float(os.getenv("INTAKE_ACTIVITY_FACTOR", "1.375"))
+
+KCAL_PER_KG = 7700
+ROLLING_WINDOWS = (7, 30)
+
+def compute_targets(profile: UserProfile) -> Optional[Dict[str, float]]:
+    """
+    Daily calorie and macro targets from the profile, using the Mifflin-St Jeor BMR,
+    a fixed activity factor and the calorie surplus/deficit implied by the goal.
+    Returns None if weight, height or age are missing.
+    """
+    if not (profile.current_weight and profile.height_cm and profile.age):
+        return None
+
+    gender = (profile.gender or "").lower()
+    offset = 5 if gender.startswith("m") else -161 if gender.startswith("f") else -78
+    bmr = 10 * profile.current_weight + 6.25 * profile.height_cm - 5 * profile.age + offset
+    tdee = bmr * INTAKE_ACTIVITY_FACTOR
+
+    # weight_change_speed is kg per week
+    goal_type = (profile.goal_type or "maintain").lower()
+    daily_delta = (profile.weight_change_speed or 0) * KCAL_PER_KG / 7
+    if goal_type.startswith("lose"):
+        calories = max(tdee - daily_delta, 1500 if offset == 5 else 1200)
+    elif goal_type.startswith("gain"):
+        calories = tdee + daily_delta
+    else:
+        calories = tdee
+
+    protein = 1.6 * profile.current_weight
+    fats = calories * 0.25 / 9
+    carbohydrates = max(calories - protein * 4 - fats * 9, 0) / 4
+    return {
+        "bmr": round(bmr),
+        "tdee": round(tdee),
+        "calories": round(calories),
+        "protein": round(protein, 1),
+        "carbohydrates": round(carbohydrates, 1),
+        "fats": round(fats, 1),
+        "fiber": round(calories / 1000 * 14, 1),
+        "sugar": round(calories * 0.10 / 4, 1),
+    }
+
+class IntakeSeries:
+    """
+    Columnar per-day nutrient totals for one user: a (days x nutrients) float array
+    covering the last `history_days` days, ending today. New meals update one row in
+    place; rolling summaries are slices of a single cumulative sum.
+    """
+
+    def __init__(self, last_day: int, history_days: int = INTAKE_HISTORY_DAYS):
+        self.history_days = history_days
+        self.last_day = last_day
+        self.totals = np.zeros((history_days, len(NUTRIENT_FIELDS)))
+        self.logged = np.zeros(history_days, dtype=bool)
+        # Last meal id in the log the series reflects; see IntakeEngine._get_series
+        self.version: Optional[int] = None
+
+    @property
+    def first_day(self) -> int:
+        return self.last_day - self.history_days + 1
+
+    def advance_to(self, day: int):
+        """Shifts the window forward so that it ends at `day`."""
+        shift = day - self.last_day
+        if shift <= 0:
+            return
+        if shift >= self.history_days:
+            self.totals[:] = 0
+            self.logged[:] = False
+        else:
+            self.totals[:-shift] = self.totals[shift:]
+            self.totals[-shift:] = 0
+            self.logged[:-shift] = self.logged[shift:]
+            self.logged[-shift:] = False
+        self.last_day = day
+
+    def add(self, day: int, amounts: np.ndarray):
+        self.advance_to(day)
+        index = day - self.first_day
+        if index < 0:
+            return
+        self.totals[index] += np.nan_to_num(amounts)
+        self.logged[index] = True
+
+    def summary(self, today: int) -> Dict:
+        self.advance_to(today)
+        # One cumulative sum over the window answers every rolling window
+        cumulative = np.cumsum(self.totals[::-1], axis=0)
+        logged_days = np.cumsum(self.logged[::-1])
+
+        result = {"today": dict(zip(NUTRIENT_FIELDS, np.round(self.totals[-1], 1).tolist()))}
+        for window in ROLLING_WINDOWS:
+            window = min(window, self.history_days)
+            total = cumulative[window - 1]
+            days = int(logged_days[window - 1])
+            result[f"last_{window}_days"] = {
+                "days_logged": days,
+                "total": dict(zip(NUTRIENT_FIELDS, np.round(total, 1).tolist())),
+                "daily_average": dict(zip(NUTRIENT_FIELDS, np.round(total / max(days, 1), 1).tolist())),
+            }
+        return result
+
+class IntakeEngine:
+    """
+    Keeps an IntakeSeries per active user in memory (LRU-bounded), loading it from the
+    meal log on first access and updating it incrementally as meals are logged.
+
+    Other workers log meals to the same store, so a cached series is only reused while
+    the user's last meal id in the store still matches the one it was built from.
+    Routes call in from threadpool threads; `_lock` guards the LRU and the series in it.
+    """
+
+    def __init__(self, store: MealLogStore = meal_log, max_users: int = INTAKE_MAX_USERS):
+        self.store = store
+        self.max_users = max_users
+        self._series: "OrderedDict[str, IntakeSeries]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_series(self, username: str, today: int) -> IntakeSeries:
+        version = self.store.last_meal_id(username)
+        with self._lock:
+            series = self._series.get(username)
+            if series is not None and series.version == version:
+                self._series.move_to_end(username)
+                return series
+
+        # Read after the version, so the series holds at least the meals up to it
+        series = IntakeSeries(today)
+        for day, *totals in self.store.daily_totals(username, series.first_day):
+            series.add(day, np.asarray(totals, dtype=np.float64))
+        series.version = version
+        with self._lock:
+            self._series[username] = series
+            self._series.move_to_end(username)
+            while len(self._series) > self.max_users:
+                self._series.popitem(last=False)
+        return series
+
+    def log_meal(self, username: str, food_item: str, grams: float, per_100g: Nutrients,
+                 eaten_at: Optional[float] = None) -> Nutrients:
+        """Stores a meal and folds it into the user's series. Returns the portion's nutrients."""
+        eaten_at = eaten_at if eaten_at is not None else time.time()
+        amounts = per_100g.scaled(grams)
+
+        # Load the series before storing the meal, so a cold load does not count it twice
+        today = day_number(time.time())
+        series = self._get_series(username, today)
+        previous, meal_id = self.store.add_meal(username, food_item, grams, amounts, eaten_at)
+        with self._lock:
+            # If another worker logged a meal meanwhile, leave the series stale so the next read reloads
+            if series.version == previous:
+                if day_number(eaten_at) <= today:
+                    series.add(day_number(eaten_at), amounts.values)
+                series.version = meal_id
+        return amounts
+
+    def dashboard(self, username: str, profile: Optional[UserProfile] = None) -> Dict:
+        """Intake summary for the user; `profile` (from the users table) adds targets and progress."""
+        today = day_number(time.time())
+        series = self._get_series(username, today)
+        with self._lock:
+            intake = series.summary(today)
+
+        targets = compute_targets(profile) if profile else None
+        result = {"username": username, "targets": targets, **intake}
+        if targets:
+            result["progress_today"] = {
+                field: round(intake["today"][field] / targets[field] * 100, 1) if targets[field] else None
+                for field in NUTRIENT_FIELDS
+            }
+        return result
+
+intake_engine = IntakeEngine()
@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import ipaddress
+import sqlite3
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+import httpx
+from services.http_client import backoff_delay
+from services.admission import OverloadedError
+from services.metrics import counter, register_collector
+
+# Job queue config. The queue is a SQLite file shared by all gunicorn workers on the
+# host; every worker runs JOB_WORKERS consumers, so a job survives restarts and is
+# picked up by whichever worker is free.
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_PATH = os.getenv("JOBS_PATH", "cache/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# First retry delay in seconds, doubled (with jitter) for every further attempt
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+# A running job whose worker has not finished it within this many seconds is handed to another worker
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "120"))
+# Finished jobs (and their results) are kept this long for polling
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", str(24 * 60 * 60)))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+# Delay before retrying a job the admission controller turned away; not counted as an attempt
+JOB_OVERLOAD_DELAY = float(os.getenv("JOB_OVERLOAD_DELAY", "1"))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+# Comma-separated hosts callback URLs may point at; empty disables callbacks. Hosts that
+# resolve to loopback, link-local or private addresses are refused even when listed.
+JOB_CALLBACK_HOSTS = {host.strip() for host in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        dedup_key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        params TEXT NOT NULL,
+        payload BLOB,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        available_at REAL NOT NULL,
+        lease_owner TEXT,
+        lease_expires REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, available_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, status)",
+    """
+    CREATE TABLE IF NOT EXISTS job_callbacks (
+        job_id TEXT NOT NULL,
+        url TEXT NOT NULL,
+        PRIMARY KEY (job_id, url)
+    )
+    """,
+)
+
+JOBS_SUBMITTED = counter("nutrivision_jobs_submitted_total", "Jobs submitted, by kind and whether they were deduplicated.",
+                         ("kind", "outcome"))
+JOBS_FINISHED = counter("nutrivision_jobs_finished_total", "Jobs finished, by kind and final status.", ("kind", "status"))
+JOBS_RETRIED = counter("nutrivision_jobs_retried_total", "Failed job attempts that were queued again.", ("kind",))
+JOB_WEBHOOKS = counter("nutrivision_job_webhooks_total", "Webhook deliveries by outcome.", ("outcome",))
+
+# Handlers take (params, payload) and return a JSON-serializable result
+JobHandler = Callable[[Dict, Optional[bytes]], Awaitable[Dict]]
+
+class JobNotFoundError(Exception):
+    """Raised when a job ID is unknown or its result has expired."""
+    pass
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def validate_callback_url(url: str) -> bool:
+    """
+    Whether a callback URL is http(s), on an allowed host and resolves only to public
+    addresses. Checked on submit and again before every delivery, since DNS may change.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return False
+    if parts.scheme not in ("http", "https") or parts.hostname not in JOB_CALLBACK_HOSTS:
+        return False
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port or 80, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return False
+    return bool(infos) and all(_is_public(info[4][0]) for info in infos)
+
+def _public(row: sqlite3.Row) -> Dict:
+    job = {
+        "job_id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if row["status"] == DONE:
+        job["result"] = json.loads(row["result"])
+    if row["error"] is not None:
+        job["error"] = row["error"]
+    return job
+
+class JobQueue:
+    """
+    Durable queue of background jobs in SQLite.
+
+    Submitting a job whose dedup key matches a queued, running or finished (and not
+    expired) job returns the existing job instead of creating a new one. Workers claim
+    jobs with a lease, so jobs of a crashed worker are picked up again once the lease
+    expires. Failed attempts are retried with exponential backoff up to
+    JOB_MAX_ATTEMPTS; callback URLs are notified once a job is done or failed.
+
+    SQLite is only touched from worker threads (asyncio.to_thread) in async code, so
+    lock waits on the shared file do not stall the event loop.
+    """
+
+    def __init__(self, path: str = JOBS_PATH):
+        self.path = path
+        self._handlers: Dict[str, JobHandler] = {}
+        self._local = threading.local()
+        self._owner = uuid.uuid4().hex
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Detached webhook deliveries, referenced until done so they are not collected
+        self._notifications: Set[asyncio.Task] = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        self._handlers[kind] = handler
+
+    # Submitting and polling
+
+    async def submit(self, kind: str, dedup_key: Optional[str], params: Dict, payload: Optional[bytes] = None,
+                     callback_url: Optional[str] = None, result: Optional[Dict] = None) -> Dict:
+        """
+        Queues a job, or returns the existing job with the same `dedup_key`.
+        A `result` records the job as already done (e.g. answered from a cache);
+        such jobs are not deduplicated and pass None as the key.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        row, deduplicated = await asyncio.to_thread(self._insert, kind, dedup_key, params, payload,
+                                                    callback_url, result)
+
+        JOBS_SUBMITTED.inc(kind, "deduplicated" if deduplicated else "cached" if result is not None else "queued")
+        job = _public(row)
+        if callback_url and row["status"] in (DONE, FAILED):
+            # Already finished: notify right away instead of waiting for a worker
+            task = asyncio.ensure_future(self._notify([callback_url], job))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+        elif self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def _insert(self, kind: str, dedup_key: Optional[str], params: Dict, payload: Optional[bytes],
+                callback_url: Optional[str], result: Optional[Dict]) -> Tuple[sqlite3.Row, bool]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = None
+            if dedup_key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE dedup_key = ? AND status != ? AND updated_at > ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (dedup_key, FAILED, now - JOB_RESULT_TTL),
+                ).fetchone()
+            deduplicated = row is not None
+            if row is None:
+                job_id = uuid.uuid4().hex
+                dedup_key = dedup_key or job_id
+                status = QUEUED if result is None else DONE
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, dedup_key, status, params, payload, result, created_at, updated_at, "
+                    "available_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, dedup_key, status, json.dumps(params), payload if result is None else None,
+                     None if result is None else json.dumps(result), now, now, now),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if callback_url and row["status"] in (QUEUED, RUNNING):
+                conn.execute("INSERT OR IGNORE INTO job_callbacks (job_id, url) VALUES (?, ?)",
+                             (row["id"], callback_url))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row, deduplicated
+
+    def get(self, job_id: str) -> Dict:
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["status"] in (DONE, FAILED) and row["updated_at"] < time.time() - JOB_RESULT_TTL):
+            raise JobNotFoundError(f"Job {job_id} not found")
+        return _public(row)
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    # Workers
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?) "
+                "ORDER BY available_at LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (RUNNING, self._owner, now + JOB_LEASE_TTL, now, row["id"]),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return row
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        # Only the lease holder may settle a job; a stale worker's late result is dropped
+        self._connection().execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND lease_owner = ?",
+            (*fields.values(), job_id, self._owner),
+        )
+
+    def _callbacks(self, job_id: str) -> List[str]:
+        rows = self._connection().execute("SELECT url FROM job_callbacks WHERE job_id = ?", (job_id,)).fetchall()
+        return [row["url"] for row in rows]
+
+    async def _deliver(self, client: httpx.AsyncClient, url: str, job: Dict) -> bool:
+        for attempt in range(JOB_WEBHOOK_RETRIES):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1, 0.5))
+            if not await validate_callback_url(url):
+                print(f"[WARNING] Webhook for job {job['job_id']} to {url} refused: host not allowed")
+                return False
+            try:
+                response = await client.post(url, json=job)
+            except httpx.HTTPError:
+                continue
+            if response.status_code < 500:
+                return response.status_code < 400
+        return False
+
+    async def _notify(self, urls: List[str], job: Dict):
+        # Webhooks get their own short-lived client rather than the shared upstream one, so
+        # arbitrary callback hosts do not accumulate pools, breakers and rate-limit buckets
+        async with httpx.AsyncClient(timeout=JOB_WEBHOOK_TIMEOUT, follow_redirects=False) as client:
+            for url in urls:
+                ok = await self._deliver(client, url, job)
+                JOB_WEBHOOKS.inc("delivered" if ok else "failed")
+                if not ok:
+                    print(f"[WARNING] Webhook for job {job['job_id']} to {url} failed")
+
+    async def _run(self, row: sqlite3.Row):
+        job_id, kind = row["id"], row["kind"]
+        try:
+            result = await self._handlers[kind](json.loads(row["params"]), row["payload"])
+        except OverloadedError:
+            # The server is busy with interactive traffic; try again shortly without using up an attempt
+            await asyncio.to_thread(self._update, job_id, status=QUEUED, attempts=row["attempts"] - 1,
+                                    lease_owner=None, available_at=time.time() + JOB_OVERLOAD_DELAY)
+            return
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if row["attempts"] < JOB_MAX_ATTEMPTS:
+                delay = JOB_RETRY_DELAY * 2 ** (row["attempts"] - 1) * random.uniform(0.5, 1.5)
+                print(f"[WARNING] Job {job_id} attempt {row['attempts']} failed, retrying in {delay:.1f}s: {error}")
+                JOBS_RETRIED.inc(kind)
+                await asyncio.to_thread(self._update, job_id, status=QUEUED, error=error, lease_owner=None,
+                                        available_at=time.time() + delay)
+                return
+            await asyncio.to_thread(self._update, job_id, status=FAILED, error=error, payload=None, lease_owner=None)
+            JOBS_FINISHED.inc(kind, FAILED)
+        else:
+            await asyncio.to_thread(self._update, job_id, status=DONE, result=json.dumps(result), error=None,
+                                    payload=None, lease_owner=None)
+            JOBS_FINISHED.inc(kind, DONE)
+
+        urls = await asyncio.to_thread(self._callbacks, job_id)
+        if urls:
+            await self._notify(urls, await asyncio.to_thread(self.get, job_id))
+
+    async def _recover(self, row: sqlite3.Row, error: Exception):
+        """
+        Settles a job whose run broke outside the handler (e.g. SQLite errors): queued again
+        while attempts remain, failed otherwise. A job already settled is left alone,
+        since settling requires the lease.
+        """
+        message = f"Internal error: {str(error) or type(error).__name__}"
+        try:
+            if row["attempts"] < JOB_MAX_ATTEMPTS:
+                await asyncio.to_thread(self._update, row["id"], status=QUEUED, error=message, lease_owner=None,
+                                        available_at=time.time() + JOB_RETRY_DELAY)
+            else:
+                await asyncio.to_thread(self._update, row["id"], status=FAILED, error=message, payload=None,
+                                        lease_owner=None)
+                JOBS_FINISHED.inc(row["kind"], FAILED)
+        except Exception as e:
+            # The lease expires and another worker picks the job up
+            print(f"[WARNING] Could not settle job {row['id']}: {str(e)}")
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RESULT_TTL
+        conn = self._connection()
+        conn.execute("DELETE FROM job_callbacks WHERE job_id IN "
+                     "(SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?)", (DONE, FAILED, cutoff))
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff))
+
+    async def _worker(self):
+        while True:
+            try:
+                row = await asyncio.to_thread(self._claim)
+            except sqlite3.OperationalError as e:
+                # Database busy beyond the connection timeout; back off and try again
+                print(f"[WARNING] Could not claim a job: {str(e)}")
+                row = None
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(row)
+            except Exception as e:
+                # Keep the consumer alive whatever went wrong with one job
+                print(f"[WARNING] Job {row['id']} crashed its worker: {str(e) or type(e).__name__}")
+                await self._recover(row, e)
+
+    async def start(self):
+        """Starts JOB_WORKERS consumers in the running event loop."""
+        if not JOBS_ENABLED or self._workers:
+            return
+        await asyncio.to_thread(self._purge)
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(JOB_WORKERS)]
+
+    async def stop(self):
+        """Cancels the consumers. Interrupted jobs are picked up again once their lease expires."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Hand unfinished jobs back right away instead of waiting out the lease
+        await asyncio.to_thread(self._release_all)
+
+    def _release_all(self):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_owner = NULL, available_at = ? "
+            "WHERE status = ? AND lease_owner = ?",
+            (QUEUED, time.time(), RUNNING, self._owner),
+        )
+
+job_queue = JobQueue()
+
+register_collector("nutrivision_jobs", "gauge", "Jobs in the queue database by status.", ("status",),
+                   lambda: [((status,), count) for status, count in job_queue.stats().items()], shared=True)
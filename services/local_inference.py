@@ -0,0 +1,193 @@
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from PIL import Image, ImageOps
+from services.image_utils import ImageBuffer
+
+# Backend switch: "remote" uses the Hugging Face Inference API, "local" runs ONNX models on CPU
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "remote").lower()
+LOCAL_MODEL_DIR = os.getenv("LOCAL_MODEL_DIR", "onnx_models")
+# Threads used inside a single inference (ONNX Runtime intra-op parallelism)
+LOCAL_INFERENCE_THREADS = int(os.getenv("LOCAL_INFERENCE_THREADS", "2"))
+# Number of inferences that may run at the same time per worker
+LOCAL_INFERENCE_CONCURRENCY = int(os.getenv("LOCAL_INFERENCE_CONCURRENCY", "1"))
+
+# Local model name -> Hugging Face model it is exported from
+MODELS = {
+    "food": "nateraw/food",
+    "fruit-vegetable": "jazzmacedo/fruits-and-vegetables-detector-36",
+}
+
+class LocalInferenceError(Exception):
+    pass
+
+def use_local_backend() -> bool:
+    return INFERENCE_BACKEND == "local"
+
+class LocalClassifier:
+    """
+    Image classifier exported to ONNX and run with ONNX Runtime on CPU.
+
+    Expects a directory produced by `python -m services.local_inference export`, containing
+    model.onnx, config.json (for id2label) and preprocessor_config.json (resize/normalize).
+    """
+
+    def __init__(self, model_dir: str, threads: int = LOCAL_INFERENCE_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise LocalInferenceError("onnxruntime is not installed; it is required for INFERENCE_BACKEND=local.")
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        if not os.path.exists(model_path):
+            raise LocalInferenceError(f"ONNX model '{model_path}' not found. Run the export command first.")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        with open(os.path.join(model_dir, "config.json")) as f:
+            config = json.load(f)
+        self.labels = [config["id2label"][str(i)] for i in range(len(config["id2label"]))]
+
+        preprocessor = {}
+        preprocessor_path = os.path.join(model_dir, "preprocessor_config.json")
+        if os.path.exists(preprocessor_path):
+            with open(preprocessor_path) as f:
+                preprocessor = json.load(f)
+
+        size = preprocessor.get("size", 224)
+        if isinstance(size, dict):
+            self.shortest_edge = size.get("shortest_edge")
+            self.size = (size.get("height", self.shortest_edge or 224), size.get("width", self.shortest_edge or 224))
+        else:
+            self.shortest_edge = None
+            self.size = (size, size)
+        self.crop_pct = preprocessor.get("crop_pct") or 0.875
+        self.mean = np.asarray(preprocessor.get("image_mean", [0.5, 0.5, 0.5]), dtype=np.float32).reshape(3, 1, 1)
+        self.std = np.asarray(preprocessor.get("image_std", [0.5, 0.5, 0.5]), dtype=np.float32).reshape(3, 1, 1)
+        self.rescale = float(preprocessor.get("rescale_factor", 1 / 255))
+
+    def _prepare(self, image) -> np.ndarray:
+        """Decodes and normalizes one image into a CHW float32 array."""
+        if isinstance(image, Image.Image):
+            img = image.convert("RGB")
+        else:
+            with Image.open(io.BytesIO(image)) as opened:
+                opened.draft("RGB", (self.size[1] * 2, self.size[0] * 2))
+                img = ImageOps.exif_transpose(opened).convert("RGB")
+
+        height, width = self.size
+        if self.shortest_edge:
+            # Resize the short side, then center crop (ConvNeXt/ResNet style processors)
+            scale = (self.shortest_edge / self.crop_pct) / min(img.size)
+            img = img.resize((max(width, round(img.width * scale)), max(height, round(img.height * scale))), Image.Resampling.BILINEAR)
+            left = (img.width - width) // 2
+            top = (img.height - height) // 2
+            img = img.crop((left, top, left + width, top + height))
+        else:
+            img = img.resize((width, height), Image.Resampling.BILINEAR)
+
+        array = np.asarray(img, dtype=np.float32).transpose(2, 0, 1)
+        return (array * self.rescale - self.mean) / self.std
+
+    def predict(self, images: Sequence, top_k: int = 5) -> List[List[Dict]]:
+        """
+        Classifies a batch of images (encoded bytes or PIL images) in a single forward pass.
+        Returns, per image, the top_k predictions as [{"label", "score"}] sorted by score.
+        """
+        batch = np.stack([self._prepare(image) for image in images])
+        logits = self.session.run(None, {self.input_name: batch})[0]
+
+        # Softmax over classes
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        top = np.argsort(-probabilities, axis=1)[:, :top_k]
+        return [
+            [{"label": self.labels[index], "score": float(row[index])} for index in indices]
+            for row, indices in zip(probabilities, top)
+        ]
+
+_classifiers: Dict[str, LocalClassifier] = {}
+_classifiers_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+def get_local_classifier(name: str) -> LocalClassifier:
+    """Loads a local model once per worker process and reuses it afterwards."""
+    classifier = _classifiers.get(name)
+    if classifier is None:
+        with _classifiers_lock:
+            classifier = _classifiers.get(name)
+            if classifier is None:
+                classifier = LocalClassifier(os.path.join(LOCAL_MODEL_DIR, name))
+                _classifiers[name] = classifier
+                print(f"[INFO] Loaded local model '{name}' from {LOCAL_MODEL_DIR}")
+    return classifier
+
+def preload_local_models():
+    """Loads all local models up front so the first scan does not pay the load time."""
+    for name in MODELS:
+        get_local_classifier(name)
+
+def classify_local(name: str, image: ImageBuffer, top_k: int = 5) -> List[Dict]:
+    return get_local_classifier(name).predict([image], top_k)[0]
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LOCAL_INFERENCE_CONCURRENCY, thread_name_prefix="inference")
+    return _executor
+
+async def classify_local_async(name: str, image: ImageBuffer, top_k: int = 5) -> List[Dict]:
+    """Runs a local inference on the inference thread pool; ONNX Runtime releases the GIL."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), classify_local, name, image, top_k)
+
+def classify_local_batch(name: str, images: Sequence[ImageBuffer], top_k: int = 5) -> List[List[Dict]]:
+    return get_local_classifier(name).predict(images, top_k) if images else []
+
+async def classify_local_batch_async(name: str, images: Sequence[ImageBuffer], top_k: int = 5) -> List[List[Dict]]:
+    """Classifies several images in one forward pass on the inference thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), classify_local_batch, name, images, top_k)
+
+def export_model(name: str, output_dir: str = LOCAL_MODEL_DIR):
+    """Exports a Hugging Face model to ONNX (requires the optional `optimum[exporters]` package)."""
+    try:
+        from optimum.exporters.onnx import main_export
+    except ImportError:
+        raise LocalInferenceError("Exporting requires `pip install optimum[exporters]`.")
+
+    target = os.path.join(output_dir, name)
+    main_export(MODELS[name], output=target, task="image-classification")
+    print(f"[INFO] Exported {MODELS[name]} to {target}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local ONNX classification models.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the classifiers to ONNX.")
+    export_parser.add_argument("models", nargs="*", help=f"Models to export (default: all of {', '.join(MODELS)}).")
+    export_parser.add_argument("--output", default=LOCAL_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        for name in args.models or MODELS:
+            if name not in MODELS:
+                parser.error(f"unknown model '{name}'")
+            export_model(name, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+from models.food import NUTRIENT_FIELDS, Nutrients
+
+# Meal log store config
+MEAL_LOG_PATH = os.getenv("MEAL_LOG_PATH", "data/meal_log.sqlite3")
+
+SECONDS_PER_DAY = 86400
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS meals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    eaten_at REAL NOT NULL,
+    day INTEGER NOT NULL,
+    food_item TEXT NOT NULL,
+    grams REAL NOT NULL,
+    {", ".join(f"{field} REAL" for field in NUTRIENT_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS meals_user_day ON meals (username, day);
+CREATE TABLE IF NOT EXISTS meal_heads (
+    username TEXT PRIMARY KEY,
+    last_meal_id INTEGER NOT NULL
+);
+"""
+
+def day_number(timestamp: float) -> int:
+    """Days since the Unix epoch (UTC) for a timestamp."""
+    return int(timestamp // SECONDS_PER_DAY)
+
+class MealLogStore:
+    """SQLite-backed log of eaten meals (absolute nutrient amounts)."""
+
+    def __init__(self, path: str = MEAL_LOG_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def add_meal(self, username: str, food_item: str, grams: float, amounts: Nutrients,
+                 eaten_at: Optional[float] = None) -> Tuple[Optional[int], int]:
+        """
+        Stores a meal. `amounts` are the nutrients of the whole portion, not per 100g.
+        Returns the user's previous last meal id and the id of the new meal.
+        """
+        eaten_at = eaten_at if eaten_at is not None else time.time()
+        values = [None if value != value else float(value) for value in amounts.values]
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous = self._last_meal_id(conn, username)
+            meal_id = conn.execute(
+                f"INSERT INTO meals (username, eaten_at, day, food_item, grams, {', '.join(NUTRIENT_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(NUTRIENT_FIELDS))})",
+                (username, eaten_at, day_number(eaten_at), food_item, grams, *values),
+            ).lastrowid
+            conn.execute("INSERT OR REPLACE INTO meal_heads (username, last_meal_id) VALUES (?, ?)",
+                         (username, meal_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return previous, meal_id
+
+    def daily_totals(self, username: str, first_day: int) -> List[Tuple]:
+        """Per-day nutrient sums from `first_day` on, as (day, *totals) rows."""
+        return self._connection().execute(
+            f"SELECT day, {', '.join(f'TOTAL({field})' for field in NUTRIENT_FIELDS)} "
+            "FROM meals WHERE username = ? AND day >= ? GROUP BY day",
+            (username, first_day),
+        ).fetchall()
+
+    def last_meal_id(self, username: str) -> Optional[int]:
+        """Id of the user's latest meal; changes whenever any worker logs a meal for them."""
+        return self._last_meal_id(self._connection(), username)
+
+    @staticmethod
+    def _last_meal_id(conn: sqlite3.Connection, username: str) -> Optional[int]:
+        row = conn.execute("SELECT last_meal_id FROM meal_heads WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+meal_log = MealLogStore()
@@ -0,0 +1,434 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import asyncio
+import sqlite3
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Metrics config. With METRICS_ENABLED=false every hook below returns right away and
+# the request middleware is not installed.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Print one JSON line with per-stage timings for every request
+TIMING_LOG_ENABLED = METRICS_ENABLED and os.getenv("TIMING_LOG_ENABLED", "false").lower() == "true"
+
+# Each gunicorn worker keeps its own counters. Workers flush them to this SQLite file
+# (counters and histograms as running totals, gauges per worker) so /metrics reports the
+# same series whichever worker answers the scrape. Empty keeps metrics per process.
+METRICS_PATH = os.getenv("METRICS_PATH", "cache/metrics.sqlite3")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Gauges of a worker that has not flushed for this long (it exited) are no longer reported
+METRICS_WORKER_TTL = 3 * METRICS_FLUSH_INTERVAL
+
+# Latency buckets in seconds, from a cache hit to a cold model load
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def snapshot(self) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values: Optional[Dict[Labels, float]] = None) -> List[str]:
+        items = sorted((self.snapshot() if values is None else values).items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout (_bucket, _sum, _count)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self) -> Dict[Labels, list]:
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._values.items()}
+
+    def render(self, values: Optional[Dict[Labels, list]] = None) -> List[str]:
+        items = sorted((self.snapshot() if values is None else values).items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+_metrics: Dict[str, object] = {}
+# name -> (type, help, label names, [functions yielding (label values, value)], shared)
+_collectors: Dict[str, Tuple[str, str, Tuple[str, ...], List[Callable], bool]] = {}
+
+def counter(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    """Creates and registers a counter, or returns the one already registered under `name`."""
+    if name not in _metrics:
+        _metrics[name] = Counter(name, help, labelnames)
+    return _metrics[name]
+
+def histogram(name: str, help: str, labelnames: Tuple[str, ...] = (),
+              buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    """Creates and registers a histogram, or returns the one already registered under `name`."""
+    if name not in _metrics:
+        _metrics[name] = Histogram(name, help, labelnames, buckets)
+    return _metrics[name]
+
+def register_collector(name: str, type: str, help: str, labelnames: Tuple[str, ...],
+                       collect: Callable[[], Iterable[Tuple[Labels, float]]], shared: bool = False):
+    """
+    Registers a function that reports values at scrape time, for numbers a module
+    already keeps (cache hit counters, queue depths). Several modules may report
+    samples for the same metric name. `shared` marks values read from state all
+    workers share (e.g. a SQLite file); those are reported as-is, not summed.
+    """
+    entry = _collectors.setdefault(name, (type, help, labelnames, [], shared))
+    entry[3].append(collect)
+
+# Keys in the modules' stats() dicts that are sizes or ratios rather than event counts
+_NON_EVENT_KEYS = {"entries", "memory_entries", "hit_rate"}
+
+def register_cache_stats(collect: Callable[[], Dict[str, Dict[str, float]]]):
+    """Reports `{cache name: stats dict}` at scrape time as nutrivision_cache_events_total."""
+    def samples():
+        for cache, stats in collect().items():
+            for event, value in stats.items():
+                if event not in _NON_EVENT_KEYS:
+                    yield (cache, event), value
+
+    register_collector("nutrivision_cache_events_total", "counter", "Cache lookups and fills by cache and event.",
+                       ("cache", "event"), samples)
+
+def _collect(name: str, functions: List[Callable]) -> Dict[Labels, float]:
+    values: Dict[Labels, float] = {}
+    for collect in functions:
+        try:
+            samples = list(collect())
+        except Exception as e:
+            print(f"[WARNING] Metrics collector for {name} failed: {str(e)}")
+            continue
+        for labels, value in samples:
+            values[tuple(labels)] = values.get(tuple(labels), 0) + value
+    return values
+
+def _add(a, b):
+    """Sums two counter values or two histogram [counts, sum] values."""
+    if isinstance(a, list):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+    return a + b
+
+def _subtract(current, flushed):
+    if isinstance(current, list):
+        counts = [x - y for x, y in zip(current[0], flushed[0])]
+        # A value below the flushed one was reset (e.g. a cleared cache); count it from zero
+        return current if min(counts, default=0) < 0 else [counts, current[1] - flushed[1]]
+    return current if current < flushed else current - flushed
+
+class _MetricsStore:
+    """
+    Cross-worker metric totals in SQLite. Counters and histograms are stored as one
+    running total per series; each worker adds what it counted since its last flush,
+    so totals survive worker restarts. Gauges are stored per worker and summed over
+    workers that flushed recently.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def _worker_state(self):
+        # The app may be imported in the gunicorn master and forked; state is per worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.worker = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+            self.flushed: Dict[Tuple[str, Labels], object] = {}
+            self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples (family TEXT NOT NULL, labels TEXT NOT NULL, "
+                "worker TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (family, labels, worker))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def flush(self):
+        """Adds this worker's counts since the last flush and replaces its gauges."""
+        with self._lock:
+            self._worker_state()
+            current: Dict[Tuple[str, Labels], object] = {}
+            gauges: Dict[Tuple[str, Labels], float] = {}
+            for metric in _metrics.values():
+                for labels, value in metric.snapshot().items():
+                    current[(metric.name, labels)] = value
+            for name, (type, _, _, functions, shared) in _collectors.items():
+                if shared:
+                    continue
+                target = current if type == "counter" else gauges
+                for labels, value in _collect(name, functions).items():
+                    target[(name, labels)] = value
+
+            deltas = {}
+            for key, value in current.items():
+                flushed = self.flushed.get(key)
+                delta = value if flushed is None else _subtract(value, flushed)
+                if (not any(delta[0]) if isinstance(delta, list) else delta == 0):
+                    continue
+                deltas[key] = delta
+
+            conn = self._connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (family, labels), delta in deltas.items():
+                    encoded = json.dumps(labels)
+                    row = conn.execute("SELECT value FROM samples WHERE family = ? AND labels = ? AND worker = ''",
+                                       (family, encoded)).fetchone()
+                    total = delta if row is None else _add(json.loads(row[0]), delta)
+                    conn.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, '', ?, ?)",
+                                 (family, encoded, json.dumps(total), now))
+                conn.execute("DELETE FROM samples WHERE worker = ?", (self.worker,))
+                conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?)",
+                                 [(family, json.dumps(labels), self.worker, json.dumps(value), now)
+                                  for (family, labels), value in gauges.items()])
+                # Gauges of exited workers
+                conn.execute("DELETE FROM samples WHERE worker != '' AND updated_at < ?", (now - 10 * METRICS_WORKER_TTL,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.flushed = current
+
+    def totals(self) -> Dict[str, Dict[Labels, object]]:
+        """Summed values per family and label set, across all workers."""
+        rows = self._connection().execute(
+            "SELECT family, labels, value FROM samples WHERE worker = '' OR updated_at >= ?",
+            (time.time() - METRICS_WORKER_TTL,),
+        ).fetchall()
+        totals: Dict[str, Dict[Labels, object]] = {}
+        for family, labels, value in rows:
+            values = totals.setdefault(family, {})
+            labels, value = tuple(json.loads(labels)), json.loads(value)
+            values[labels] = value if labels not in values else _add(values[labels], value)
+        return totals
+
+_store = _MetricsStore(METRICS_PATH) if METRICS_PATH else None
+
+def flush_metrics():
+    """Writes this worker's metrics to the shared store (no-op when metrics are per process)."""
+    if METRICS_ENABLED and _store is not None:
+        _store.flush()
+
+_flusher: Optional[asyncio.Task] = None
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_metrics)
+        except sqlite3.Error as e:
+            print(f"[WARNING] Could not flush metrics: {str(e)}")
+
+async def start_metrics_flusher():
+    global _flusher
+    if METRICS_ENABLED and _store is not None and _flusher is None:
+        _flusher = asyncio.create_task(_flush_periodically())
+
+async def stop_metrics_flusher():
+    """Stops the flusher and writes the last counts, so an exiting worker's totals are kept."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+        await asyncio.to_thread(flush_metrics)
+
+def _family_lines(name: str, type: str, help: str) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+
+def render() -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format: totals over all
+    workers when METRICS_PATH is set (this worker's counts are flushed first, other
+    workers' are at most METRICS_FLUSH_INTERVAL old), otherwise this process only.
+    """
+    totals = None
+    if _store is not None and METRICS_ENABLED:
+        try:
+            _store.flush()
+            totals = _store.totals()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Could not read shared metrics, reporting this worker only: {str(e)}")
+
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(_family_lines(metric.name, metric.type, metric.help))
+        lines.extend(metric.render(None if totals is None else totals.get(metric.name, {})))
+    for name, (type, help, labelnames, functions, shared) in _collectors.items():
+        lines.extend(_family_lines(name, type, help))
+        values = _collect(name, functions) if totals is None or shared else totals.get(name, {})
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+# Pipeline metrics
+
+REQUESTS = counter("nutrivision_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = histogram("nutrivision_request_seconds", "HTTP request latency by route.", ("route",))
+STAGE_SECONDS = histogram("nutrivision_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+UPSTREAM_RESPONSES = counter("nutrivision_upstream_responses_total",
+                             "Upstream attempts by host and status code (or error / circuit_open).", ("host", "status"))
+UPSTREAM_SECONDS = histogram("nutrivision_upstream_seconds", "Latency of single upstream attempts.", ("host",))
+UPSTREAM_RETRIES = counter("nutrivision_upstream_retries_total", "Upstream retries by host and reason.", ("host", "reason"))
+RETRY_SLEEP_SECONDS = counter("nutrivision_upstream_retry_sleep_seconds_total",
+                              "Time spent sleeping between upstream retries.", ("host",))
+
+# Per-request timings
+
+class RequestTiming:
+    __slots__ = ("stages",)
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+_current_request: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+class _Span:
+    __slots__ = ("stage", "started_at")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started_at
+        STAGE_SECONDS.observe(elapsed, self.stage)
+        timing = _current_request.get()
+        if timing is not None:
+            # Stages that run concurrently within one request are summed
+            timing.stages[self.stage] = timing.stages.get(self.stage, 0.0) + elapsed
+        return False
+
+_NOOP_SPAN = nullcontext()
+
+def span(stage: str):
+    """
+    Times a pipeline stage, usable as `with span("classify"):` in sync and async code.
+    The duration goes to the stage histogram and to the current request's timing log.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, latency and the per-request timing log."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current_request.set(timing)
+        status = 500
+        started_at = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUESTS.inc(scope["method"], path, str(status))
+            REQUEST_SECONDS.observe(elapsed, path)
+            if TIMING_LOG_ENABLED:
+                print(json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": path,
+                    "status": status,
+                    "seconds": round(elapsed, 4),
+                    "stages": {stage: round(seconds, 4) for stage, seconds in timing.stages.items()},
+                }))
+            _current_request.reset(token)
@@ -0,0 +1,165 @@
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+from models.food import NUTRIENT_FIELDS, NUTRIENT_UNITS, Nutrients, NutrientValue, ResolvedNutrition
+from services.admission import admission
+from services.food_search import get_search_index_async
+from services.metrics import register_collector
+from services.openfoodfacts import UNAVAILABLE, get_product_record, normalize_barcode
+from services.reference_nutrients import lookup_reference
+from services.summary_cache import get_summary, summary_cache
+
+# Tiers in the order they are consulted, cheapest first. Barcodes go through the OFF
+# tiers; names through the summary cache, the reference table and finally Gemini.
+TIERS = ("summary_cache", "product_cache", "off_index", "openfoodfacts", "reference", "gemini")
+# Once a packaged product has answered, Gemini is only asked if one of these is still
+# missing. Most OFF products lack fiber or sugar, and a generic LLM estimate under the
+# brand name is neither worth a call nor comparable to the label's values.
+CORE_FIELDS = ("calories", "protein", "carbohydrates", "fats")
+
+_stats = {tier: {"hits": 0, "misses": 0} for tier in TIERS}
+_resolutions = {"total": 0, "llm_calls": 0}
+
+def _record(tier: str, hit: bool):
+    _stats[tier]["hits" if hit else "misses"] += 1
+
+def resolver_stats() -> Dict:
+    """Hits and misses per tier, and how many resolutions never needed Gemini."""
+    tiers = {}
+    for tier, counts in _stats.items():
+        lookups = counts["hits"] + counts["misses"]
+        tiers[tier] = {**counts, "hit_rate": round(counts["hits"] / lookups, 3) if lookups else 0.0}
+    return {
+        "tiers": tiers,
+        "resolutions": _resolutions["total"],
+        "llm_calls": _resolutions["llm_calls"],
+        "llm_calls_avoided": _resolutions["total"] - _resolutions["llm_calls"],
+    }
+
+register_collector("nutrivision_nutrition_tier_total", "counter", "Nutrition resolver lookups by tier and outcome.",
+                   ("tier", "outcome"),
+                   lambda: [((tier, outcome), counts[outcome]) for tier, counts in _stats.items()
+                            for outcome in ("hits", "misses")])
+
+class _Merge:
+    """Accumulates field values from successive tiers; earlier tiers win."""
+
+    def __init__(self):
+        self.values = Nutrients()
+        self.provenance: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.sources: List[str] = []
+
+    def add(self, tier: str, nutrients: Nutrients, as_of: Optional[float]) -> bool:
+        filled = [field for field in self.values.missing() if not math.isnan(getattr(nutrients, field))]
+        _record(tier, bool(filled))
+        if not filled:
+            return False
+        self.values = self.values.merged(nutrients)
+        for field in filled:
+            self.provenance[field] = (tier, as_of)
+        self.sources.append(tier)
+        return True
+
+    def complete(self) -> bool:
+        return not self.values.missing()
+
+    def nutrients(self) -> Dict[str, NutrientValue]:
+        result = {}
+        for field, unit in zip(NUTRIENT_FIELDS, NUTRIENT_UNITS):
+            value = getattr(self.values, field)
+            source, as_of = self.provenance.get(field, (None, None))
+            result[field] = NutrientValue(value=None if math.isnan(value) else round(value, 2), unit=unit,
+                                          source=source, as_of=as_of)
+        return result
+
+def _looks_like_barcode(query: str) -> bool:
+    return query.isnumeric() and len(query) > 6
+
+async def resolve_nutrition(query: str, allow_llm: bool = True) -> ResolvedNutrition:
+    """
+    Resolves per-100g nutrients for a barcode or food name, consulting sources in cost
+    order and stopping once every field is known:
+
+    - barcodes: OFF product cache, local OFF index, OpenFoodFacts API; fields the
+      product lacks (often fiber and sugar) are then filled by name like below
+    - names: summary cache, the OFF tiers when the name matches a known product,
+      the reference table and, if `allow_llm`, Gemini
+    - for packaged products Gemini is only asked when a CORE_FIELDS value is missing
+
+    Each field records the tier it came from and when that source last updated it.
+    """
+    merge = _Merge()
+    name: Optional[str] = None
+    barcode: Optional[str] = None
+    unavailable = False
+    product_found = False
+    # Whether the summary cache has already been asked about `name`
+    checked_summary = False
+
+    if _looks_like_barcode(query):
+        barcode = normalize_barcode(query) or query
+    else:
+        match = (await get_search_index_async()).resolve(query)
+        name = match.entry.key if match else query
+        if match is not None and match.entry.barcode:
+            barcode = match.entry.barcode
+        entry = await summary_cache.get_entry_async(name)
+        if entry is not None:
+            merge.add("summary_cache", Nutrients.from_gemini(entry[0]), entry[1])
+        else:
+            _record("summary_cache", False)
+        checked_summary = True
+
+    if barcode is not None and not merge.complete():
+        product, source, as_of = await get_product_record(barcode)
+        # Tiers before the one that answered were consulted and missed
+        for tier in TIERS[TIERS.index("product_cache"):TIERS.index(source)]:
+            _record(tier, False)
+        if product is UNAVAILABLE:
+            unavailable = True
+            _record(source, False)
+        elif "error" in product:
+            _record(source, False)
+        else:
+            product_found = True
+            merge.add(source, Nutrients.from_off(product), as_of)
+            if name is None and product.get("name") not in (None, "", "Unknown"):
+                name = product["name"]
+            if not merge.complete() and name is not None and not checked_summary:
+                entry = await summary_cache.get_entry_async(name)
+                if entry is not None:
+                    merge.add("summary_cache", Nutrients.from_gemini(entry[0]), entry[1])
+                else:
+                    _record("summary_cache", False)
+
+    if name is not None and not merge.complete():
+        reference = lookup_reference(name)
+        if reference is not None:
+            merge.add("reference", reference, None)
+        else:
+            _record("reference", False)
+
+    llm_needed = not merge.complete()
+    if product_found:
+        llm_needed = any(field in merge.values.missing() for field in CORE_FIELDS)
+
+    llm_used = False
+    if allow_llm and name is not None and llm_needed:
+        # Only the Gemini tier is expensive enough to need an admission slot
+        async with admission.admit("high"):
+            summary = await get_summary(name)
+        llm_used = True
+        merge.add("gemini", Nutrients.from_gemini(summary), time.time())
+
+    _resolutions["total"] += 1
+    if llm_used:
+        _resolutions["llm_calls"] += 1
+
+    if merge.complete():
+        status = "ok"
+    elif merge.sources:
+        status = "partial"
+    else:
+        status = "unavailable" if unavailable else "not_found"
+    return ResolvedNutrition(query=query, name=name, barcode=barcode, status=status,
+                             nutrients=merge.nutrients(), sources=merge.sources)
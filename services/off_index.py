@@ -0,0 +1,302 @@
+import os
+import io
+import sys
+import csv
+import gzip
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+import requests
+
+# Local OpenFoodFacts index config
+OFF_INDEX_PATH = os.getenv("OFF_INDEX_PATH", "data/off_index.sqlite3")
+OFF_DELTA_URL = os.getenv("OFF_DELTA_URL", "https://static.openfoodfacts.org/data/delta/")
+
+IMPORT_BATCH_SIZE = 5000
+
+# Columns kept from the dump, in table order
+_COLUMNS = ("barcode", "name", "kcal", "protein", "fat", "carbs", "fiber", "sugar", "nutriscore", "ingredients",
+            "last_modified")
+# Columns added after the first release; older index files get them on the next import
+_ADDED_COLUMNS = {"fiber": "REAL", "sugar": "REAL"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    barcode TEXT PRIMARY KEY,
+    name TEXT,
+    kcal REAL,
+    protein REAL,
+    fat REAL,
+    carbs REAL,
+    fiber REAL,
+    sugar REAL,
+    nutriscore TEXT,
+    ingredients TEXT,
+    last_modified INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_UPSERT = (
+    f"INSERT INTO products ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT(barcode) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])
+    + " WHERE excluded.last_modified >= products.last_modified"
+)
+
+_local = threading.local()
+
+# Lookups
+
+def _reader() -> Optional[sqlite3.Connection]:
+    """Per-thread read-only connection, or None if no index has been built."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        if not os.path.exists(OFF_INDEX_PATH):
+            return None
+        conn = sqlite3.connect(f"file:{OFF_INDEX_PATH}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA mmap_size = 1073741824")
+        # An index built before fiber/sugar were added reads them as missing
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+        selected = [column if column in existing else f"NULL AS {column}" for column in _COLUMNS[1:]]
+        _local.select = f"SELECT {', '.join(selected)} FROM products WHERE barcode IN "
+        _local.conn = conn
+    return conn
+
+def _barcode_variants(barcode: str) -> Tuple[str, ...]:
+    """OFF stores UPC-A codes both with and without the leading zero of their EAN-13 form."""
+    code = barcode.strip()
+    variants = [code]
+    if len(code) == 12:
+        variants.append("0" + code)
+    elif len(code) == 13 and code.startswith("0"):
+        variants.append(code[1:])
+    return tuple(variants)
+
+def _as_response(row) -> Dict:
+    """Same keys, in the same order, as openfoodfacts._parse_product."""
+    name, kcal, protein, fat, carbs, fiber, sugar, nutriscore, ingredients = row
+    return {
+        "name": name or "Unknown",
+        "calories": kcal if kcal is not None else "N/A",
+        "protein": protein if protein is not None else "N/A",
+        "fats": fat if fat is not None else "N/A",
+        "carbs": carbs if carbs is not None else "N/A",
+        "fiber": fiber if fiber is not None else "N/A",
+        "sugar": sugar if sugar is not None else "N/A",
+        "nutriscore": nutriscore or "N/A",
+        "ingredients": ingredients or "N/A",
+    }
+
+def lookup_product_record(barcode: str) -> Optional[Tuple[Dict, Optional[float]]]:
+    """
+    Looks up a barcode in the local index.
+    Returns (product in the get_nutrition_info shape, OFF last-modified timestamp), or None
+    if the index is missing or has no entry.
+    """
+    conn = _reader()
+    if conn is None:
+        return None
+
+    variants = _barcode_variants(barcode)
+    placeholders = ", ".join("?" * len(variants))
+    row = conn.execute(f"{_local.select}({placeholders}) LIMIT 1", variants).fetchone()
+    if row is None:
+        return None
+    return _as_response(row[:-1]), (float(row[-1]) if row[-1] else None)
+
+def lookup_product(barcode: str) -> Optional[Dict]:
+    """
+    Looks up a barcode in the local index.
+    Returns the same shape as get_nutrition_info, or None if the index is missing or has no entry.
+    """
+    record = lookup_product_record(barcode)
+    return record[0] if record else None
+
+# Import
+
+def _to_float(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "rt", encoding="utf-8", errors="replace", newline="")
+
+def _iter_jsonl(path: str) -> Iterator[Tuple]:
+    with _open_text(path) as f:
+        for line in f:
+            try:
+                product = json.loads(line)
+            except ValueError:
+                continue
+            code = str(product.get("code") or "").strip()
+            if not code:
+                continue
+            nutriments = product.get("nutriments") or {}
+            yield (
+                code,
+                product.get("product_name"),
+                _to_float(nutriments.get("energy-kcal_100g")),
+                _to_float(nutriments.get("proteins_100g")),
+                _to_float(nutriments.get("fat_100g")),
+                _to_float(nutriments.get("carbohydrates_100g")),
+                _to_float(nutriments.get("fiber_100g")),
+                _to_float(nutriments.get("sugars_100g")),
+                product.get("nutriscore_grade"),
+                product.get("ingredients_text"),
+                _to_int(product.get("last_modified_t")),
+            )
+
+def _iter_csv(path: str) -> Iterator[Tuple]:
+    # The OFF CSV export is tab separated and has very long ingredient fields
+    csv.field_size_limit(sys.maxsize)
+    with _open_text(path) as f:
+        reader = csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+        for product in reader:
+            code = (product.get("code") or "").strip()
+            if not code:
+                continue
+            yield (
+                code,
+                product.get("product_name") or None,
+                _to_float(product.get("energy-kcal_100g")),
+                _to_float(product.get("proteins_100g")),
+                _to_float(product.get("fat_100g")),
+                _to_float(product.get("carbohydrates_100g")),
+                _to_float(product.get("fiber_100g")),
+                _to_float(product.get("sugars_100g")),
+                product.get("nutriscore_grade") or None,
+                product.get("ingredients_text") or None,
+                _to_int(product.get("last_modified_t")),
+            )
+
+def iter_dump(path: str) -> Iterator[Tuple]:
+    """Streams product rows from an OFF JSONL or CSV dump (optionally gzipped)."""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".csv", ".tsv")):
+        return _iter_csv(path)
+    return _iter_jsonl(path)
+
+def _writer(path: str = OFF_INDEX_PATH) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(_SCHEMA)
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    for column, kind in _ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE products ADD COLUMN {column} {kind}")
+    return conn
+
+def import_rows(rows: Iterable[Tuple], path: str = OFF_INDEX_PATH) -> int:
+    """
+    Upserts product rows into the index in batches. Rows older than the stored
+    version of the same barcode are ignored, so deltas can be replayed safely.
+    """
+    conn = _writer(path)
+    count = 0
+    batch = []
+    started = time.time()
+
+    def flush():
+        conn.execute("BEGIN")
+        conn.executemany(_UPSERT, batch)
+        conn.execute("COMMIT")
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        count += 1
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush()
+            if count % (IMPORT_BATCH_SIZE * 20) == 0:
+                print(f"[INFO] Imported {count} products ({count / (time.time() - started):.0f}/s)")
+    if batch:
+        flush()
+
+    conn.close()
+    return count
+
+def _get_meta(key: str, path: str = OFF_INDEX_PATH) -> Optional[str]:
+    conn = _writer(path)
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def _set_meta(key: str, value: str, path: str = OFF_INDEX_PATH):
+    conn = _writer(path)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    conn.close()
+
+def sync_deltas(path: str = OFF_INDEX_PATH) -> int:
+    """
+    Downloads and imports the OFF daily delta exports newer than the last one applied.
+    Returns the number of delta files imported.
+    """
+    response = requests.get(f"{OFF_DELTA_URL}index.txt", timeout=30)
+    response.raise_for_status()
+    files = sorted(line.strip() for line in response.text.splitlines() if line.strip().endswith(".json.gz"))
+
+    last_applied = _get_meta("last_delta", path) or ""
+    applied = 0
+    for name in files:
+        if name <= last_applied:
+            continue
+
+        print(f"[INFO] Importing delta {name}")
+        with tempfile.NamedTemporaryFile(suffix=".json.gz") as tmp:
+            with requests.get(f"{OFF_DELTA_URL}{name}", stream=True, timeout=60) as download:
+                download.raise_for_status()
+                for chunk in download.iter_content(chunk_size=1 << 20):
+                    tmp.write(chunk)
+            tmp.flush()
+            import_rows(_iter_jsonl(tmp.name), path)
+
+        _set_meta("last_delta", name, path)
+        applied += 1
+    return applied
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and update the local OpenFoodFacts barcode index.")
+    parser.add_argument("--path", default=OFF_INDEX_PATH, help="Index database file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import a full dump or a delta file (JSONL or CSV, optionally .gz).")
+    import_parser.add_argument("dump", nargs="+")
+    subparsers.add_parser("sync-deltas", help="Download and apply new OFF delta exports.")
+    subparsers.add_parser("stats", help="Show the number of indexed products.")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        for dump in args.dump:
+            count = import_rows(iter_dump(dump), args.path)
+            print(f"[INFO] Imported {count} products from {dump}")
+    elif args.command == "sync-deltas":
+        applied = sync_deltas(args.path)
+        print(f"[INFO] Applied {applied} delta files")
+    elif args.command == "stats":
+        conn = _writer(args.path)
+        count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        print(f"{count} products indexed in {args.path} (last delta: {_get_meta('last_delta', args.path) or 'none'})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
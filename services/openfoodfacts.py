@@ -1,16 +1,108 @@
-import requests
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import httpx
+from services.http_client import get_upstream, CircuitOpenError
+from services.rate_limit import RateLimitedError
+from services.off_index import lookup_product, lookup_product_record
+from services.metrics import register_cache_stats, span
+from services.admission import admission
 
-OPENFOODFACTS_API = "https://world.openfoodfacts.org/api/v2/product/"
+OFF_API_BASE = os.getenv("OFF_API_BASE", "https://world.openfoodfacts.org")
+OPENFOODFACTS_API = f"{OFF_API_BASE}/api/v2/product/"
+OFF_CACHE_TTL = float(os.getenv("OFF_CACHE_TTL", str(24 * 60 * 60)))
+OFF_CACHE_ENTRIES = int(os.getenv("OFF_CACHE_ENTRIES", "10000"))
+OFF_BULK_CONCURRENCY = int(os.getenv("OFF_BULK_CONCURRENCY", "10"))
 
-def get_nutrition_info(barcode):
-    """Fetches nutrition data from OpenFoodFacts using barcode."""
-    response = requests.get(f"{OPENFOODFACTS_API}{barcode}.json")
+UNAVAILABLE = {"error": "OpenFoodFacts is unavailable"}
+NOT_FOUND = {"error": "Product not found"}
 
-    if response.status_code != 200:
-        return {"error": "Product not found"}
+# Products fetched from the API, keyed by barcode: (product, expires_at)
+_product_cache: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_semaphore = None
+_stats = {"index_hits": 0, "cache_hits": 0, "misses": 0}
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(OFF_BULK_CONCURRENCY)
+    return _semaphore
+
+def normalize_barcode(barcode: str) -> Optional[str]:
+    """
+    Validates an EAN-8, UPC-A, EAN-13 or GTIN-14 code by its check digit.
+
+    Returns the code with surrounding whitespace and inner spaces/dashes removed,
+    or None if it is not a valid GTIN.
+    """
+    code = barcode.strip().replace(" ", "").replace("-", "")
+    if not code.isdigit() or len(code) not in (8, 12, 13, 14):
+        return None
+    # Weights alternate 3, 1, 3, ... starting from the digit next to the check digit
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(code[:-1])))
+    if (10 - total % 10) % 10 != int(code[-1]):
+        return None
+    return code
+
+def _cached_product(barcode: str) -> Optional[Dict]:
+    product = _cache_get(barcode)
+    if product is not None:
+        _stats["cache_hits"] += 1
+    return product
+
+def _indexed_product(product: Optional[Dict]) -> Optional[Dict]:
+    """Counts the outcome of an index lookup made after a product cache miss."""
+    _stats["index_hits" if product is not None else "misses"] += 1
+    return product
+
+def _local_product(barcode: str) -> Optional[Dict]:
+    """Product from the product cache or the local OFF index (same order as get_product_record), or None."""
+    product = _cached_product(barcode)
+    if product is not None:
+        return product
+    return _indexed_product(lookup_product(barcode))
+
+async def _local_product_async(barcode: str) -> Optional[Dict]:
+    """_local_product() for async callers; the index read runs in a worker thread."""
+    product = _cached_product(barcode)
+    if product is not None:
+        return product
+    return _indexed_product(await asyncio.to_thread(lookup_product, barcode))
 
-    data = response.json()
-    
+def off_stats() -> Dict[str, int]:
+    return {"entries": len(_product_cache), **_stats}
+
+register_cache_stats(lambda: {"off": off_stats()})
+
+def _cache_get_record(barcode: str) -> Optional[Tuple[Dict, float]]:
+    """Cached product and the time it was fetched, or None."""
+    with _cache_lock:
+        item = _product_cache.get(barcode)
+        if item is None:
+            return None
+        product, expires_at = item
+        if expires_at < time.time():
+            del _product_cache[barcode]
+            return None
+        _product_cache.move_to_end(barcode)
+        return product, expires_at - OFF_CACHE_TTL
+
+def _cache_get(barcode: str) -> Optional[Dict]:
+    record = _cache_get_record(barcode)
+    return record[0] if record else None
+
+def _cache_put(barcode: str, product: Dict):
+    with _cache_lock:
+        _product_cache[barcode] = (product, time.time() + OFF_CACHE_TTL)
+        _product_cache.move_to_end(barcode)
+        while len(_product_cache) > OFF_CACHE_ENTRIES:
+            _product_cache.popitem(last=False)
+
+def _parse_product(data):
     if "product" in data:
         product = data["product"]
         return {
@@ -19,8 +111,135 @@ def get_nutrition_info(barcode):
             "protein": product.get("nutriments", {}).get("proteins_100g", "N/A"),
             "fats": product.get("nutriments", {}).get("fat_100g", "N/A"),
             "carbs": product.get("nutriments", {}).get("carbohydrates_100g", "N/A"),
+            "fiber": product.get("nutriments", {}).get("fiber_100g", "N/A"),
+            "sugar": product.get("nutriments", {}).get("sugars_100g", "N/A"),
             "nutriscore": product.get("nutriscore_grade", "N/A"),  # Add Nutri-Score
             "ingredients": product.get("ingredients_text", "N/A"),
         }
-    
+
     return {"error": "Incomplete data"}
+
+def _handle_response(barcode: str, response: httpx.Response) -> Dict:
+    if response.status_code == 404:
+        return NOT_FOUND
+    if response.status_code != 200:
+        # Rate limited, down or otherwise failing: says nothing about whether the product exists
+        return UNAVAILABLE
+
+    try:
+        data = response.json()
+    except ValueError:
+        # An HTML error page from a proxy or maintenance mode
+        return UNAVAILABLE
+    if not isinstance(data, dict):
+        return UNAVAILABLE
+
+    product = _parse_product(data)
+    if "error" not in product:
+        _cache_put(barcode, product)
+    return product
+
+def get_nutrition_info(barcode):
+    """Fetches nutrition data using barcode, from the product cache or the local OFF index first and the OpenFoodFacts API on a miss."""
+    with span("nutrition_lookup"):
+        local = _local_product(barcode)
+        if local is not None:
+            return local
+
+        try:
+            response = get_upstream().request("GET", f"{OPENFOODFACTS_API}{barcode}.json", retries=2)
+        except (CircuitOpenError, RateLimitedError, httpx.HTTPError):
+            return UNAVAILABLE
+
+        return _handle_response(barcode, response)
+
+async def _fetch_async(barcode: str) -> Dict:
+    try:
+        async with _get_semaphore():
+            response = await get_upstream().arequest("GET", f"{OPENFOODFACTS_API}{barcode}.json", retries=2)
+    except (CircuitOpenError, RateLimitedError, httpx.HTTPError):
+        return UNAVAILABLE
+
+    return _handle_response(barcode, response)
+
+async def get_nutrition_info_async(barcode: str) -> Dict:
+    """Async counterpart of get_nutrition_info(); API calls share the bulk concurrency limit."""
+    with span("nutrition_lookup"):
+        local = await _local_product_async(barcode)
+        if local is not None:
+            return local
+        return await _fetch_async(barcode)
+
+async def get_product_record(barcode: str) -> Tuple[Dict, str, Optional[float]]:
+    """
+    Like get_nutrition_info_async(), but also reports where the product came from
+    ("product_cache", "off_index" or "openfoodfacts") and when that data was last
+    updated (None if unknown). NOT_FOUND / UNAVAILABLE come back with source "openfoodfacts".
+    """
+    with span("nutrition_lookup"):
+        record = _cache_get_record(barcode)
+        if record is not None:
+            _stats["cache_hits"] += 1
+            return record[0], "product_cache", record[1]
+        record = await asyncio.to_thread(lookup_product_record, barcode)
+        if record is not None:
+            _stats["index_hits"] += 1
+            return record[0], "off_index", record[1]
+        _stats["misses"] += 1
+        return await _fetch_async(barcode), "openfoodfacts", time.time()
+
+def _status(product: Dict) -> str:
+    if product is UNAVAILABLE:
+        return "unavailable"
+    if "error" in product:
+        return "not_found"
+    return "ok"
+
+async def get_nutrition_bulk(barcodes: List[str]) -> List[Dict]:
+    """
+    Looks up many barcodes at once.
+
+    Codes are checksum-validated and deduplicated first. Hits in the product cache and
+    the local index are answered immediately; the remaining codes are fetched from
+    OpenFoodFacts concurrently, at most OFF_BULK_CONCURRENCY at a time. Raises
+    OverloadedError if the server has no capacity left for the fetches.
+
+    Returns one entry per input code, in input order, with a per-item `status`
+    of "ok", "invalid", "not_found" or "unavailable".
+    """
+    normalized = [normalize_barcode(barcode) for barcode in barcodes]
+
+    results: Dict[str, Dict] = {}
+    misses = []
+    with span("nutrition_lookup"):
+        uncached = []
+        for code in dict.fromkeys(code for code in normalized if code is not None):
+            product = _cached_product(code)
+            if product is not None:
+                results[code] = product
+            else:
+                uncached.append(code)
+
+        # One trip to a worker thread for all index reads
+        indexed = await asyncio.to_thread(lambda: [lookup_product(code) for code in uncached]) if uncached else []
+        for code, product in zip(uncached, indexed):
+            if _indexed_product(product) is not None:
+                results[code] = product
+            else:
+                misses.append(code)
+
+        if misses:
+            # Only the API fetches count against admission; cached codes are always answered
+            async with admission.admit("low"):
+                fetched = await asyncio.gather(*(_fetch_async(code) for code in misses))
+            results.update(zip(misses, fetched))
+
+    items = []
+    for barcode, code in zip(barcodes, normalized):
+        if code is None:
+            items.append({"barcode": barcode, "status": "invalid", "product": None})
+            continue
+        product = results[code]
+        status = _status(product)
+        items.append({"barcode": code, "status": status, "product": product if status == "ok" else None})
+    return items
@@ -0,0 +1,241 @@
+import io
+import os
+import re
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image, ImageOps
+from models.food import Nutrients, total_nutrients
+from services.food_recognition import classify_food_batch_async
+from services.fruit_vegetable_detector import classify_fruit_or_vegetable_batch_async
+from services.image_preprocessing import run_in_pool
+from services.local_inference import use_local_backend
+from services.summary_cache import get_summaries, normalize_label
+from services.metrics import span
+
+# Plate analysis config
+PLATE_GRID = int(os.getenv("PLATE_GRID", "2"))
+# Upper bound on regions classified per photo, including the whole image
+PLATE_MAX_REGIONS = int(os.getenv("PLATE_MAX_REGIONS", "6"))
+# With the Inference API every region costs one call (and rate-limit token) per
+# classifier, so fewer regions are sent than the local backend classifies
+PLATE_MAX_REMOTE_REGIONS = int(os.getenv("PLATE_MAX_REMOTE_REGIONS", "3"))
+PLATE_MIN_SCORE = float(os.getenv("PLATE_MIN_SCORE", "0.3"))
+# Detections with different labels overlapping more than this keep only the most confident one
+PLATE_OVERLAP_IOU = float(os.getenv("PLATE_OVERLAP_IOU", "0.5"))
+# Portion used when a summary has no parseable serving size
+PLATE_DEFAULT_PORTION_GRAMS = float(os.getenv("PLATE_DEFAULT_PORTION_GRAMS", "150"))
+
+# Saliency is computed on a coarse grid; components smaller than this share of it are ignored
+SALIENCY_GRID = 16
+SALIENCY_MIN_AREA = 0.04
+
+_GRAMS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:g|grams?)\b", re.IGNORECASE)
+
+Box = Tuple[float, float, float, float]
+WHOLE_IMAGE: Box = (0.0, 0.0, 1.0, 1.0)
+
+@dataclass
+class Region:
+    # (left, top, right, bottom) as fractions of the image size
+    box: Box
+    data: bytes
+
+@dataclass
+class Detection:
+    label: str
+    score: float
+    source: str
+    box: Box
+    regions: int = 1
+    candidates: List[Dict] = field(default_factory=list)
+
+def _iou(a: Box, b: Box) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+def _union(a: Box, b: Box) -> Box:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+def _grid_boxes(grid: int) -> List[Box]:
+    step = 1.0 / grid
+    return [(col * step, row * step, (col + 1) * step, (row + 1) * step) for row in range(grid) for col in range(grid)]
+
+def _saliency_boxes(img: Image.Image) -> List[Tuple[float, Box]]:
+    """
+    Boxes around regions that stand out from the dominant (plate / table) colour.
+
+    Saliency is the colour distance of each cell of a SALIENCY_GRID x SALIENCY_GRID
+    thumbnail from the median colour; cells above mean + 0.5 std are grouped into
+    4-connected components. Returns (share of salient cells, box) per component.
+    """
+    small = np.asarray(img.resize((SALIENCY_GRID, SALIENCY_GRID), Image.Resampling.BOX), dtype=np.float32)
+    distance = np.linalg.norm(small - np.median(small.reshape(-1, 3), axis=0), axis=2)
+    mask = distance > distance.mean() + 0.5 * distance.std()
+
+    boxes = []
+    seen = np.zeros_like(mask)
+    for start in zip(*np.nonzero(mask)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        queue = deque([start])
+        cells = []
+        while queue:
+            row, col = queue.popleft()
+            cells.append((row, col))
+            for r, c in ((row + 1, col), (row - 1, col), (row, col + 1), (row, col - 1)):
+                if 0 <= r < SALIENCY_GRID and 0 <= c < SALIENCY_GRID and mask[r, c] and not seen[r, c]:
+                    seen[r, c] = True
+                    queue.append((r, c))
+        share = len(cells) / SALIENCY_GRID ** 2
+        if share < SALIENCY_MIN_AREA:
+            continue
+        rows, cols = np.array(cells).T
+        # Pad by one cell so the crop includes the food's edges
+        box = (max(0, int(cols.min()) - 1) / SALIENCY_GRID, max(0, int(rows.min()) - 1) / SALIENCY_GRID,
+               min(SALIENCY_GRID, int(cols.max()) + 2) / SALIENCY_GRID,
+               min(SALIENCY_GRID, int(rows.max()) + 2) / SALIENCY_GRID)
+        boxes.append((share, box))
+    return sorted(boxes, reverse=True)
+
+def propose_regions(image: bytes, grid: int = PLATE_GRID, max_regions: int = PLATE_MAX_REGIONS) -> List[Region]:
+    """
+    Splits a photo into candidate food regions: the whole image, saliency crops
+    (largest first) and grid tiles, skipping boxes that nearly duplicate earlier ones.
+    Each region is returned as a JPEG crop.
+    """
+    with Image.open(io.BytesIO(image)) as opened:
+        img = ImageOps.exif_transpose(opened).convert("RGB")
+
+    proposals = [WHOLE_IMAGE]
+    proposals += [box for _, box in _saliency_boxes(img)]
+    proposals += _grid_boxes(grid) if grid > 1 else []
+
+    regions = []
+    for box in proposals:
+        if len(regions) >= max_regions:
+            break
+        if any(_iou(box, region.box) > 0.8 for region in regions):
+            continue
+        crop = img.crop((round(box[0] * img.width), round(box[1] * img.height),
+                         round(box[2] * img.width), round(box[3] * img.height)))
+        out = io.BytesIO()
+        crop.save(out, format="JPEG", quality=85)
+        regions.append(Region(box, out.getvalue()))
+    return regions
+
+def merge_detections(detections: List[Detection], overlap_iou: float = PLATE_OVERLAP_IOU) -> List[Detection]:
+    """
+    Collapses per-region detections into one per food. Regions with the same label are
+    merged (boxes unioned, best score kept); a region overlapping a more confident
+    detection of a different label is dropped as a conflicting guess for the same food.
+    """
+    merged: List[Detection] = []
+    for detection in sorted(detections, key=lambda d: d.score, reverse=True):
+        key = normalize_label(detection.label)
+        same = next((kept for kept in merged if normalize_label(kept.label) == key), None)
+        if same is not None:
+            same.regions += detection.regions
+            # The whole-image box would swallow every other item, so it is not unioned in
+            if detection.box != WHOLE_IMAGE:
+                same.box = detection.box if same.box == WHOLE_IMAGE else _union(same.box, detection.box)
+            continue
+        if any(_iou(detection.box, kept.box) > overlap_iou for kept in merged
+               if WHOLE_IMAGE not in (detection.box, kept.box)):
+            continue
+        merged.append(detection)
+    return merged
+
+def _best(predictions: Dict[str, object]) -> Optional[Tuple[str, List[Dict]]]:
+    """
+    Picks the classifier with the most confident top prediction for one region.
+    Classifiers that failed for the region (an exception) or returned nothing are skipped.
+    """
+    usable = {source: result for source, result in predictions.items() if not isinstance(result, BaseException) and result}
+    if not usable:
+        return None
+    source = max(usable, key=lambda name: usable[name][0]["score"])
+    return source, usable[source]
+
+def _portion_grams(summary) -> float:
+    # Serving sizes read like "150 g" or "1 medium (118g)"; only an explicit gram amount is used
+    match = _GRAMS.search(summary.average_serving_size or "")
+    grams = float(match.group(1)) if match else 0.0
+    return grams if grams > 0 else PLATE_DEFAULT_PORTION_GRAMS
+
+async def analyze_plate(image: bytes, max_regions: int = PLATE_MAX_REGIONS) -> Dict:
+    """
+    Detects several foods on one photo.
+
+    The image is split into regions, every region is classified by both classifiers
+    in one batch each, overlapping detections are merged and the summaries of the
+    unique labels are fetched in one batched lookup. Each item is scaled to its
+    serving size and the items are summed into meal totals.
+    """
+    if not use_local_backend():
+        max_regions = min(max_regions, PLATE_MAX_REMOTE_REGIONS)
+    with span("preprocess"):
+        regions = await run_in_pool(propose_regions, image, PLATE_GRID, max_regions)
+
+    with span("classify"):
+        crops = [region.data for region in regions]
+        food, fruit = await asyncio.gather(
+            classify_food_batch_async(crops, "image/jpeg", top_k=3),
+            classify_fruit_or_vegetable_batch_async(crops, "image/jpeg", top_k=3),
+            return_exceptions=True,
+        )
+    if isinstance(food, BaseException) and isinstance(fruit, BaseException):
+        # Both classifiers failed for every region; report the first error
+        raise food
+
+    detections = []
+    for index, region in enumerate(regions):
+        best = _best({
+            "food-item": food if isinstance(food, BaseException) else food[index],
+            "fruit-vegetable": fruit if isinstance(fruit, BaseException) else fruit[index],
+        })
+        if best is None:
+            continue
+        source, predictions = best
+        if predictions[0]["score"] >= PLATE_MIN_SCORE:
+            detections.append(Detection(predictions[0]["label"], predictions[0]["score"], source, region.box,
+                                        candidates=predictions))
+    items = merge_detections(detections)
+
+    summaries, errors = await get_summaries([item.label for item in items])
+
+    results, records, portions = [], [], []
+    for item in items:
+        key = normalize_label(item.label)
+        result = {
+            "label": item.label,
+            "score": round(item.score, 4),
+            "source": item.source,
+            "box": [round(value, 3) for value in item.box],
+            "regions": item.regions,
+            "candidates": item.candidates,
+        }
+        summary = summaries.get(key)
+        if summary is None:
+            result["error"] = errors.get(key, "No summary available")
+        else:
+            grams = _portion_grams(summary)
+            per_100g = Nutrients.from_gemini(summary)
+            result.update(grams=grams, nutrients=per_100g.scaled(grams).to_dict(), nutrition=summary.model_dump())
+            records.append(per_100g)
+            portions.append(grams)
+        results.append(result)
+
+    return {
+        "items": results,
+        "totals": total_nutrients(records, portions).to_dict(),
+        "regions_analyzed": len(regions),
+    }
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+from services.metrics import counter, register_collector
+
+# Rate limit config. Buckets live in a SQLite file shared by all gunicorn workers on the
+# host, so the configured rate is a per-host total rather than per worker.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PATH = os.getenv("RATE_LIMIT_PATH", "cache/rate_limits.sqlite3")
+# "name=requests_per_second:burst,...". Names are upstream hosts, plus "gemini".
+# OpenFoodFacts allows 100 product reads per minute.
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS",
+    "api-inference.huggingface.co=10:20,gemini=10:20,world.openfoodfacts.org=1.6:10",
+)
+# Longest a caller waits for a token before giving up
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+# After a 429 the rate is halved and then recovers by this many requests/s every second
+RATE_LIMIT_RECOVERY = float(os.getenv("RATE_LIMIT_RECOVERY", "0.5"))
+RATE_LIMIT_MIN_FRACTION = 0.1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    rate REAL NOT NULL,
+    penalized_at REAL NOT NULL,
+    blocked_until REAL NOT NULL
+)
+"""
+
+RATE_LIMIT_WAITS = counter("nutrivision_rate_limit_waits_total", "Requests delayed by an upstream token bucket.", ("name",))
+RATE_LIMIT_REJECTS = counter("nutrivision_rate_limit_rejects_total",
+                             "Requests rejected because the token wait exceeded RATE_LIMIT_MAX_WAIT.", ("name",))
+RATE_LIMIT_PENALTIES = counter("nutrivision_rate_limit_penalties_total", "429 / Retry-After responses that slowed a bucket.",
+                               ("name",))
+
+class RateLimitedError(Exception):
+    """Raised when a token would not be available within the allowed wait."""
+    pass
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        rate, _, burst = value.partition(":")
+        if name and rate:
+            limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+class UpstreamRateLimiter:
+    """
+    Token buckets per upstream, shared across processes through SQLite.
+
+    The refill rate adapts (AIMD): a 429 or a Retry-After halves the rate and blocks the
+    bucket until the advertised time, after which the rate grows back linearly by
+    RATE_LIMIT_RECOVERY per second up to the configured rate. Names without a
+    configured limit are not limited.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_PATH, limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.path = path
+        self.limits = _parse_limits(RATE_LIMITS) if limits is None else limits
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _current_rate(self, name: str, rate: float, penalized_at: float, now: float) -> float:
+        max_rate = self.limits[name][0]
+        return min(max_rate, rate + RATE_LIMIT_RECOVERY * max(0.0, now - penalized_at))
+
+    def _refill(self, name: str, burst: float, tokens: float, updated_at: float, rate: float,
+                penalized_at: float, blocked_until: float, now: float) -> float:
+        # Nothing refills while the bucket is blocked by a Retry-After
+        elapsed = max(0.0, now - max(updated_at, blocked_until))
+        return min(burst, tokens + elapsed * self._current_rate(name, rate, penalized_at, now))
+
+    def reserve(self, name: str, max_wait: float = RATE_LIMIT_MAX_WAIT) -> float:
+        """
+        Reserves the next token and returns how long the caller must wait before using it.
+
+        Tokens may go negative: each reservation queues behind the earlier ones, so
+        concurrent waiters get staggered wait times instead of all waking together.
+        If the wait would exceed `max_wait`, nothing is reserved and the wait is returned.
+        """
+        if not RATE_LIMIT_ENABLED or name not in self.limits:
+            return 0.0
+        max_rate, burst = self.limits[name]
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, rate, penalized_at, blocked_until FROM buckets WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                tokens, updated_at, rate, penalized_at, blocked_until = burst, now, max_rate, 0.0, 0.0
+            else:
+                tokens, updated_at, rate, penalized_at, blocked_until = row
+
+            tokens = self._refill(name, burst, tokens, updated_at, rate, penalized_at, blocked_until, now) - 1
+            wait = max(0.0, blocked_until - now) + max(0.0, -tokens) / self._current_rate(name, rate, penalized_at, now)
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                return wait
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at, rate, penalized_at, blocked_until) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, tokens, max(now, updated_at), rate, penalized_at, blocked_until),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def penalize(self, name: str, retry_after: Optional[float] = None, slow_down: bool = True):
+        """
+        Blocks the bucket for `retry_after` seconds and, after a 429 (`slow_down`),
+        halves its rate. Outstanding reservations (negative tokens) are kept.
+        """
+        if not RATE_LIMIT_ENABLED or name not in self.limits:
+            return
+        max_rate, burst = self.limits[name]
+        RATE_LIMIT_PENALTIES.inc(name)
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, rate, penalized_at, blocked_until FROM buckets WHERE name = ?", (name,)
+            ).fetchone()
+            tokens, updated_at, rate, penalized_at, blocked_until = row if row else (0.0, now, max_rate, 0.0, 0.0)
+            tokens = self._refill(name, burst, tokens, updated_at, rate, penalized_at, blocked_until, now)
+            if slow_down:
+                rate = max(max_rate * RATE_LIMIT_MIN_FRACTION, self._current_rate(name, rate, penalized_at, now) / 2)
+                penalized_at = now
+            blocked_until = now + retry_after if retry_after else 0.0
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at, rate, penalized_at, blocked_until) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, min(0.0, tokens), now, rate, penalized_at, blocked_until),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if slow_down:
+            print(f"[WARNING] {name} is rate limiting us, slowing down to {rate:.2f} req/s")
+
+    async def penalize_async(self, name: str, retry_after: Optional[float] = None, slow_down: bool = True):
+        """penalize() in a worker thread, so a contended SQLite lock does not stall the event loop."""
+        await asyncio.to_thread(self.penalize, name, retry_after, slow_down)
+
+    def _check_wait(self, name: str, wait: float):
+        if wait > RATE_LIMIT_MAX_WAIT:
+            RATE_LIMIT_REJECTS.inc(name)
+            raise RateLimitedError(f"Rate limit for {name} exceeded, retry in {wait:.1f}s")
+        if wait > 0:
+            RATE_LIMIT_WAITS.inc(name)
+
+    def acquire(self, name: str):
+        """Blocks until a token is available. Raises RateLimitedError past RATE_LIMIT_MAX_WAIT."""
+        wait = self.reserve(name)
+        self._check_wait(name, wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, name: str):
+        """
+        Async counterpart of acquire(). The SQLite transaction runs in a worker thread
+        and the wait uses asyncio.sleep, so neither blocks the event loop.
+        """
+        if not RATE_LIMIT_ENABLED or name not in self.limits:
+            return
+        wait = await asyncio.to_thread(self.reserve, name)
+        self._check_wait(name, wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def rates(self) -> Dict[str, float]:
+        """Current adaptive rate per configured bucket."""
+        now = time.time()
+        rows = self._connection().execute("SELECT name, rate, penalized_at FROM buckets").fetchall()
+        current = {name: self._current_rate(name, rate, penalized_at, now)
+                   for name, rate, penalized_at in rows if name in self.limits}
+        return {name: round(current.get(name, limit[0]), 3) for name, limit in self.limits.items()}
+
+rate_limiter = UpstreamRateLimiter()
+
+register_collector("nutrivision_rate_limit_rate", "gauge", "Current adaptive request rate per upstream bucket.",
+                   ("name",), lambda: [((name,), rate) for name, rate in rate_limiter.rates().items()], shared=True)
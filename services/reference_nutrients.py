@@ -0,0 +1,98 @@
+import os
+import csv
+from typing import Dict, Optional
+from models.food import Nutrients
+from services.summary_cache import normalize_label
+
+# Optional CSV with extra or corrected rows: a `name` column plus the NUTRIENT_FIELDS
+# columns, per 100g (e.g. an export from USDA FoodData Central)
+REFERENCE_NUTRIENTS_PATH = os.getenv("REFERENCE_NUTRIENTS_PATH", "")
+
+# Generic per-100g values for common foods, approximated from USDA FoodData Central
+# (SR Legacy, raw unless the name says otherwise). Order follows NUTRIENT_FIELDS:
+# calories, protein, carbohydrates, fats, fiber, sugar.
+REFERENCE_NUTRIENTS = {
+    "apple": (52, 0.3, 13.8, 0.2, 2.4, 10.4),
+    "banana": (89, 1.1, 22.8, 0.3, 2.6, 12.2),
+    "beetroot": (43, 1.6, 9.6, 0.2, 2.8, 6.8),
+    "bell pepper": (31, 1.0, 6.0, 0.3, 2.1, 4.2),
+    "cabbage": (25, 1.3, 5.8, 0.1, 2.5, 3.2),
+    "capsicum": (31, 1.0, 6.0, 0.3, 2.1, 4.2),
+    "carrot": (41, 0.9, 9.6, 0.2, 2.8, 4.7),
+    "cauliflower": (25, 1.9, 5.0, 0.3, 2.0, 1.9),
+    "chilli pepper": (40, 1.9, 8.8, 0.4, 1.5, 5.3),
+    "corn": (86, 3.3, 18.7, 1.4, 2.0, 6.3),
+    "cucumber": (15, 0.7, 3.6, 0.1, 0.5, 1.7),
+    "eggplant": (25, 1.0, 5.9, 0.2, 3.0, 3.5),
+    "garlic": (149, 6.4, 33.1, 0.5, 2.1, 1.0),
+    "ginger": (80, 1.8, 17.8, 0.8, 2.0, 1.7),
+    "grapes": (69, 0.7, 18.1, 0.2, 0.9, 15.5),
+    "jalapeno": (29, 0.9, 6.5, 0.4, 2.8, 4.1),
+    "jalepeno": (29, 0.9, 6.5, 0.4, 2.8, 4.1),
+    "kiwi": (61, 1.1, 14.7, 0.5, 3.0, 9.0),
+    "lemon": (29, 1.1, 9.3, 0.3, 2.8, 2.5),
+    "lettuce": (15, 1.4, 2.9, 0.2, 1.3, 0.8),
+    "mango": (60, 0.8, 15.0, 0.4, 1.6, 13.7),
+    "onion": (40, 1.1, 9.3, 0.1, 1.7, 4.2),
+    "orange": (47, 0.9, 11.8, 0.1, 2.4, 9.4),
+    # The classifier's "paprika" is the sweet pepper, not the spice
+    "paprika": (31, 1.0, 6.0, 0.3, 2.1, 4.2),
+    "pear": (57, 0.4, 15.2, 0.1, 3.1, 9.8),
+    "peas": (81, 5.4, 14.5, 0.4, 5.7, 5.7),
+    "pineapple": (50, 0.5, 13.1, 0.1, 1.4, 9.9),
+    "pomegranate": (83, 1.7, 18.7, 1.2, 4.0, 13.7),
+    "potato": (77, 2.0, 17.5, 0.1, 2.2, 0.8),
+    "radish": (16, 0.7, 3.4, 0.1, 1.6, 1.9),
+    "raddish": (16, 0.7, 3.4, 0.1, 1.6, 1.9),
+    "soy beans": (446, 36.5, 30.2, 19.9, 9.3, 7.3),
+    "spinach": (23, 2.9, 3.6, 0.4, 2.2, 0.4),
+    "sweetcorn": (86, 3.3, 18.7, 1.4, 2.0, 6.3),
+    "sweetpotato": (86, 1.6, 20.1, 0.1, 3.0, 4.2),
+    "tomato": (18, 0.9, 3.9, 0.2, 1.2, 2.6),
+    "turnip": (28, 0.9, 6.4, 0.1, 1.8, 3.8),
+    "watermelon": (30, 0.6, 7.6, 0.2, 0.4, 6.2),
+    "avocado": (160, 2.0, 8.5, 14.7, 6.7, 0.7),
+    "strawberry": (32, 0.7, 7.7, 0.3, 2.0, 4.9),
+    "broccoli": (34, 2.8, 6.6, 0.4, 2.6, 1.7),
+    "white rice cooked": (130, 2.7, 28.2, 0.3, 0.4, 0.1),
+    "egg": (143, 12.6, 0.7, 9.5, 0.0, 0.4),
+    # Prepared foods among the Food-101 labels with a well-defined composition
+    "edamame": (121, 11.9, 8.9, 5.2, 5.2, 2.2),
+    "french fries": (312, 3.4, 41.4, 14.7, 3.8, 0.3),
+    "hummus": (166, 7.9, 14.3, 9.6, 6.0, 0.3),
+    "ice cream": (207, 3.5, 23.6, 11.0, 0.7, 21.2),
+    "cheesecake": (321, 5.5, 25.5, 22.5, 0.4, 21.8),
+    "pizza": (266, 11.4, 33.3, 9.7, 2.3, 3.6),
+    "grilled salmon": (206, 22.1, 0.0, 12.4, 0.0, 0.0),
+    "mussels": (86, 11.9, 3.7, 2.2, 0.0, 0.0),
+    "scallops": (69, 12.1, 3.2, 0.5, 0.0, 0.0),
+}
+
+_table: Optional[Dict[str, Nutrients]] = None
+
+def _load_csv(path: str) -> Dict[str, Nutrients]:
+    rows = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            key = normalize_label(row.get("name", ""))
+            if key:
+                rows[key] = Nutrients.from_dict(row)
+    return rows
+
+def get_reference_table() -> Dict[str, Nutrients]:
+    """Reference records keyed by normalized label, built on first use."""
+    global _table
+    if _table is None:
+        table = {normalize_label(name): Nutrients(values) for name, values in REFERENCE_NUTRIENTS.items()}
+        if REFERENCE_NUTRIENTS_PATH:
+            try:
+                table.update(_load_csv(REFERENCE_NUTRIENTS_PATH))
+            except (OSError, csv.Error) as e:
+                print(f"[WARNING] Could not load reference nutrients from {REFERENCE_NUTRIENTS_PATH}: {str(e)}")
+        print(f"[INFO] Loaded {len(table)} reference nutrient records")
+        _table = table
+    return _table
+
+def lookup_reference(food_item: str) -> Optional[Nutrients]:
+    """Per-100g reference values for a food name, or None."""
+    return get_reference_table().get(normalize_label(food_item))
@@ -0,0 +1,61 @@
+import time
+import inspect
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+@dataclass
+class Service:
+    name: str
+    start: Optional[Callable] = None
+    stop: Optional[Callable] = None
+    started: bool = False
+    startup_seconds: float = 0.0
+
+async def _call(func: Callable):
+    result = func()
+    if inspect.isawaitable(result):
+        await result
+
+class ServiceRegistry:
+    """
+    Process-wide services with start/stop hooks, driven by the FastAPI lifespan hook.
+
+    Services start in registration order and stop in reverse order. Anything not needed
+    to answer the first request (Gemini client, HTTP pools, database sessions) should be
+    registered with only a stop hook and created lazily on first use, so worker boot
+    stays fast. Hooks may be plain functions or coroutine functions.
+    """
+
+    def __init__(self):
+        self._services: Dict[str, Service] = {}
+
+    def register(self, name: str, start: Optional[Callable] = None, stop: Optional[Callable] = None):
+        self._services[name] = Service(name, start, stop)
+
+    async def start_all(self):
+        for service in self._services.values():
+            if service.start is not None:
+                started_at = time.perf_counter()
+                await _call(service.start)
+                service.startup_seconds = time.perf_counter() - started_at
+                print(f"[INFO] Started {service.name} in {service.startup_seconds:.2f}s")
+            service.started = True
+
+    async def stop_all(self):
+        for service in reversed(list(self._services.values())):
+            if not service.started:
+                continue
+            if service.stop is not None:
+                try:
+                    await _call(service.stop)
+                except Exception as e:
+                    print(f"[WARNING] Failed to stop {service.name}: {str(e)}")
+            service.started = False
+
+    def status(self) -> List[Dict]:
+        return [
+            {"name": service.name, "started": service.started, "startup_seconds": round(service.startup_seconds, 3)}
+            for service in self._services.values()
+        ]
+
+registry = ServiceRegistry()
@@ -0,0 +1,455 @@
+import os
+import re
+import sys
+import time
+import uuid
+import asyncio
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from services.gemini import NutritionSummary, GEMINI_BATCH_SIZE, generate_summary_async, generate_summaries_async
+from services.metrics import register_cache_stats, span
+from services.admission import admission
+
+# Cache config
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "cache/summaries.sqlite3")
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(30 * 24 * 60 * 60)))
+SUMMARY_CACHE_MEMORY_ENTRIES = int(os.getenv("SUMMARY_CACHE_MEMORY_ENTRIES", "2048"))
+# How long one worker may hold the generation lease for a key before others take over
+SUMMARY_LEASE_TTL = float(os.getenv("SUMMARY_LEASE_TTL", "45"))
+
+# Words that end in "s" but are already singular
+_INVARIANT_WORDS = {"hummus", "molasses", "grits", "swiss", "asparagus", "couscous", "citrus", "quinoa"}
+# Plurals of words whose singular ends in "ie" rather than "y"
+_IE_PLURALS = {"pies", "cookies", "brownies", "smoothies", "veggies", "hoagies", "rotis", "sarnies"}
+
+def _singularize(word: str) -> str:
+    if word in _INVARIANT_WORDS or len(word) <= 3:
+        return word
+    if word.endswith(("ss", "us")):
+        return word
+    if word in _IE_PLURALS:
+        return word[:-1]
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes", "zes", "sses")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+def normalize_label(label: str) -> str:
+    """
+    Maps equivalent spellings of a food label to one cache key:
+    "Apple_Pie", "apple pie " and "apple pies" all become "apple pie".
+    """
+    text = label.strip().lower().replace("_", " ").replace("-", " ")
+    words = re.sub(r"[^a-z0-9 ]+", " ", text).split()
+    if words:
+        words[-1] = _singularize(words[-1])
+    return " ".join(words)
+
+def _is_placeholder(summary: NutritionSummary) -> bool:
+    """Gemini fallbacks (unparseable responses) are never cached."""
+    return summary.summary == "N/A" and summary.health_rating == "Unknown"
+
+class SummaryCache:
+    """
+    Two-level cache for Gemini nutrition summaries keyed by normalized food label.
+
+    Level one is an in-process LRU. Level two is a SQLite database shared by all
+    gunicorn workers on the host. Concurrent misses for the same key are coalesced
+    into a single Gemini call: within a process through a shared task, and across
+    processes through a lease row in SQLite.
+
+    Async code uses the *_async methods, which run SQLite in a worker thread so lock
+    waits on the shared file never stall the event loop; the sync methods are for
+    scripts and threads.
+    """
+
+    def __init__(self, path: str = SUMMARY_CACHE_PATH, ttl: float = SUMMARY_CACHE_TTL,
+                 memory_entries: int = SUMMARY_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[NutritionSummary, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Detached batch generations, referenced until done so they are not collected
+        self._batches: Set[asyncio.Task] = set()
+        self._local = threading.local()
+        self._owner = uuid.uuid4().hex
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.generations = 0
+        self.batch_calls = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    # Lookups
+
+    def _memory_get(self, key: str) -> Optional[NutritionSummary]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        summary, expires_at = item
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return summary
+
+    def _memory_put(self, key: str, summary: NutritionSummary, expires_at: float):
+        self._memory[key] = (summary, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Tuple[NutritionSummary, float]]:
+        row = self._connection().execute(
+            "SELECT payload, created_at FROM summaries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        expires_at = row[1] + self.ttl
+        if expires_at < time.time():
+            return None
+        return NutritionSummary.model_validate_json(row[0]), expires_at
+
+    def get(self, food_item: str) -> Optional[NutritionSummary]:
+        """Returns a cached summary without ever calling Gemini."""
+        entry = self.get_entry(food_item)
+        return entry[0] if entry else None
+
+    def _memory_entry(self, key: str) -> Optional[Tuple[NutritionSummary, float]]:
+        summary = self._memory_get(key)
+        if summary is None:
+            return None
+        self.memory_hits += 1
+        return summary, self._memory[key][1] - self.ttl
+
+    def _disk_entry(self, key: str, item: Optional[Tuple[NutritionSummary, float]]):
+        if item is None:
+            return None
+        self.disk_hits += 1
+        self._memory_put(key, *item)
+        return item[0], item[1] - self.ttl
+
+    def get_entry(self, food_item: str) -> Optional[Tuple[NutritionSummary, float]]:
+        """Like get(), but also returns the time the summary was generated."""
+        key = normalize_label(food_item)
+        entry = self._memory_entry(key)
+        return entry if entry is not None else self._disk_entry(key, self._disk_get(key))
+
+    async def get_async(self, food_item: str) -> Optional[NutritionSummary]:
+        entry = await self.get_entry_async(food_item)
+        return entry[0] if entry else None
+
+    async def get_entry_async(self, food_item: str) -> Optional[Tuple[NutritionSummary, float]]:
+        """get_entry() for async code; only a memory miss goes to the SQLite tier, in a thread."""
+        key = normalize_label(food_item)
+        entry = self._memory_entry(key)
+        if entry is not None:
+            return entry
+        return self._disk_entry(key, await asyncio.to_thread(self._disk_get, key))
+
+    def _disk_put(self, key: str, payload: str, created_at: float):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO summaries (key, payload, created_at) VALUES (?, ?, ?)",
+            (key, payload, created_at),
+        )
+
+    def put(self, food_item: str, summary: NutritionSummary):
+        if _is_placeholder(summary):
+            return
+        key = normalize_label(food_item)
+        now = time.time()
+        self._disk_put(key, summary.model_dump_json(), now)
+        self._memory_put(key, summary, now + self.ttl)
+
+    async def put_async(self, food_item: str, summary: NutritionSummary):
+        if _is_placeholder(summary):
+            return
+        key = normalize_label(food_item)
+        now = time.time()
+        self._memory_put(key, summary, now + self.ttl)
+        await asyncio.to_thread(self._disk_put, key, summary.model_dump_json(), now)
+
+    # Generation with stampede protection
+
+    async def get_or_generate(self, food_item: str) -> NutritionSummary:
+        """
+        Returns the cached summary for `food_item`, generating it with Gemini on a miss.
+        Only one generation per key runs at a time, however many requests ask for it.
+        """
+        summary = await self.get_async(food_item)
+        if summary is not None:
+            return summary
+
+        key = normalize_label(food_item)
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._generate(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key) if self._inflight.get(key) is done else None)
+        else:
+            self.coalesced += 1
+
+        # Shield so a cancelled client does not abort the generation other requests wait on
+        return await asyncio.shield(task)
+
+    async def _generate(self, key: str) -> NutritionSummary:
+        deadline = time.time() + SUMMARY_LEASE_TTL
+        while not await asyncio.to_thread(self._acquire_lease, key):
+            # Another worker is generating this key; wait for its result to land in SQLite
+            await asyncio.sleep(0.1)
+            item = await asyncio.to_thread(self._disk_get, key)
+            if item is not None:
+                self._memory_put(key, *item)
+                return item[0]
+            if time.time() > deadline:
+                break
+
+        try:
+            self.generations += 1
+            summary = await generate_summary_async(key)
+            await self.put_async(key, summary)
+            return summary
+        finally:
+            await asyncio.to_thread(self._release_lease, key)
+
+    async def get_many(self, food_items: Iterable[str],
+                       priority: Optional[str] = None) -> Tuple[Dict[str, NutritionSummary], Dict[str, str]]:
+        """
+        Resolves several food items at once.
+
+        Items are deduplicated by normalized key and served from cache where possible.
+        Keys already being generated by another request are awaited rather than requested
+        again, and the remaining misses are packed into as few Gemini calls as possible.
+        With a `priority`, the misses wait for an admission slot of that class first.
+
+        Returns:
+            tuple: (summaries by normalized key, error messages by normalized key)
+        """
+        loop = asyncio.get_running_loop()
+        results: Dict[str, NutritionSummary] = {}
+        errors: Dict[str, str] = {}
+        pending: Dict[str, asyncio.Future] = {}
+        owned: List[str] = []
+
+        keys = [key for key in dict.fromkeys(normalize_label(item) for item in food_items) if key]
+        for key in keys:
+            summary = await self.get_async(key)
+            if summary is not None:
+                results[key] = summary
+        misses = [key for key in keys if key not in results]
+        if not misses:
+            return results, errors
+
+        async with admission.admit(priority) if priority else nullcontext():
+            for key in misses:
+                future = self._inflight.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                else:
+                    self.misses += 1
+                    future = loop.create_future()
+                    self._inflight[key] = future
+                    owned.append(key)
+                pending[key] = future
+
+            if owned:
+                # Runs detached so a disconnecting client does not strand other waiters
+                task = asyncio.ensure_future(self._generate_many(owned))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+            for key, future in pending.items():
+                try:
+                    results[key] = await asyncio.shield(future)
+                except Exception as e:
+                    errors[key] = str(e) or type(e).__name__
+
+        return results, errors
+
+    async def _generate_many(self, keys: List[str]):
+        futures = {key: self._inflight.get(key) for key in keys}
+        try:
+            leased = await asyncio.to_thread(lambda: [key for key in keys if self._acquire_lease(key)])
+            # Keys another worker is already generating go through the single-key wait path
+            others = [key for key in keys if key not in leased]
+
+            chunks = [leased[i:i + GEMINI_BATCH_SIZE] for i in range(0, len(leased), GEMINI_BATCH_SIZE)]
+            await asyncio.gather(
+                *(self._generate_chunk(chunk) for chunk in chunks),
+                *(self._settle_from(key, self._generate(key)) for key in others),
+            )
+        except BaseException as e:
+            # Never leave waiters hanging; only keys still holding this batch's future are settled
+            error = e if isinstance(e, Exception) else RuntimeError("Summary generation was interrupted")
+            for key, future in futures.items():
+                if future is not None and self._inflight.get(key) is future:
+                    self._settle(key, error=error)
+            if not isinstance(e, Exception):
+                raise
+            print(f"[WARNING] Batch summary generation failed: {str(e) or type(e).__name__}")
+
+    async def _generate_chunk(self, keys: List[str]):
+        try:
+            self.batch_calls += 1
+            summaries = await generate_summaries_async(keys)
+            dropped = []
+            for key in keys:
+                summary = summaries.get(key)
+                if summary is None:
+                    dropped.append(key)
+                    continue
+                await self.put_async(key, summary)
+                self._settle(key, result=summary)
+
+            # Gemini dropped these items from the batch; ask for each on its own, concurrently
+            self.generations += len(dropped)
+            fallbacks = await asyncio.gather(*(generate_summary_async(key) for key in dropped),
+                                             return_exceptions=True)
+            for key, summary in zip(dropped, fallbacks):
+                if isinstance(summary, BaseException):
+                    self._settle(key, error=summary)
+                else:
+                    await self.put_async(key, summary)
+                    self._settle(key, result=summary)
+        except Exception as e:
+            # Keys already settled above are left alone
+            for key in keys:
+                self._settle(key, error=e)
+        finally:
+            await asyncio.to_thread(lambda: [self._release_lease(key) for key in keys])
+
+    async def _settle_from(self, key: str, awaitable):
+        try:
+            self._settle(key, result=await awaitable)
+        except Exception as e:
+            self._settle(key, error=e)
+
+    def _settle(self, key: str, result: Optional[NutritionSummary] = None, error: Optional[Exception] = None):
+        future = self._inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _acquire_lease(self, key: str) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ?",
+            (key, self._owner, now + SUMMARY_LEASE_TTL, now),
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key: str):
+        self._connection().execute(
+            "DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner)
+        )
+
+    def keys(self) -> List[str]:
+        """All normalized labels currently stored in the shared cache."""
+        rows = self._connection().execute(
+            "SELECT key FROM summaries WHERE created_at >= ?", (time.time() - self.ttl,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "generations": self.generations,
+            "batch_calls": self.batch_calls,
+        }
+
+# Process-wide cache instance
+summary_cache = SummaryCache()
+
+register_cache_stats(lambda: {"summary": summary_cache.stats()})
+
+async def get_summary(food_item: str) -> NutritionSummary:
+    """Cached replacement for generate_summary_async."""
+    with span("summarize"):
+        return await summary_cache.get_or_generate(food_item)
+
+async def get_summaries(food_items: Iterable[str],
+                        priority: Optional[str] = None) -> Tuple[Dict[str, NutritionSummary], Dict[str, str]]:
+    """Cached, coalesced batch lookup; see SummaryCache.get_many."""
+    with span("summarize"):
+        return await summary_cache.get_many(food_items, priority)
+
+async def warm_cache(labels, concurrency: int = 4, force: bool = False) -> int:
+    """Generates summaries for every label not yet cached. Returns the number generated."""
+    semaphore = asyncio.Semaphore(concurrency)
+    generated = 0
+
+    async def warm(label: str):
+        nonlocal generated
+        if not force and await summary_cache.get_async(label) is not None:
+            return
+        async with semaphore:
+            try:
+                summary = await generate_summary_async(normalize_label(label))
+                await summary_cache.put_async(label, summary)
+                generated += 1
+                print(f"[INFO] Cached summary for '{normalize_label(label)}'")
+            except Exception as e:
+                print(f"[WARNING] Failed to warm '{label}': {e}")
+
+    await asyncio.gather(*(warm(label) for label in labels))
+    return generated
+
+def main(argv=None):
+    from services.labels import ALL_LABELS
+
+    parser = argparse.ArgumentParser(description="Manage the nutrition summary cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    warm_parser = subparsers.add_parser("warm", help="Pre-generate summaries for all classifier labels.")
+    warm_parser.add_argument("--concurrency", type=int, default=4)
+    warm_parser.add_argument("--force", action="store_true", help="Regenerate labels that are already cached.")
+    subparsers.add_parser("stats", help="Show the number of cached summaries.")
+    args = parser.parse_args(argv)
+
+    if args.command == "warm":
+        generated = asyncio.run(warm_cache(ALL_LABELS, args.concurrency, args.force))
+        print(f"[INFO] Generated {generated} summaries ({len(ALL_LABELS)} labels total)")
+    elif args.command == "stats":
+        count = summary_cache._connection().execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        print(f"{count} summaries cached in {summary_cache.path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
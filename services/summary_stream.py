@@ -0,0 +1,140 @@
+import re
+import json
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from services.gemini import NutritionSummary, stream_summary_async
+from services.openfoodfacts import get_nutrition_info_async
+from services.summary_cache import normalize_label, summary_cache
+from services.admission import admission
+
+# Free-text fields forwarded to the client while Gemini is still generating
+STREAMED_FIELDS = ("summary", "serving_notes")
+
+MACRO_FIELDS = ("calories", "protein", "carbohydrates", "fats", "fiber", "sugar")
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+def _decode_partial_string(text: str, start: int) -> Tuple[str, bool]:
+    """
+    Decodes a JSON string literal starting at `start` (just after the opening quote)
+    as far as the buffer allows. Returns (decoded text, whether the closing quote was seen).
+    An escape sequence cut off at the end of the buffer is left for the next chunk.
+    """
+    out = []
+    i = start
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            return "".join(out), True
+        if char == "\\":
+            if i + 1 >= len(text):
+                break
+            code = text[i + 1]
+            if code == "u":
+                if i + 6 > len(text):
+                    break
+                out.append(chr(int(text[i + 2:i + 6], 16)))
+                i += 6
+                continue
+            out.append(_ESCAPES.get(code, code))
+            i += 2
+            continue
+        out.append(char)
+        i += 1
+    return "".join(out), False
+
+class JsonFieldStreamer:
+    """
+    Extracts the growing values of selected string fields from a JSON document that
+    arrives in arbitrary chunks, so their text can be forwarded before the document
+    is complete.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self._patterns = {field: re.compile(rf'"{field}"\s*:\s*"') for field in fields}
+        self._starts: Dict[str, int] = {}
+        self._emitted: Dict[str, int] = {}
+        self._complete = set()
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Adds a chunk and returns the new (field, text) deltas it made available."""
+        self.buffer += chunk
+        deltas = []
+        for field, pattern in self._patterns.items():
+            if field in self._complete:
+                continue
+            if field not in self._starts:
+                match = pattern.search(self.buffer)
+                if match is None:
+                    continue
+                self._starts[field] = match.end()
+                self._emitted[field] = 0
+
+            value, complete = _decode_partial_string(self.buffer, self._starts[field])
+            if len(value) > self._emitted[field]:
+                deltas.append((field, value[self._emitted[field]:]))
+                self._emitted[field] = len(value)
+            if complete:
+                self._complete.add(field)
+        return deltas
+
+def format_event(event: str, data) -> str:
+    """Serializes one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _macros(summary: NutritionSummary) -> Dict[str, str]:
+    return {field: getattr(summary, field) for field in MACRO_FIELDS}
+
+async def _barcode_product(food_item: str) -> Optional[Dict]:
+    if not (food_item.isnumeric() and len(food_item) > 6):
+        return None
+    product = await get_nutrition_info_async(food_item)
+    return None if "error" in product else product
+
+async def stream_summary_events(food_item: str) -> AsyncIterator[str]:
+    """
+    Produces the SSE stream for a summary request:
+
+    - `label`: the resolved food label, immediately
+    - `macros`: cached or OpenFoodFacts nutrient values, as soon as they are known
+    - `delta`: pieces of the summary / serving_notes text while Gemini generates them
+    - `summary`: the final validated NutritionSummary
+    - `error`: if generation fails or the server is overloaded
+    """
+    label = food_item
+    product = await _barcode_product(food_item)
+    if product is not None:
+        label = product["name"]
+
+    yield format_event("label", {"food_item": label, "key": normalize_label(label)})
+
+    if product is not None:
+        yield format_event("macros", {
+            "source": "openfoodfacts",
+            "calories": product["calories"],
+            "protein": product["protein"],
+            "fats": product["fats"],
+            "carbohydrates": product["carbs"],
+        })
+
+    cached = await summary_cache.get_async(label)
+    if cached is not None:
+        yield format_event("macros", {"source": "cache", **_macros(cached)})
+        yield format_event("summary", cached.model_dump())
+        return
+
+    streamer = JsonFieldStreamer(STREAMED_FIELDS)
+    try:
+        # Headers are already sent, so running out of capacity is reported as an error event
+        async with admission.admit("high"):
+            async for chunk in stream_summary_async(label):
+                for field, text in streamer.feed(chunk):
+                    yield format_event("delta", {"field": field, "text": text})
+
+        summary = NutritionSummary.model_validate_json(streamer.buffer)
+    except Exception as e:
+        yield format_event("error", {"detail": f"An error occurred: {str(e)}"})
+        return
+
+    await summary_cache.put_async(label, summary)
+    yield format_event("summary", summary.model_dump())